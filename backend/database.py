@@ -1,4 +1,8 @@
-from sqlmodel import SQLModel, create_engine, Session
+from sqlmodel import create_engine, Session
+from sqlalchemy import event, inspect
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 import os
 sqlite_file_name = os.getenv("DATABASE_PATH", "ledger.db")
@@ -9,12 +13,88 @@ if not os.path.isabs(sqlite_file_name):
 sqlite_url = f"sqlite:///{sqlite_file_name}"
 print(f"📦 Using database at: {sqlite_url}")
 
-connect_args = {"check_same_thread": False}
-engine = create_engine(sqlite_url, echo=False, connect_args=connect_args)
+# SQLite 存储配置：调度线程、请求线程池和后台任务共用一个数据库文件，
+# WAL 让读写互不阻塞，busy_timeout 让写冲突等待而不是立即报 "database is locked"
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", str(64 * 1024)))
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "10"))
+SQLITE_POOL_MAX_OVERFLOW = int(os.getenv("SQLITE_POOL_MAX_OVERFLOW", "10"))
+SQLITE_POOL_TIMEOUT = float(os.getenv("SQLITE_POOL_TIMEOUT", "30"))
+
+connect_args = {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}
+engine = create_engine(
+    sqlite_url,
+    echo=False,
+    connect_args=connect_args,
+    poolclass=QueuePool,
+    pool_size=SQLITE_POOL_SIZE,
+    max_overflow=SQLITE_POOL_MAX_OVERFLOW,
+    pool_timeout=SQLITE_POOL_TIMEOUT,
+)
+
+# 异步引擎（aiosqlite）：async 请求处理函数和 get_current_user 使用，查询期间不阻塞事件循环。
+# 与同步引擎共用数据库文件和存储配置；调度器、快照重建等同步代码继续使用 engine
+async_engine = create_async_engine(
+    f"sqlite+aiosqlite:///{sqlite_file_name}",
+    echo=False,
+    connect_args={"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=SQLITE_POOL_SIZE,
+    max_overflow=SQLITE_POOL_MAX_OVERFLOW,
+    pool_timeout=SQLITE_POOL_TIMEOUT,
+)
+
+@event.listens_for(engine, "connect")
+@event.listens_for(async_engine.sync_engine, "connect")
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """每个新连接上应用存储配置"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    # 负数表示以 KiB 为单位
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    cursor.close()
+
+ALEMBIC_INI = os.path.join(os.path.dirname(__file__), "alembic.ini")
+# 在引入迁移之前由 create_all 建出的数据库，对应的基线版本
+BASELINE_REVISION = "0001"
+
+def _alembic_config():
+    from alembic.config import Config
+    config = Config(ALEMBIC_INI)
+    config.set_main_option("script_location", os.path.join(os.path.dirname(__file__), "migrations"))
+    return config
+
+def run_migrations(bind=None, revision: str = "head"):
+    """
+    把数据库升级到指定版本（默认最新）。
+    没有 alembic_version 表但已有 user 表的旧数据库先标记为基线版本，再执行后续迁移。
+    """
+    from alembic import command
+
+    bind = bind if bind is not None else engine
+    config = _alembic_config()
+    with bind.begin() as connection:
+        config.attributes["connection"] = connection
+        tables = set(inspect(connection).get_table_names())
+        if "alembic_version" not in tables and "user" in tables:
+            command.stamp(config, BASELINE_REVISION)
+            print(f"📌 Existing database stamped at migration {BASELINE_REVISION}")
+        command.upgrade(config, revision)
 
 def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+    run_migrations()
 
 def get_session():
     with Session(engine) as session:
         yield session
+
+async def get_async_session():
+    # 提交后不过期，返回的对象在会话关闭后仍可读取（如 get_current_user 返回的 User）
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
@@ -45,11 +45,13 @@ def health_check():
 from routers import stocks, quotes, transactions, portfolio, users, external
 from database import create_db_and_tables
 from services.scheduler import start_scheduler, stop_scheduler
+from services.crypto import install_reload_signal_handler
 
 @app.on_event("startup")
 def on_startup():
     create_db_and_tables()
     start_scheduler()  # 启动定时任务
+    install_reload_signal_handler()  # SIGHUP 重新加载 RSA 密钥
     print("✅ Application started with background scheduler")
 
 @app.on_event("shutdown")
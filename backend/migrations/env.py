@@ -0,0 +1,46 @@
+from logging.config import fileConfig
+
+from alembic import context
+from sqlmodel import SQLModel
+
+import models  # noqa: F401  registers every table on SQLModel.metadata
+
+config = context.config
+if config.config_file_name is not None and config.attributes.get("connection") is None:
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+target_metadata = SQLModel.metadata
+
+
+def _configure(**kwargs):
+    # SQLite 不支持大部分 ALTER TABLE，用 batch 模式重建表
+    context.configure(target_metadata=target_metadata, render_as_batch=True, **kwargs)
+
+
+def run_migrations_offline():
+    from database import sqlite_url
+    _configure(url=sqlite_url, literal_binds=True, dialect_opts={"paramstyle": "named"})
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    # database.run_migrations() passes its own connection; the CLI uses the app engine
+    connection = config.attributes.get("connection")
+    if connection is not None:
+        _configure(connection=connection)
+        with context.begin_transaction():
+            context.run_migrations()
+        return
+
+    from database import engine
+    with engine.connect() as connection:
+        _configure(connection=connection)
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
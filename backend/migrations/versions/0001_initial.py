@@ -0,0 +1,103 @@
+"""initial schema (tables created by create_all before migrations existed)
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-16
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "user",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("email", sa.String(), nullable=False),
+        sa.Column("hashed_password", sa.String(), nullable=False),
+        sa.Column("is_active", sa.Boolean(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_user_email", "user", ["email"], unique=True)
+
+    op.create_table(
+        "stock",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("symbol", sa.String(), nullable=False),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("market", sa.String(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(["user_id"], ["user.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_stock_user_id", "stock", ["user_id"])
+    op.create_index("ix_stock_symbol", "stock", ["symbol"])
+
+    op.create_table(
+        "transaction",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("stock_id", sa.Integer(), nullable=False),
+        sa.Column("type", sa.String(), nullable=False),
+        sa.Column("date", sa.String(), nullable=False),
+        sa.Column("price", sa.Float(), nullable=False),
+        sa.Column("quantity", sa.Float(), nullable=False),
+        sa.Column("fees", sa.Float(), nullable=False),
+        sa.Column("notes", sa.String(), nullable=True),
+        sa.ForeignKeyConstraint(["stock_id"], ["stock.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+
+    op.create_table(
+        "dailyquote",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("stock_id", sa.Integer(), nullable=False),
+        sa.Column("date", sa.String(), nullable=False),
+        sa.Column("open", sa.Float(), nullable=False),
+        sa.Column("close", sa.Float(), nullable=False),
+        sa.Column("high", sa.Float(), nullable=False),
+        sa.Column("low", sa.Float(), nullable=False),
+        sa.Column("volume", sa.Integer(), nullable=False),
+        sa.Column("is_manual", sa.Boolean(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_dailyquote_stock_id", "dailyquote", ["stock_id"])
+
+    op.create_table(
+        "assetsnapshot",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("stock_id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("date", sa.String(), nullable=False),
+        sa.Column("holdings_qty", sa.Float(), nullable=False),
+        sa.Column("cost_basis_fifo", sa.Float(), nullable=False),
+        sa.Column("total_cost", sa.Float(), nullable=False),
+        sa.Column("market_value", sa.Float(), nullable=False),
+        sa.Column("daily_pnl", sa.Float(), nullable=False),
+        sa.Column("total_pnl", sa.Float(), nullable=False),
+        sa.Column("realized_pnl", sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(["stock_id"], ["stock.id"]),
+        sa.ForeignKeyConstraint(["user_id"], ["user.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_assetsnapshot_user_id", "assetsnapshot", ["user_id"])
+
+    op.create_table(
+        "systemconfig",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("key", sa.String(), nullable=False),
+        sa.Column("value", sa.String(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_systemconfig_key", "systemconfig", ["key"], unique=True)
+
+
+def downgrade():
+    for table in ("systemconfig", "assetsnapshot", "dailyquote", "transaction", "stock", "user"):
+        op.drop_table(table)
@@ -0,0 +1,204 @@
+"""shared market data: marketquote, history cache, calendar, snapshot checkpoints
+
+Replaces the ad-hoc upgrade steps that used to run in database.create_db_and_tables().
+Databases created between those releases may already have some of these tables,
+so every step checks the current schema first. Downgrading copies the shared quotes
+back to per-stock dailyquote rows; canonicalized stock symbols are kept.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-16
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def _tables():
+    return set(sa.inspect(op.get_bind()).get_table_names())
+
+
+def _indexes(table):
+    return {ix["name"] for ix in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def _create_assetsnapshot():
+    op.create_table(
+        "assetsnapshot",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("stock_id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("date", sa.String(), nullable=False),
+        sa.Column("close", sa.Float(), nullable=False),
+        sa.Column("holdings_qty", sa.Float(), nullable=False),
+        sa.Column("cost_basis_fifo", sa.Float(), nullable=False),
+        sa.Column("total_cost", sa.Float(), nullable=False),
+        sa.Column("market_value", sa.Float(), nullable=False),
+        sa.Column("daily_pnl", sa.Float(), nullable=False),
+        sa.Column("total_pnl", sa.Float(), nullable=False),
+        sa.Column("realized_pnl", sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(["stock_id"], ["stock.id"]),
+        sa.ForeignKeyConstraint(["user_id"], ["user.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_assetsnapshot_stock_id", "assetsnapshot", ["stock_id"])
+    op.create_index("ix_assetsnapshot_user_id", "assetsnapshot", ["user_id"])
+    op.create_index("ix_assetsnapshot_date", "assetsnapshot", ["date"])
+
+
+def _bar_columns():
+    return [
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("market", sa.String(), nullable=False),
+        sa.Column("symbol", sa.String(), nullable=False),
+        sa.Column("date", sa.String(), nullable=False),
+        sa.Column("open", sa.Float(), nullable=False),
+        sa.Column("close", sa.Float(), nullable=False),
+        sa.Column("high", sa.Float(), nullable=False),
+        sa.Column("low", sa.Float(), nullable=False),
+        sa.Column("volume", sa.Integer(), nullable=False),
+    ]
+
+
+def _normalize_symbol(symbol, market):
+    # 迁移时的规范化规则（与当时的 services/quote_store.normalize_symbol 一致），
+    # 内联在这里，之后修改应用代码不会改变本迁移的行为
+    symbol = str(symbol).strip().upper()
+    if market == "CN" and symbol.isdigit():
+        symbol = symbol.zfill(6)
+    return symbol
+
+
+def upgrade():
+    conn = op.get_bind()
+    tables = _tables()
+
+    # AssetSnapshot 是可重建的派生数据（旧版本从未写入），缺少 close 列时直接按新结构重建
+    columns = {c["name"] for c in sa.inspect(conn).get_columns("assetsnapshot")}
+    if "close" not in columns:
+        legacy_rows = conn.execute(sa.text("SELECT COUNT(*) FROM assetsnapshot")).scalar()
+        op.drop_table("assetsnapshot")
+        _create_assetsnapshot()
+        if legacy_rows:
+            print("♻️ Dropped legacy assetsnapshot table, snapshots will be rebuilt")
+
+    if "marketquote" not in tables:
+        op.create_table(
+            "marketquote",
+            *_bar_columns(),
+            sa.Column("updated_at", sa.DateTime(), nullable=False),
+            sa.PrimaryKeyConstraint("id"),
+            sa.UniqueConstraint("market", "symbol", "date"),
+        )
+    if "historybar" not in tables:
+        op.create_table(
+            "historybar",
+            *_bar_columns(),
+            sa.PrimaryKeyConstraint("id"),
+            sa.UniqueConstraint("market", "symbol", "date"),
+        )
+    if "historysync" not in tables:
+        op.create_table(
+            "historysync",
+            sa.Column("market", sa.String(), nullable=False),
+            sa.Column("symbol", sa.String(), nullable=False),
+            sa.Column("last_synced_date", sa.String(), nullable=True),
+            sa.Column("synced_at", sa.DateTime(), nullable=False),
+            sa.PrimaryKeyConstraint("market", "symbol"),
+        )
+    if "marketholiday" not in tables:
+        op.create_table(
+            "marketholiday",
+            sa.Column("market", sa.String(), nullable=False),
+            sa.Column("date", sa.String(), nullable=False),
+            sa.Column("name", sa.String(), nullable=True),
+            sa.PrimaryKeyConstraint("market", "date"),
+        )
+    if "snapshotcheckpoint" not in tables:
+        op.create_table(
+            "snapshotcheckpoint",
+            sa.Column("stock_id", sa.Integer(), nullable=False),
+            sa.Column("dirty_from", sa.String(), nullable=True),
+            sa.Column("updated_at", sa.DateTime(), nullable=False),
+            sa.ForeignKeyConstraint(["stock_id"], ["stock.id"]),
+            sa.PrimaryKeyConstraint("stock_id"),
+        )
+
+    # 旧版本按 stock_id 保存所有行情：把非手动行情去重后迁入共享的 marketquote 表，
+    # 同一 (market, symbol, date) 保留最后写入的一行；手动行情保留为用户级覆盖
+    # Stock rows must use the canonical symbol to match the shared key, whether or not
+    # they have quotes to migrate: the scheduler writes marketquote under the canonical key
+    for stock_id, symbol, market in conn.execute(sa.text("SELECT id, symbol, market FROM stock")).all():
+        canonical = _normalize_symbol(symbol, market)
+        if canonical != symbol:
+            conn.execute(sa.text("UPDATE stock SET symbol = :symbol WHERE id = :id"), {"symbol": canonical, "id": stock_id})
+
+    pending = conn.execute(sa.text("SELECT COUNT(*) FROM dailyquote WHERE is_manual = 0")).scalar()
+    if pending:
+        conn.execute(sa.text("""
+            INSERT OR IGNORE INTO marketquote (market, symbol, date, open, close, high, low, volume, updated_at)
+            SELECT s.market, s.symbol, q.date, q.open, q.close, q.high, q.low, q.volume, CURRENT_TIMESTAMP
+            FROM dailyquote q JOIN stock s ON s.id = q.stock_id
+            WHERE q.id IN (
+                SELECT MAX(q2.id) FROM dailyquote q2 JOIN stock s2 ON s2.id = q2.stock_id
+                WHERE q2.is_manual = 0
+                GROUP BY s2.market, s2.symbol, q2.date
+            )
+        """))
+        conn.execute(sa.text("DELETE FROM dailyquote WHERE is_manual = 0"))
+        # 去重后的行情可能与原来的不同，快照全部重建
+        conn.execute(sa.text("DELETE FROM snapshotcheckpoint"))
+        print(f"♻️ Migrated {pending} per-stock quotes into the shared marketquote table")
+
+    # 旧表没有 (stock_id, date) 唯一索引：保留每天最后写入的一行后补建索引
+    if "ix_dailyquote_stock_id_date" not in _indexes("dailyquote"):
+        had_quotes = conn.execute(sa.text("SELECT COUNT(*) FROM dailyquote")).scalar()
+        removed = conn.execute(sa.text(
+            "DELETE FROM dailyquote WHERE id NOT IN (SELECT MAX(id) FROM dailyquote GROUP BY stock_id, date)"
+        )).rowcount
+        op.create_index("ix_dailyquote_stock_id_date", "dailyquote", ["stock_id", "date"], unique=True)
+        if removed:
+            conn.execute(sa.text("DELETE FROM snapshotcheckpoint"))
+        if had_quotes:
+            print(f"♻️ Added unique (stock_id, date) index to dailyquote, removed {removed} duplicate rows")
+
+
+def downgrade():
+    conn = op.get_bind()
+
+    # 共享行情复制回每个持有者的 dailyquote（非手动行）；已有手动覆盖的日期保留覆盖
+    conn.execute(sa.text("""
+        INSERT INTO dailyquote (stock_id, date, open, close, high, low, volume, is_manual)
+        SELECT s.id, m.date, m.open, m.close, m.high, m.low, m.volume, 0
+        FROM marketquote m JOIN stock s ON s.market = m.market AND s.symbol = m.symbol
+        WHERE NOT EXISTS (SELECT 1 FROM dailyquote q WHERE q.stock_id = s.id AND q.date = m.date)
+    """))
+    op.drop_index("ix_dailyquote_stock_id_date", table_name="dailyquote")
+
+    for table in ("snapshotcheckpoint", "marketholiday", "historysync", "historybar", "marketquote"):
+        op.drop_table(table)
+
+    # 快照是派生数据，按 0001 的旧结构重建空表即可
+    op.drop_table("assetsnapshot")
+    op.create_table(
+        "assetsnapshot",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("stock_id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("date", sa.String(), nullable=False),
+        sa.Column("holdings_qty", sa.Float(), nullable=False),
+        sa.Column("cost_basis_fifo", sa.Float(), nullable=False),
+        sa.Column("total_cost", sa.Float(), nullable=False),
+        sa.Column("market_value", sa.Float(), nullable=False),
+        sa.Column("daily_pnl", sa.Float(), nullable=False),
+        sa.Column("total_pnl", sa.Float(), nullable=False),
+        sa.Column("realized_pnl", sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(["stock_id"], ["stock.id"]),
+        sa.ForeignKeyConstraint(["user_id"], ["user.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_assetsnapshot_user_id", "assetsnapshot", ["user_id"])
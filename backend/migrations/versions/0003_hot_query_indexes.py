@@ -0,0 +1,45 @@
+"""composite indexes for the hot queries
+
+- transaction (stock_id, date): every position rebuild and the transaction list
+  filter by stock_id and order/cut by date
+- assetsnapshot (stock_id, date): latest-snapshot lookups, incremental rebuilds
+  and the portfolio history window
+- stock (market, symbol): scheduler grouping and mark_symbols_dirty lookups
+- the single-column stock_id/date indexes are prefixes of the new ones (or of
+  ix_dailyquote_stock_id_date) and are dropped
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-16
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def _drop_index_if_exists(name, table):
+    if name in {ix["name"] for ix in sa.inspect(op.get_bind()).get_indexes(table)}:
+        op.drop_index(name, table_name=table)
+
+
+def upgrade():
+    op.create_index("ix_transaction_stock_id_date", "transaction", ["stock_id", "date"])
+    op.create_index("ix_assetsnapshot_stock_id_date", "assetsnapshot", ["stock_id", "date"])
+    op.create_index("ix_stock_market_symbol", "stock", ["market", "symbol"])
+
+    _drop_index_if_exists("ix_assetsnapshot_stock_id", "assetsnapshot")
+    _drop_index_if_exists("ix_assetsnapshot_date", "assetsnapshot")
+    _drop_index_if_exists("ix_dailyquote_stock_id", "dailyquote")
+
+
+def downgrade():
+    op.create_index("ix_dailyquote_stock_id", "dailyquote", ["stock_id"])
+    op.create_index("ix_assetsnapshot_date", "assetsnapshot", ["date"])
+    op.create_index("ix_assetsnapshot_stock_id", "assetsnapshot", ["stock_id"])
+    op.drop_index("ix_stock_market_symbol", table_name="stock")
+    op.drop_index("ix_assetsnapshot_stock_id_date", table_name="assetsnapshot")
+    op.drop_index("ix_transaction_stock_id_date", table_name="transaction")
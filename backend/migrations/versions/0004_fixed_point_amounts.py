@@ -0,0 +1,57 @@
+"""store prices, amounts and quantities as fixed-point int64
+
+Prices and money amounts become integer micro-units (x 1_000_000), quantities
+integer milli-shares (x 1_000); see services/fixed_point.py. Existing REAL values
+are rounded to the nearest unit.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-16
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+PRICE_SCALE = 1_000_000
+QTY_SCALE = 1_000
+
+PRICE_COLUMNS = ("open", "close", "high", "low")
+COLUMNS = {
+    "transaction": {"price": PRICE_SCALE, "quantity": QTY_SCALE, "fees": PRICE_SCALE},
+    "marketquote": {c: PRICE_SCALE for c in PRICE_COLUMNS},
+    "dailyquote": {c: PRICE_SCALE for c in PRICE_COLUMNS},
+    "assetsnapshot": {
+        "close": PRICE_SCALE,
+        "holdings_qty": QTY_SCALE,
+        "cost_basis_fifo": PRICE_SCALE,
+        "total_cost": PRICE_SCALE,
+        "market_value": PRICE_SCALE,
+        "daily_pnl": PRICE_SCALE,
+        "total_pnl": PRICE_SCALE,
+        "realized_pnl": PRICE_SCALE,
+    },
+}
+
+
+def upgrade():
+    conn = op.get_bind()
+    for table, columns in COLUMNS.items():
+        assignments = ", ".join(f'"{c}" = CAST(ROUND("{c}" * {scale}) AS INTEGER)' for c, scale in columns.items())
+        conn.execute(sa.text(f'UPDATE "{table}" SET {assignments}'))
+        with op.batch_alter_table(table) as batch:
+            for column in columns:
+                batch.alter_column(column, existing_type=sa.Float(), type_=sa.BigInteger(), existing_nullable=False)
+
+
+def downgrade():
+    conn = op.get_bind()
+    for table, columns in COLUMNS.items():
+        with op.batch_alter_table(table) as batch:
+            for column in columns:
+                batch.alter_column(column, existing_type=sa.BigInteger(), type_=sa.Float(), existing_nullable=False)
+        assignments = ", ".join(f'"{c}" = "{c}" * 1.0 / {scale}' for c, scale in columns.items())
+        conn.execute(sa.text(f'UPDATE "{table}" SET {assignments}'))
@@ -0,0 +1,30 @@
+"""ttlentry table for the shared TTL store (verification codes, used nonces)
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-16
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "ttlentry",
+        sa.Column("namespace", sa.String(), nullable=False),
+        sa.Column("key", sa.String(), nullable=False),
+        sa.Column("value", sa.String(), nullable=False),
+        sa.Column("expires_at", sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint("namespace", "key"),
+    )
+    op.create_index("ix_ttlentry_expires_at", "ttlentry", ["expires_at"])
+
+
+def downgrade():
+    op.drop_index("ix_ttlentry_expires_at", table_name="ttlentry")
+    op.drop_table("ttlentry")
@@ -1,6 +1,9 @@
 from typing import Optional, List
 from sqlmodel import Field, SQLModel, Relationship
+from pydantic import field_validator
+from sqlalchemy import Index, UniqueConstraint
 from datetime import datetime
+from services.fixed_point import FixedPoint, PRICE_SCALE, QTY_SCALE, check_precision
 
 class User(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
@@ -13,6 +16,8 @@ class User(SQLModel, table=True):
     stocks: List["Stock"] = Relationship(back_populates="user")
 
 class Stock(SQLModel, table=True):
+    # (market, symbol) 是共享行情的关联键，调度器和 mark_symbols_dirty 按它分组/查找持仓
+    __table_args__ = (Index("ix_stock_market_symbol", "market", "symbol"),)
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="user.id", index=True)
     symbol: str = Field(index=True) # Removed unique here to allow same symbol for different users
@@ -24,43 +29,149 @@ class Stock(SQLModel, table=True):
     user: Optional[User] = Relationship(back_populates="stocks")
 
 class Transaction(SQLModel, table=True):
+    # 所有热点查询都按 stock_id 过滤、按 date 排序或截断
+    __table_args__ = (Index("ix_transaction_stock_id_date", "stock_id", "date"),)
+    # 价格、数量、费用以定点整数保存（services/fixed_point.py），API 中仍是十进制数
     id: Optional[int] = Field(default=None, primary_key=True)
     stock_id: int = Field(foreign_key="stock.id")
     type: str # BUY, SELL, DIVIDEND
     date: str
+    price: float = Field(sa_type=FixedPoint(PRICE_SCALE))
+    quantity: float = Field(sa_type=FixedPoint(QTY_SCALE))
+    fees: float = Field(sa_type=FixedPoint(PRICE_SCALE))
+    notes: Optional[str] = None
+
+class TransactionCreate(SQLModel):
+    # 请求体模型：表模型构造时不执行校验，超出定点精度的输入在这里拒绝（422），而不是写库时被舍入
+    type: str
+    date: str
     price: float
     quantity: float
     fees: float
     notes: Optional[str] = None
 
-class DailyQuote(SQLModel, table=True):
+    @field_validator("price", "fees")
+    @classmethod
+    def _price_precision(cls, v):
+        return check_precision(v, PRICE_SCALE)
+
+    @field_validator("quantity")
+    @classmethod
+    def _quantity_precision(cls, v):
+        return check_precision(v, QTY_SCALE)
+
+class TransactionUpdate(TransactionCreate):
+    # 只更新请求中出现的字段；stock_id 用于把交易移到同一用户的另一只股票
+    stock_id: Optional[int] = None
+    type: Optional[str] = None
+    date: Optional[str] = None
+    price: Optional[float] = None
+    quantity: Optional[float] = None
+    fees: Optional[float] = None
+
+class MarketQuote(SQLModel, table=True):
+    # Shared daily bars: one row per (market, symbol, date) however many users hold the stock.
+    # Stock rows reference it through their (market, symbol) pair.
+    __table_args__ = (UniqueConstraint("market", "symbol", "date"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    market: str
+    symbol: str
+    date: str
+    open: float = Field(sa_type=FixedPoint(PRICE_SCALE))
+    close: float = Field(sa_type=FixedPoint(PRICE_SCALE))
+    high: float = Field(sa_type=FixedPoint(PRICE_SCALE))
+    low: float = Field(sa_type=FixedPoint(PRICE_SCALE))
+    volume: int
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class MarketHoliday(SQLModel, table=True):
+    # Exchange holidays consulted by services/trading_calendar.py (weekends are implicit)
+    market: str = Field(primary_key=True)
+    date: str = Field(primary_key=True)
+    name: Optional[str] = None
+
+class HistoryBar(SQLModel, table=True):
+    # Provider daily history cache (services/history_cache.py), appended incrementally.
+    __table_args__ = (UniqueConstraint("market", "symbol", "date"),)
     id: Optional[int] = Field(default=None, primary_key=True)
-    stock_id: int = Field(index=True) # Remove foreign key to keep market quotes shared even if stock is deleted by one user
-    # Actually, keep it for now but be careful.
-    # To keep it simple, market quotes remain tied to a stock record.
-    # But if two users have the same stock symbol, do we share quotes? 
-    # For now, let's keep them separate per user stock record to avoid complex sharing logic.
+    market: str
+    symbol: str
     date: str
     open: float
     close: float
     high: float
     low: float
     volume: int
+
+class HistorySync(SQLModel, table=True):
+    # Sync state per symbol: last closed bar stored in HistoryBar and when we last asked the provider
+    market: str = Field(primary_key=True)
+    symbol: str = Field(primary_key=True)
+    last_synced_date: Optional[str] = None
+    synced_at: datetime = Field(default_factory=datetime.utcnow)
+
+class DailyQuote(SQLModel, table=True):
+    # Per-user manual overrides layered on top of MarketQuote (see services/quote_store.py).
+    # Market data fetched by the scheduler lives in MarketQuote, never here.
+    __table_args__ = (Index("ix_dailyquote_stock_id_date", "stock_id", "date", unique=True),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    stock_id: int
+    date: str
+    open: float = Field(sa_type=FixedPoint(PRICE_SCALE))
+    close: float = Field(sa_type=FixedPoint(PRICE_SCALE))
+    high: float = Field(sa_type=FixedPoint(PRICE_SCALE))
+    low: float = Field(sa_type=FixedPoint(PRICE_SCALE))
+    volume: int
     is_manual: bool = Field(default=False)
 
+class DailyQuoteInput(SQLModel):
+    # 手动行情的请求体，价格同样拒绝超出定点精度的输入；已有行情时未填写的字段沿用原值
+    stock_id: int
+    date: str
+    close: float
+    open: Optional[float] = None
+    high: Optional[float] = None
+    low: Optional[float] = None
+    volume: Optional[int] = None
+
+    @field_validator("close", "open", "high", "low")
+    @classmethod
+    def _price_precision(cls, v):
+        return check_precision(v, PRICE_SCALE)
+
 class AssetSnapshot(SQLModel, table=True):
+    # Derived per-stock, per-day state written by services/snapshots.py.
+    # Safe to drop and rebuild at any time from Transaction + quotes.
+    __table_args__ = (Index("ix_assetsnapshot_stock_id_date", "stock_id", "date"),)
     id: Optional[int] = Field(default=None, primary_key=True)
     stock_id: int = Field(foreign_key="stock.id")
     # user_id added for faster portfolio stats
     user_id: int = Field(default=0, foreign_key="user.id", index=True) 
     date: str
-    holdings_qty: float
-    cost_basis_fifo: float
-    total_cost: float
-    market_value: float
-    daily_pnl: float
-    total_pnl: float
-    realized_pnl: float
+    close: float = Field(sa_type=FixedPoint(PRICE_SCALE))
+    holdings_qty: float = Field(sa_type=FixedPoint(QTY_SCALE))
+    cost_basis_fifo: float = Field(sa_type=FixedPoint(PRICE_SCALE)) # Accounting cost basis (see PortfolioAnalyzer)
+    total_cost: float = Field(sa_type=FixedPoint(PRICE_SCALE))
+    market_value: float = Field(sa_type=FixedPoint(PRICE_SCALE))
+    daily_pnl: float = Field(sa_type=FixedPoint(PRICE_SCALE))
+    total_pnl: float = Field(sa_type=FixedPoint(PRICE_SCALE))
+    realized_pnl: float = Field(sa_type=FixedPoint(PRICE_SCALE))
+
+class SnapshotCheckpoint(SQLModel, table=True):
+    # One row per stock. dirty_from is the earliest date whose AssetSnapshot rows
+    # are stale; None means snapshots are up to date. A missing row means the
+    # stock has never been snapshotted and needs a full rebuild.
+    stock_id: int = Field(primary_key=True, foreign_key="stock.id")
+    dirty_from: Optional[str] = None
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class TTLEntry(SQLModel, table=True):
+    # Short-lived shared state for services/ttl_store.py (verification codes, used nonces),
+    # visible to every worker process using the same database file.
+    namespace: str = Field(primary_key=True)
+    key: str = Field(primary_key=True)
+    value: str  # JSON
+    expires_at: float = Field(index=True)  # unix time
 
 class SystemConfig(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
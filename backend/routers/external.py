@@ -1,26 +1,48 @@
-from fastapi import APIRouter, Header, HTTPException, Depends
-from typing import Optional
+from fastapi import APIRouter, Header, HTTPException, Depends, status
+from pydantic import BaseModel
+from typing import List, Optional
+import asyncio
 import os
-from sqlmodel import Session, select
-from database import get_session
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from database import get_async_session
 from models import SystemConfig, User
 from services.market_data import fetch_diagnosis_data
 from services.auth import get_current_user
+from services.worker_pool import WorkerPool, WorkerPoolBusy
 from datetime import datetime
 
 router = APIRouter(prefix="/api/external", tags=["external"])
 
-@router.get("/diagnosis/{symbol}")
-async def get_stock_diagnosis(
-    symbol: str, 
+# 批量诊断的代码数上限与并发度
+DIAGNOSIS_BATCH_MAX = int(os.getenv("DIAGNOSIS_BATCH_MAX", "50"))
+DIAGNOSIS_BATCH_CONCURRENCY = int(os.getenv("DIAGNOSIS_BATCH_CONCURRENCY", "8"))
+# 诊断抓取专用线程池：上游限流时线程会在 ProviderLimiter 中等待，不能占用同步路由共用的 anyio 线程池
+DIAGNOSIS_WORKERS = int(os.getenv("DIAGNOSIS_WORKERS", "8"))
+DIAGNOSIS_MAX_PENDING = int(os.getenv("DIAGNOSIS_MAX_PENDING", "200"))
+
+diagnosis_pool = WorkerPool("diagnosis", DIAGNOSIS_WORKERS, DIAGNOSIS_MAX_PENDING)
+DIAGNOSIS_BUSY = "Diagnosis service is busy, please try again shortly."
+
+def _diagnosis_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=DIAGNOSIS_BUSY,
+        headers={"Retry-After": "1"},
+    )
+
+class DiagnosisBatchRequest(BaseModel):
+    symbols: List[str]
+
+async def verify_api_key(
     x_api_key: Optional[str] = Header(None, alias="X-API-KEY"),
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
     """
-    提供外部调用的股票解析/诊断服务
+    校验外部调用密钥（异步查询，不阻塞事件循环）
     """
     # 按照优先级检查密钥: 1. 数据库 2. 环境变量
-    config_key = session.exec(select(SystemConfig).where(SystemConfig.key == "EXTERNAL_API_KEY")).first()
+    config_key = (await session.exec(select(SystemConfig).where(SystemConfig.key == "EXTERNAL_API_KEY"))).first()
     master_key = config_key.value if config_key else os.getenv("EXTERNAL_API_KEY")
     
     if not master_key:
@@ -34,20 +56,63 @@ async def get_stock_diagnosis(
             status_code=401, 
             detail="无效的 API 密钥，请联系作者: https://t.me/suimigg666"
         )
-    
+
+@router.get("/diagnosis/{symbol}", dependencies=[Depends(verify_api_key)])
+async def get_stock_diagnosis(symbol: str):
+    """
+    提供外部调用的股票解析/诊断服务
+    """
     try:
-        data = fetch_diagnosis_data(symbol)
-        if not data:
-            raise HTTPException(status_code=404, detail="Stock not found")
-        return data
+        # 行情/基本面抓取是阻塞的网络 I/O，放到诊断专用线程池中执行
+        data = await diagnosis_pool.run(fetch_diagnosis_data, symbol)
+    except WorkerPoolBusy:
+        raise _diagnosis_busy()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if not data:
+        raise HTTPException(status_code=404, detail="Stock not found")
+    return data
+
+@router.post("/diagnosis/batch", dependencies=[Depends(verify_api_key)])
+async def get_stock_diagnosis_batch(request: DiagnosisBatchRequest):
+    """
+    批量诊断：并发解析多个代码（并发度受 DIAGNOSIS_BATCH_CONCURRENCY 限制）
+    返回 results（代码 -> 诊断数据）和 errors（代码 -> 错误信息）
+    """
+    symbols = list(dict.fromkeys(s.strip() for s in request.symbols if s and s.strip()))
+    if not symbols:
+        raise HTTPException(status_code=400, detail="No symbols provided")
+    if len(symbols) > DIAGNOSIS_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {DIAGNOSIS_BATCH_MAX} symbols per request")
+
+    semaphore = asyncio.Semaphore(DIAGNOSIS_BATCH_CONCURRENCY)
+
+    async def diagnose(symbol: str):
+        async with semaphore:
+            try:
+                return symbol, await diagnosis_pool.run(fetch_diagnosis_data, symbol), None
+            except WorkerPoolBusy:
+                return symbol, None, DIAGNOSIS_BUSY
+            except Exception as e:
+                return symbol, None, str(e)
+
+    outcomes = await asyncio.gather(*(diagnose(s) for s in symbols))
+    # 整批都被线程池拒绝时返回 503，部分拒绝的代码记入 errors
+    if all(error is DIAGNOSIS_BUSY for _, _, error in outcomes):
+        raise _diagnosis_busy()
+    results, errors = {}, {}
+    for symbol, data, error in outcomes:
+        if data:
+            results[symbol] = data
+        else:
+            errors[symbol] = error or "Stock not found"
+    return {"results": results, "errors": errors}
 
 @router.post("/config/api-settings")
 async def set_api_settings(
     data: dict, 
     current_user: User = Depends(get_current_user), 
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
     """
     从 UI 设置全局 API 地址和密钥
@@ -59,7 +124,7 @@ async def set_api_settings(
     
     for key, value in settings.items():
         if value is not None:
-            config = session.exec(select(SystemConfig).where(SystemConfig.key == key)).first()
+            config = (await session.exec(select(SystemConfig).where(SystemConfig.key == key))).first()
             if config:
                 config.value = value
                 config.updated_at = datetime.utcnow()
@@ -67,19 +132,19 @@ async def set_api_settings(
                 config = SystemConfig(key=key, value=value)
             session.add(config)
             
-    session.commit()
+    await session.commit()
     return {"message": "API Settings updated successfully"}
 
 @router.get("/config/api-settings")
 async def get_api_settings(
     current_user: User = Depends(get_current_user), 
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
     """
     获取当前 API 配置状态（出于安全原因内容可能部分隐藏）
     """
-    config_key = session.exec(select(SystemConfig).where(SystemConfig.key == "EXTERNAL_API_KEY")).first()
-    config_url = session.exec(select(SystemConfig).where(SystemConfig.key == "EXTERNAL_API_URL")).first()
+    config_key = (await session.exec(select(SystemConfig).where(SystemConfig.key == "EXTERNAL_API_KEY"))).first()
+    config_url = (await session.exec(select(SystemConfig).where(SystemConfig.key == "EXTERNAL_API_URL"))).first()
     
     return {
         "isConfigured": config_key is not None or os.getenv("EXTERNAL_API_KEY") is not None,
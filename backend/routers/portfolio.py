@@ -1,8 +1,9 @@
 from fastapi import APIRouter, Depends
-from sqlmodel import Session, select
+from sqlmodel import Session, select, func
 from database import get_session
-from models import Stock, Transaction, DailyQuote
-from services.analytics import PortfolioAnalyzer
+from models import Stock, AssetSnapshot
+from services.snapshots import refresh_snapshots
+from services.portfolio_loader import load_positions
 from datetime import date, timedelta
 from services.auth import get_current_user
 from models import User
@@ -13,6 +14,7 @@ router = APIRouter(prefix="/api/portfolio", tags=["portfolio"])
 @router.get("/stats")
 def get_portfolio_stats(current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
     stocks = session.exec(select(Stock).where(Stock.user_id == current_user.id)).all()
+    positions = load_positions(session, stocks, recent=2)
     
     total_net_worth = 0.0
     total_unrealized_pnl = 0.0
@@ -23,11 +25,9 @@ def get_portfolio_stats(current_user: User = Depends(get_current_user), session:
     active_stock_count = 0
     
     for stock in stocks:
-        transactions = session.exec(select(Transaction).where(Transaction.stock_id == stock.id)).all()
-        quotes = session.exec(select(DailyQuote).where(DailyQuote.stock_id == stock.id)).all()
-        
-        analyzer = PortfolioAnalyzer(transactions, quotes)
-        snapshot = analyzer.get_snapshot()
+        position = positions[stock.id]
+        snapshot = position.get_snapshot()
+        rows = position.snapshots
         
         total_net_worth += snapshot["market_value"]
         total_unrealized_pnl += snapshot["unrealized_pnl"]
@@ -38,10 +38,8 @@ def get_portfolio_stats(current_user: User = Depends(get_current_user), session:
             active_stock_count += 1
             
         # Calculate Daily P/L based on the last two available quotes
-        if len(quotes) >= 2:
-            latest_quote = quotes[-1]
-            prev_close = quotes[-2].close
-            daily_change = latest_quote.close - prev_close
+        if len(rows) >= 2:
+            daily_change = rows[-1].close - rows[-2].close
             total_daily_pnl += daily_change * snapshot["holdings_qty"]
 
     total_pnl = total_unrealized_pnl + total_realized_pnl
@@ -65,27 +63,37 @@ def get_portfolio_chart(current_user: User = Depends(get_current_user), session:
     获取过去7天的每日总盈亏状况（累计，严格连续7天）
     """
     stocks = session.exec(select(Stock).where(Stock.user_id == current_user.id)).all()
-    
+    refresh_snapshots(session, stocks)
+    stock_ids = [stock.id for stock in stocks]
+
+    today = date.today()
+    window_start = (today - timedelta(days=7)).isoformat()
+
+    # 只需要窗口内的快照，外加窗口起点之前最近的一天（用于向前补齐）
+    anchor_date = session.exec(
+        select(func.max(AssetSnapshot.date)).where(
+            AssetSnapshot.stock_id.in_(stock_ids),
+            AssetSnapshot.date <= window_start
+        )
+    ).one()
+    rows = session.exec(
+        select(AssetSnapshot).where(
+            AssetSnapshot.stock_id.in_(stock_ids),
+            AssetSnapshot.date >= (anchor_date or window_start)
+        ).order_by(AssetSnapshot.stock_id, AssetSnapshot.date)
+    ).all()
+
     # 合并所有股票的 timeline
     master_timeline = {}
-    for stock in stocks:
-        txs = session.exec(select(Transaction).where(Transaction.stock_id == stock.id)).all()
-        quotes = session.exec(select(DailyQuote).where(DailyQuote.stock_id == stock.id)).all()
-        
-        analyzer = PortfolioAnalyzer(txs, quotes)
-        timeline = analyzer.get_timeline()
-        
-        for entry in timeline:
-            d_str = entry["date"]
-            if d_str not in master_timeline:
-                master_timeline[d_str] = {"pnl": 0.0, "market_value": 0.0}
-            master_timeline[d_str]["pnl"] += entry["total_pnl"]
-            master_timeline[d_str]["market_value"] += entry["market_value"]
+    for row in rows:
+        d_str = row.date
+        if d_str not in master_timeline:
+            master_timeline[d_str] = {"pnl": 0.0, "market_value": 0.0}
+        master_timeline[d_str]["pnl"] += row.total_pnl
+        master_timeline[d_str]["market_value"] += row.market_value
             
     if not master_timeline:
         return []
-
-    today = date.today()
     
     # 我们需要 7 天的数据点，外加一个起始点来计算第一天的变化
     # 也就是从 today-7 到 today，总共 8 个点用于计算 7 个变动
@@ -1,9 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from typing import List
-from database import get_session
-from models import Stock, DailyQuote
-from services.market_data import fetch_price
+from database import get_session, get_async_session
+from models import Stock, DailyQuoteInput
+from services.market_data import fetch_and_save_price
+from services.snapshots import mark_dirty, refresh_snapshots
+from services.quote_store import load_quotes_async, get_quote, save_manual_quote
 from datetime import datetime
 
 from services.auth import get_current_user
@@ -16,12 +19,12 @@ def manual_update_quotes(current_user: User = Depends(get_current_user), session
     """
     手动触发行情更新
     """
-    from services.scheduler import update_all_quotes
+    from services.scheduler import update_all_quotes, last_cycle_stats
     
     # Check if user is admin or allowed? For now, any logged-in user can trigger.
     try:
         update_all_quotes()
-        return {"status": "success", "message": "Quote update triggered successfully"}
+        return {"status": "success", "message": "Quote update triggered successfully", "stats": dict(last_cycle_stats)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Update failed: {str(e)}")
 
@@ -35,19 +38,13 @@ def get_historical_price(stock_id: int, date: str, current_user: User = Depends(
         raise HTTPException(status_code=404, detail="Stock not found")
     
     # 1. First check local database
-    existing_quote = session.exec(
-        select(DailyQuote).where(
-            DailyQuote.stock_id == stock_id,
-            DailyQuote.date == date
-        )
-    ).first()
+    existing_quote = get_quote(session, stock, date)
     
     if existing_quote:
         return {"price": existing_quote.close, "source": "local"}
     
-    # 2. If not in DB, fetch from internet
-    from services.market_data import fetch_price
-    price = fetch_price(stock.symbol, stock.market, date)
+    # 2. If not in DB, fetch from internet (concurrent identical requests share one fetch)
+    price = fetch_and_save_price(stock.symbol, stock.market, date)
     
     if price is None:
         print(f"❌ Failed to fetch price for {stock.symbol} on {date}")
@@ -56,18 +53,16 @@ def get_historical_price(stock_id: int, date: str, current_user: User = Depends(
     return {"price": price, "source": "remote"}
 
 @router.get("/{stock_id}")
-def get_quotes(stock_id: int, current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
+async def get_quotes(stock_id: int, current_user: User = Depends(get_current_user), session: AsyncSession = Depends(get_async_session)):
     # Verify ownership
-    stock = session.exec(select(Stock).where(Stock.id == stock_id, Stock.user_id == current_user.id)).first()
+    stock = (await session.exec(select(Stock).where(Stock.id == stock_id, Stock.user_id == current_user.id))).first()
     if not stock:
         raise HTTPException(status_code=404, detail="Stock not found")
         
-    statement = select(DailyQuote).where(DailyQuote.stock_id == stock_id).order_by(DailyQuote.date)
-    quotes = session.exec(statement).all()
-    return quotes
+    return await load_quotes_async(session, stock)
 
 @router.post("/")
-def record_manual_quote(quote: DailyQuote, current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
+def record_manual_quote(quote: DailyQuoteInput, current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
     """
     Manually record or update a quote for a specific date.
     Manual entries take precedence and won't be overwritten by the scheduler.
@@ -77,27 +72,18 @@ def record_manual_quote(quote: DailyQuote, current_user: User = Depends(get_curr
     if not stock:
         raise HTTPException(status_code=404, detail="Stock not found or forbidden")
 
-    existing = session.exec(
-        select(DailyQuote).where(
-            DailyQuote.stock_id == quote.stock_id,
-            DailyQuote.date == quote.date
-        )
-    ).first()
-    
+    # 已有手动覆盖则更新；只有共享行情时，未填写的字段沿用共享数据并写成新的覆盖
+    existing = get_quote(session, stock, quote.date)
+    data = {'close': quote.close, 'open': quote.open, 'high': quote.high, 'low': quote.low, 'volume': quote.volume}
     if existing:
-        existing.close = quote.close
-        existing.open = quote.open if quote.open else existing.open
-        existing.high = quote.high if quote.high else existing.high
-        existing.low = quote.low if quote.low else existing.low
-        existing.volume = quote.volume if quote.volume else existing.volume
-        existing.is_manual = True
-        session.add(existing)
-        session.commit()
-        session.refresh(existing)
-        return existing
-    else:
-        quote.is_manual = True
-        session.add(quote)
-        session.commit()
-        session.refresh(quote)
-        return quote
+        data['open'] = quote.open if quote.open else existing.open
+        data['high'] = quote.high if quote.high else existing.high
+        data['low'] = quote.low if quote.low else existing.low
+        data['volume'] = quote.volume if quote.volume else existing.volume
+
+    saved = save_manual_quote(session, stock.id, quote.date, data)
+    mark_dirty(session, stock.id, quote.date)
+    session.commit()
+    refresh_snapshots(session, [stock])
+    session.refresh(saved)
+    return saved
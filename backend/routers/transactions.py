@@ -2,13 +2,14 @@ from fastapi import APIRouter, Depends, HTTPException
 from sqlmodel import Session, select
 from typing import List
 from database import get_session
-from models import Transaction, Stock, User
+from models import Transaction, TransactionUpdate, Stock, User
 from services.auth import get_current_user
+from services.snapshots import mark_dirty, refresh_snapshots
 
 router = APIRouter(prefix="/api/transactions", tags=["transactions"])
 
 @router.put("/{transaction_id}", response_model=Transaction)
-def update_transaction(transaction_id: int, transaction_update: Transaction, current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
+def update_transaction(transaction_id: int, transaction_update: TransactionUpdate, current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
     db_transaction = session.get(Transaction, transaction_id)
     if not db_transaction:
         raise HTTPException(status_code=404, detail="Transaction not found")
@@ -19,18 +20,24 @@ def update_transaction(transaction_id: int, transaction_update: Transaction, cur
         raise HTTPException(status_code=403, detail="Forbidden")
     
     transaction_data = transaction_update.model_dump(exclude_unset=True)
-    if 'id' in transaction_data:
-        del transaction_data['id']
-    if 'stock_id' in transaction_data:
-        # Prevent changing stock_id if not intended, but usually fine.
-        # Ideally stock_id shouldn't change, but if user made mistake...
-        pass
+    affected = [stock]
+    if transaction_data.get('stock_id', stock.id) != stock.id:
+        # 允许把记错的交易移到同一用户的另一只股票，两只股票的快照都要重算
+        target = session.exec(select(Stock).where(Stock.id == transaction_data['stock_id'], Stock.user_id == current_user.id)).first()
+        if not target:
+            raise HTTPException(status_code=404, detail="Target stock not found")
+        affected.append(target)
 
+    old_date = db_transaction.date
     for key, value in transaction_data.items():
         setattr(db_transaction, key, value)
         
     session.add(db_transaction)
+    # 快照只需从新旧日期中较早的一天开始重算；失效标记与修改同一事务提交，重算失败也不会丢失
+    for affected_stock in affected:
+        mark_dirty(session, affected_stock.id, min(old_date, db_transaction.date))
     session.commit()
+    refresh_snapshots(session, affected)
     session.refresh(db_transaction)
     return db_transaction
 
@@ -45,6 +52,9 @@ def delete_transaction(transaction_id: int, current_user: User = Depends(get_cur
     if not stock:
         raise HTTPException(status_code=403, detail="Forbidden")
     
+    tx_date = transaction.date
     session.delete(transaction)
+    mark_dirty(session, stock.id, tx_date)
     session.commit()
+    refresh_snapshots(session, [stock])
     return {"ok": True}
@@ -1,19 +1,27 @@
 from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlmodel import Session, select
-from database import get_session
+from fastapi.concurrency import run_in_threadpool
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from database import get_async_session
 from models import User
 from services.auth import get_password_hash, verify_password, create_access_token, get_current_user
+from services.credential_pool import credential_pool
+from services.worker_pool import WorkerPoolBusy
 from services.email import send_verification_code
 from services.crypto import get_public_key, decrypt_password
+from services.ttl_store import get_ttl_store, TTLStoreFull
 import random
 import time
 from pydantic import BaseModel, EmailStr
 
 router = APIRouter(prefix="/api/users", tags=["users"])
 
-# Temp store for verification codes: {email: {"code": str, "expiry": float}}
-verification_codes = {}
+# 验证码与已使用的动态 token nonce 存在共享 TTL 存储中，多个 worker 之间可见，过期自动清理
+VERIFICATION_CODE_TTL = 600  # 10 mins
+DYNAMIC_TOKEN_TTL = 300
+verification_codes = get_ttl_store("verification_code")  # email -> code
+used_nonces = get_ttl_store("token_nonce")
 
 class UserRegister(BaseModel):
     email: EmailStr
@@ -50,6 +58,13 @@ TOKEN_SECRET = os.getenv("TOKEN_SECRET", "deep_ledger_dynamic_secret_key_2026")
 if TOKEN_SECRET == "deep_ledger_dynamic_secret_key_2026":
     print("⚠️ WARNING: Using default insecure TOKEN_SECRET. Set TOKEN_SECRET in .env for production.")
 
+def _server_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Server is busy, please try again shortly.",
+        headers={"Retry-After": "1"},
+    )
+
 def generate_session_key():
     # Generate a random 16-char key for this specific session
     return ''.join(secrets.choice(string.ascii_letters + string.digits) for _ in range(16))
@@ -82,10 +97,20 @@ def verify_token_and_get_key(token: str):
             return None
             
         # 2. Verify Expiration
-        if time.time() - int(timestamp) > 300: 
+        age = time.time() - int(timestamp)
+        if age > DYNAMIC_TOKEN_TTL: 
+            return None
+
+        # 3. Single use: nonce 只记录到 token 过期为止
+        if not used_nonces.add(nonce, True, ttl=max(DYNAMIC_TOKEN_TTL - age, 0) + 1):
+            print("⚠️ Replayed dynamic token")
             return None
             
         return session_key
+    except TTLStoreFull as e:
+        # nonce 无法记录时不能放行（否则可重放），也不能当成无效 token
+        print(f"🚨 {e}")
+        raise _server_busy()
     except Exception as e:
         print(f"Token verification error: {e}")
         return None
@@ -148,45 +173,68 @@ def request_code(req: CodeRequest):
 
     print(f"📩 Received code request for: {req.email}, lang: {req.lang}")
     code = f"{random.randint(100000, 999999)}"
-    verification_codes[req.email] = {
-        "code": code,
-        "expiry": time.time() + 600 # 10 mins
-    }
+    try:
+        verification_codes.set(req.email, code, ttl=VERIFICATION_CODE_TTL)
+    except TTLStoreFull as e:
+        print(f"🚨 {e}")
+        raise _server_busy()
     
     if send_verification_code(req.email, code, req.lang):
         return {"message": "Verification code sent."}
     else:
         raise HTTPException(status_code=500, detail="Failed to send email.")
 
+def _hash_encrypted_password(encrypted_password: str) -> Optional[str]:
+    """解密前端 RSA 加密的密码并生成 bcrypt 哈希；解密失败返回 None"""
+    password = decrypt_password(encrypted_password)
+    return get_password_hash(password) if password else None
+
+def _check_encrypted_password(encrypted_password: str, hashed_password: Optional[str]) -> bool:
+    password = decrypt_password(encrypted_password)
+    return bool(password and hashed_password and verify_password(password, hashed_password))
+
+async def _run_credential_op(fn, *args):
+    """RSA/bcrypt 运算放到专用线程池，池满时返回 503"""
+    try:
+        return await credential_pool.run(fn, *args)
+    except WorkerPoolBusy:
+        raise _server_busy()
+
+async def _check_code(email: str, code: str):
+    """只校验不删除：503、邮箱已注册、密码无法解密等失败之后，仍可用同一个验证码重试"""
+    if await run_in_threadpool(verification_codes.get, email) != code:
+        raise HTTPException(status_code=400, detail="Invalid or expired verification code.")
+
+async def _consume_code(email: str, code: str):
+    """提交前原子地删除验证码，并发请求中只有一个能通过"""
+    if not await run_in_threadpool(verification_codes.consume, email, code):
+        raise HTTPException(status_code=400, detail="Invalid or expired verification code.")
+
 @router.post("/register")
-def register(user_data: UserRegister, session: Session = Depends(get_session)):
+async def register(user_data: UserRegister, session: AsyncSession = Depends(get_async_session)):
     # Check code
-    record = verification_codes.get(user_data.email)
-    if not record or record["code"] != user_data.code or record["expiry"] < time.time():
-        raise HTTPException(status_code=400, detail="Invalid or expired verification code.")
+    await _check_code(user_data.email, user_data.code)
     
     # Check if user exists
-    existing = session.exec(select(User).where(User.email == user_data.email)).first()
+    existing = (await session.exec(select(User).where(User.email == user_data.email))).first()
     if existing:
         raise HTTPException(status_code=400, detail="Email already registered.")
     
-    # Decrypt password
-    password = decrypt_password(user_data.password)
-    if not password:
+    # Decrypt password and hash it
+    hashed_password = await _run_credential_op(_hash_encrypted_password, user_data.password)
+    if not hashed_password:
         raise HTTPException(status_code=400, detail="Invalid encrypted password.")
     
+    # Remove code（一切检查通过后才消耗验证码）
+    await _consume_code(user_data.email, user_data.code)
+
     # Create user
     new_user = User(
         email=user_data.email,
-        hashed_password=get_password_hash(password)
+        hashed_password=hashed_password
     )
     session.add(new_user)
-    session.commit()
-    session.refresh(new_user)
-    
-    # Remove code
-    if user_data.email in verification_codes:
-        del verification_codes[user_data.email]
+    await session.commit()
     
     return {"message": "User registered successfully."}
 
@@ -196,40 +244,37 @@ class PasswordReset(BaseModel):
     new_password: str
 
 @router.post("/reset-password")
-def reset_password(data: PasswordReset, session: Session = Depends(get_session)):
+async def reset_password(data: PasswordReset, session: AsyncSession = Depends(get_async_session)):
     # Check code
-    record = verification_codes.get(data.email)
-    if not record or record["code"] != data.code or record["expiry"] < time.time():
-        raise HTTPException(status_code=400, detail="Invalid or expired verification code.")
+    await _check_code(data.email, data.code)
     
     # Check if user exists
-    user = session.exec(select(User).where(User.email == data.email)).first()
+    user = (await session.exec(select(User).where(User.email == data.email))).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found.")
     
-    # Decrypt password
-    new_password = decrypt_password(data.new_password)
-    if not new_password:
+    # Decrypt password and hash it
+    hashed_password = await _run_credential_op(_hash_encrypted_password, data.new_password)
+    if not hashed_password:
         raise HTTPException(status_code=400, detail="Invalid encrypted password.")
         
+    # Remove code（一切检查通过后才消耗验证码）
+    await _consume_code(data.email, data.code)
+
     # Update password
-    user.hashed_password = get_password_hash(new_password)
+    user.hashed_password = hashed_password
     session.add(user)
-    session.commit()
-    
-    # Remove code
-    if data.email in verification_codes:
-        del verification_codes[data.email]
+    await session.commit()
         
     return {"message": "Password reset successfully."}
 
 @router.post("/login")
-def login(login_data: UserLogin, session: Session = Depends(get_session)):
-    user = session.exec(select(User).where(User.email == login_data.email)).first()
+async def login(login_data: UserLogin, session: AsyncSession = Depends(get_async_session)):
+    user = (await session.exec(select(User).where(User.email == login_data.email))).first()
     
-    # Decrypt password
-    password = decrypt_password(login_data.password)
-    if not password or not user or not verify_password(password, user.hashed_password):
+    # Decrypt password and verify it
+    valid = await _run_credential_op(_check_encrypted_password, login_data.password, user.hashed_password if user else None)
+    if not valid:
         raise HTTPException(status_code=401, detail="Incorrect email or password.")
     
     access_token = create_access_token(data={"sub": user.email})
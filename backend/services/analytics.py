@@ -1,169 +1,239 @@
 from typing import List, Dict, Any
 from models import Transaction, DailyQuote
 from datetime import date
+import numpy as np
+from services.fixed_point import (
+    PRICE_SCALE, QTY_SCALE, price_units, qty_units, from_units, amount, unit_cost, prorate,
+)
 
 class PortfolioAnalyzer:
     def __init__(self, transactions: List[Transaction], quotes: List[DailyQuote]):
         self.transactions = sorted(transactions, key=lambda x: (x.date, x.id))
         self.quotes = sorted(quotes, key=lambda x: x.date)
-        self.holdings_qty = 0.0
-        self.total_cost = 0.0           # Accounting cost (Mark-to-Market)
-        self.purchase_total_cost = 0.0  # Real purchase cost (Average of all buys)
+        # 运行状态均为定点整数单位（services/fixed_point.py），get_snapshot() 输出时换算成 float
+        self.holdings_qty = 0
+        self.total_cost = 0           # Accounting cost (Mark-to-Market)
+        self.purchase_total_cost = 0  # Real purchase cost (Average of all buys)
         
-        self.realized_pnl = 0.0
-        self.total_fees = 0.0
-        self.current_avg_cost = 0.0
-        self.purchase_avg_cost = 0.0
+        self.realized_pnl = 0
+        self.total_fees = 0
+        self.current_avg_cost = 0
+        self.purchase_avg_cost = 0
 
         # Process transactions to get current state
         self._calculate_current_state()
 
     def _calculate_current_state(self):
-        last_valid_avg_cost = 0.0
-        last_valid_purchase_cost = 0.0
+        last_valid_avg_cost = 0
+        last_valid_purchase_cost = 0
         
         for tx in self.transactions:
-            self.total_fees += tx.fees
+            price = price_units(tx.price)
+            quantity = qty_units(tx.quantity)
+            fees = price_units(tx.fees)
+            self.total_fees += fees
             
             if tx.type == 'BUY':
-                cost_added = (tx.price * tx.quantity) + tx.fees
+                cost_added = amount(price, quantity) + fees
                 self.total_cost += cost_added
                 self.purchase_total_cost += cost_added
-                self.holdings_qty += tx.quantity
+                self.holdings_qty += quantity
                 
             elif tx.type == 'SELL':
+                sold = abs(quantity)
                 if self.holdings_qty > 0:
-                    avg_cost = self.total_cost / self.holdings_qty
-                    p_avg_cost = self.purchase_total_cost / self.holdings_qty
-                    last_valid_avg_cost = avg_cost
-                    last_valid_purchase_cost = p_avg_cost
+                    last_valid_avg_cost = unit_cost(self.total_cost, self.holdings_qty)
+                    last_valid_purchase_cost = unit_cost(self.purchase_total_cost, self.holdings_qty)
+                    # 按数量比例分摊成本，卖出全部时成本恰好清零
+                    cost_removed = prorate(self.total_cost, sold, self.holdings_qty)
+                    p_cost_removed = prorate(self.purchase_total_cost, sold, self.holdings_qty)
                 else:
-                    avg_cost = last_valid_avg_cost
-                    p_avg_cost = last_valid_purchase_cost
+                    cost_removed = amount(last_valid_avg_cost, sold)
+                    p_cost_removed = amount(last_valid_purchase_cost, sold)
                 
-                cost_removed = avg_cost * abs(tx.quantity)
-                p_cost_removed = p_avg_cost * abs(tx.quantity)
-                revenue = (tx.price * abs(tx.quantity)) - tx.fees
+                revenue = amount(price, sold) - fees
                 
                 self.total_cost -= cost_removed
                 self.purchase_total_cost -= p_cost_removed
-                self.holdings_qty -= abs(tx.quantity)
+                self.holdings_qty -= sold
                 # Correct realized PnL: Net Revenue - current accounting cost basis
                 self.realized_pnl += (revenue - cost_removed)
             
             elif tx.type == 'CLOSE_POSITION':
                 # Settlement: Only updates accounting cost, NOT purchase cost
                 if self.holdings_qty > 0:
-                    avg_cost = self.total_cost / self.holdings_qty
+                    sold = abs(quantity)
                     # Profit factor in fees
-                    profit = (tx.price * abs(tx.quantity)) - tx.fees - (avg_cost * abs(tx.quantity))
+                    profit = amount(price, sold) - fees - prorate(self.total_cost, sold, self.holdings_qty)
                     self.realized_pnl += profit
-                    self.total_cost += (profit + tx.fees) # Add back fees to total_cost if we are clearing it? 
-                    # Actually for CLOSE_POSITION, if it's meant to clear the position:
-                    # If we sold everything, total_cost should go to 0.
-                    # Let's just use the same logic as SELL.
-                    last_valid_avg_cost = self.total_cost / self.holdings_qty if self.holdings_qty > 0 else avg_cost
+                    self.total_cost += (profit + fees)
+                    last_valid_avg_cost = unit_cost(self.total_cost, self.holdings_qty)
 
         if self.holdings_qty > 0:
-            self.current_avg_cost = self.total_cost / self.holdings_qty
-            self.purchase_avg_cost = self.purchase_total_cost / self.holdings_qty
+            self.current_avg_cost = unit_cost(self.total_cost, self.holdings_qty)
+            self.purchase_avg_cost = unit_cost(self.purchase_total_cost, self.holdings_qty)
         else:
+            # 整数数量没有舍入残留，卖光即为 0
             self.current_avg_cost = last_valid_avg_cost
             self.purchase_avg_cost = last_valid_purchase_cost
-            if self.holdings_qty < 0.0001: 
-                self.total_cost = 0.0
-                self.purchase_total_cost = 0.0
+            self.total_cost = 0
+            self.purchase_total_cost = 0
 
     def get_snapshot(self, current_price: float = None):
         if current_price is None:
             current_price = self.quotes[-1].close if self.quotes else 0.0
             
-        market_value = self.holdings_qty * current_price
+        market_value = amount(price_units(current_price), self.holdings_qty)
         # Unrealized PnL based on accounting cost
         unrealized_pnl = market_value - self.total_cost
         # Total PnL is sum of realized and unrealized
         total_pnl = self.realized_pnl + unrealized_pnl
         
         return {
-            "holdings_qty": self.holdings_qty,
-            "avg_cost": self.purchase_avg_cost, # Display purchase cost as 'Average Cost'
-            "accounting_avg_cost": self.current_avg_cost,
-            "total_cost": self.purchase_total_cost,
+            "holdings_qty": from_units(self.holdings_qty, QTY_SCALE),
+            "avg_cost": from_units(self.purchase_avg_cost, PRICE_SCALE), # Display purchase cost as 'Average Cost'
+            "accounting_avg_cost": from_units(self.current_avg_cost, PRICE_SCALE),
+            "total_cost": from_units(self.purchase_total_cost, PRICE_SCALE),
             "current_price": current_price,
-            "market_value": market_value,
-            "unrealized_pnl": unrealized_pnl,
+            "market_value": from_units(market_value, PRICE_SCALE),
+            "unrealized_pnl": from_units(unrealized_pnl, PRICE_SCALE),
             "unrealized_pnl_percent": (unrealized_pnl / self.total_cost * 100) if self.total_cost > 0 else 0,
-            "realized_pnl": self.realized_pnl,
-            "total_pnl": total_pnl,
+            "realized_pnl": from_units(self.realized_pnl, PRICE_SCALE),
+            "total_pnl": from_units(total_pnl, PRICE_SCALE),
             "pnl_percent": (total_pnl / self.purchase_total_cost * 100) if self.purchase_total_cost > 0 else 0,
-            "total_fees": self.total_fees
+            "total_fees": from_units(self.total_fees, PRICE_SCALE)
         }
 
     def get_timeline(self):
         """
         Generate daily series of (date, price, qty, avg_cost, unrealized_pnl)
         """
-        if not self.quotes:
-            return []
-            
-        timeline = []
-        running_qty = 0.0
-        running_cost = 0.0          # Accounting
-        running_purchase_cost = 0.0 # Real
-        
-        # Helper to group transactions by date
-        tx_by_date = {}
-        for tx in self.transactions:
-            d_str = tx.date if isinstance(tx.date, str) else tx.date.strftime('%Y-%m-%d')
-            if d_str not in tx_by_date:
-                tx_by_date[d_str] = []
-            tx_by_date[d_str].append(tx)
-            
-        running_realized_pnl = 0.0
-        # Iterate through daily quotes
-        for quote in self.quotes:
-            d_str = quote.date if isinstance(quote.date, str) else quote.date.strftime('%Y-%m-%d')
-            
-            if d_str in tx_by_date:
-                for tx in tx_by_date[d_str]:
-                    if tx.type == 'BUY':
-                        cost = (tx.price * tx.quantity) + tx.fees
-                        running_cost += cost
-                        running_purchase_cost += cost
-                        running_qty += tx.quantity
-                    elif tx.type == 'SELL' and running_qty > 0:
-                        accounting_avg = running_cost / running_qty
-                        purchase_avg = running_purchase_cost / running_qty
-                        
-                        revenue = (tx.price * abs(tx.quantity)) - tx.fees
-                        cost_removed = accounting_avg * abs(tx.quantity)
-                        
-                        running_realized_pnl += (revenue - cost_removed)
-                        running_cost -= cost_removed
-                        running_purchase_cost -= (purchase_avg * abs(tx.quantity))
-                        running_qty -= abs(tx.quantity)
-                    elif tx.type == 'CLOSE_POSITION' and running_qty > 0:
-                        accounting_avg = running_cost / running_qty
-                        profit = (tx.price * abs(tx.quantity)) - tx.fees - (accounting_avg * abs(tx.quantity))
-                        running_realized_pnl += profit
-                        running_cost += (profit + tx.fees)
-            
-            # Calculate metrics
-            market_value = running_qty * quote.close
-            # Unrealized based on current accounting cost
-            unrealized_pnl = market_value - running_cost
-            total_pnl_val = unrealized_pnl + running_realized_pnl
-            
-            timeline.append({
-                "date": d_str,
-                "close": quote.close,
-                "qty": running_qty,
-                "avg_cost": running_purchase_cost / running_qty if running_qty > 0 else 0,
-                "market_value": market_value,
-                "unrealized_pnl": unrealized_pnl,
-                "realized_pnl": running_realized_pnl,
-                "total_pnl": total_pnl_val,
-                "unrealized_pnl_percent": (unrealized_pnl / running_cost * 100) if running_cost > 0 else 0
-            })
-            
-        return timeline
+        return self.get_timeline_columns().to_records()
+
+    def get_timeline_columns(self):
+        return build_timeline_columns(self.transactions, self.quotes)
+
+
+class TimelineColumns:
+    """
+    Columnar daily timeline: one numpy array per metric, aligned on `dates`.
+    """
+    FIELDS = ("close", "qty", "avg_cost", "cost_basis", "total_cost", "market_value",
+              "unrealized_pnl", "realized_pnl", "total_pnl", "unrealized_pnl_percent")
+
+    def __init__(self, dates: List[str], **columns: np.ndarray):
+        self.dates = dates
+        for field in self.FIELDS:
+            setattr(self, field, columns[field])
+
+    def __len__(self):
+        return len(self.dates)
+
+    def to_records(self) -> List[Dict[str, Any]]:
+        """Dict-per-day view used by the JSON API."""
+        columns = [getattr(self, field).tolist() for field in self.FIELDS]
+        return [
+            {"date": d, **dict(zip(self.FIELDS, values))}
+            for d, *values in zip(self.dates, *columns)
+        ]
+
+
+def build_timeline(transactions: List[Transaction], quotes: List[DailyQuote], start: Dict[str, float] = None):
+    """Dict view of build_timeline_columns()."""
+    return build_timeline_columns(transactions, quotes, start).to_records()
+
+
+def build_timeline_columns(transactions: List[Transaction], quotes: List[DailyQuote], start: Dict[str, float] = None) -> TimelineColumns:
+    """
+    Replay transactions against a date-sorted quote series.
+
+    Transactions only change state on the few days they occur, so they are
+    replayed sequentially (keeping the SELL / CLOSE_POSITION average-cost rules
+    exact) to produce the running state after each trading day; that state is
+    then forward-filled over the quote series and every per-day metric is
+    computed with array operations.
+
+    `start` seeds the running state (qty / cost_basis / total_cost / realized_pnl)
+    so a timeline can resume from a persisted AssetSnapshot checkpoint instead
+    of replaying the whole history.
+
+    Ledger state is kept in fixed-point integer units (services/fixed_point.py)
+    so a full sell-out leaves exactly zero cost; the returned columns are floats.
+    """
+    start = start or {}
+    dates = [q.date if isinstance(q.date, str) else q.date.strftime('%Y-%m-%d') for q in quotes]
+    close = np.array([price_units(q.close) for q in quotes], dtype=np.int64)
+    n = len(dates)
+
+    # Helper to group transactions by date
+    tx_by_date = {}
+    for tx in sorted(transactions, key=lambda x: (x.date, x.id)):
+        d_str = tx.date if isinstance(tx.date, str) else tx.date.strftime('%Y-%m-%d')
+        tx_by_date.setdefault(d_str, []).append(tx)
+
+    # Running state after each quote day that carries transactions, in fixed-point units
+    seed = [
+        qty_units(start.get("qty", 0)),
+        price_units(start.get("cost_basis", 0)),
+        price_units(start.get("total_cost", 0)),
+        price_units(start.get("realized_pnl", 0)),
+    ]
+    state = np.empty((n, 4), dtype=np.int64)  # qty, cost_basis, total_cost, realized_pnl
+    running_qty, running_cost, running_purchase_cost, running_realized_pnl = seed  # cost: Accounting / purchase: Real
+
+    event_idx = np.flatnonzero(np.isin(np.array(dates, dtype=object), list(tx_by_date)))
+    for i in event_idx:
+        for tx in tx_by_date[dates[i]]:
+            price = price_units(tx.price)
+            quantity = qty_units(tx.quantity)
+            fees = price_units(tx.fees)
+            if tx.type == 'BUY':
+                cost = amount(price, quantity) + fees
+                running_cost += cost
+                running_purchase_cost += cost
+                running_qty += quantity
+            elif tx.type == 'SELL' and running_qty > 0:
+                sold = abs(quantity)
+                revenue = amount(price, sold) - fees
+                cost_removed = prorate(running_cost, sold, running_qty)
+
+                running_realized_pnl += (revenue - cost_removed)
+                running_cost -= cost_removed
+                running_purchase_cost -= prorate(running_purchase_cost, sold, running_qty)
+                running_qty -= sold
+            elif tx.type == 'CLOSE_POSITION' and running_qty > 0:
+                sold = abs(quantity)
+                profit = amount(price, sold) - fees - prorate(running_cost, sold, running_qty)
+                running_realized_pnl += profit
+                running_cost += (profit + fees)
+        state[i] = (running_qty, running_cost, running_purchase_cost, running_realized_pnl)
+
+    # Forward-fill: every day takes the state of the latest event day at or before it
+    last_event = np.full(n, -1, dtype=int)
+    last_event[event_idx] = event_idx
+    last_event = np.maximum.accumulate(last_event)
+    filled = np.where((last_event >= 0)[:, None], state[np.maximum(last_event, 0)], np.array(seed, dtype=np.int64))
+    qty, cost_basis, total_cost, realized_pnl = filled.T
+
+    # Calculate metrics (market value rounded back to whole price units)
+    market_value = np.rint(qty.astype(float) * close / QTY_SCALE).astype(np.int64)
+    # Unrealized based on current accounting cost
+    unrealized_pnl = market_value - cost_basis
+    total_pnl = unrealized_pnl + realized_pnl
+    with np.errstate(divide="ignore", invalid="ignore"):
+        avg_cost = np.where(qty > 0, total_cost / PRICE_SCALE / (qty / QTY_SCALE), 0.0)
+        unrealized_pnl_percent = np.where(cost_basis > 0, unrealized_pnl / cost_basis * 100, 0.0)
+
+    return TimelineColumns(
+        dates,
+        close=from_units(close, PRICE_SCALE),
+        qty=from_units(qty, QTY_SCALE),
+        avg_cost=avg_cost,
+        cost_basis=from_units(cost_basis, PRICE_SCALE),
+        total_cost=from_units(total_cost, PRICE_SCALE),
+        market_value=from_units(market_value, PRICE_SCALE),
+        unrealized_pnl=from_units(unrealized_pnl, PRICE_SCALE),
+        realized_pnl=from_units(realized_pnl, PRICE_SCALE),
+        total_pnl=from_units(total_pnl, PRICE_SCALE),
+        unrealized_pnl_percent=unrealized_pnl_percent,
+    )
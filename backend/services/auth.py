@@ -1,18 +1,30 @@
 import os
+import threading
+import time
 from datetime import datetime, timedelta
 from typing import Optional, Union
 from jose import JWTError, jwt
 # from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlmodel import Session, select
-from database import get_session
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session as OrmSession, object_session
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from database import get_async_session
 from models import User
+from services.ttl_cache import TTLCache
 
 # Configuration
 SECRET_KEY = os.getenv("SECRET_KEY", "your-super-secret-key-change-it-in-prod")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7 # 7 days
+# bcrypt 成本因子，只影响新生成的哈希；已有哈希按其自带的成本校验
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# 已验证 token -> 用户的缓存：命中时跳过 JWT 解码和用户查询。
+# 本进程内改密码/停用账号会立即失效；多 worker 部署时其他进程最多滞后 TTL 秒
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
 
 import bcrypt
 
@@ -43,7 +55,7 @@ def get_password_hash(password):
         password_bytes = password[:72]
         
     # Generate salt and hash
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
     hashed = bcrypt.hashpw(password_bytes, salt)
     return hashed.decode('utf-8')
 
@@ -57,12 +69,81 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), session: Session = Depends(get_session)) -> User:
+class PrincipalCache:
+    """
+    token -> User 的 LRU/TTL 缓存。条目过期时间不超过 token 本身的 exp。
+    按邮箱失效：每个邮箱有一个版本号，失效时递增，旧版本的条目不再命中。
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self._entries = TTLCache(ttl=ttl, max_entries=max_entries)  # token -> (user, version)
+        self._versions = {}  # email -> version
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[User]:
+        entry = self._entries.get(token)
+        if entry is None:
+            return None
+        user, version = entry
+        if self._versions.get(user.email, 0) != version:
+            self._entries.pop(token)
+            return None
+        return user
+
+    def version(self, email: str) -> int:
+        return self._versions.get(email, 0)
+
+    def put(self, token: str, user: User, version: int, expires_at: float):
+        ttl = min(self._entries.ttl, expires_at - time.time())
+        if ttl > 0:
+            self._entries.set(token, (user, version), ttl=ttl)
+
+    def invalidate(self, email: str):
+        with self._lock:
+            self._versions[email] = self._versions.get(email, 0) + 1
+
+    def clear(self):
+        self._entries.clear()
+
+principal_cache = PrincipalCache(PRINCIPAL_CACHE_TTL, PRINCIPAL_CACHE_SIZE)
+
+_PENDING_INVALIDATIONS = "principal_cache_invalidations"
+
+@event.listens_for(User, "after_update")
+def _invalidate_principal(mapper, connection, target):
+    """改密码、停用账号或改邮箱后，该用户已缓存的 token 全部失效"""
+    state = inspect(target)
+    for attr in ("hashed_password", "is_active", "email"):
+        history = state.attrs[attr].history
+        if history.has_changes():
+            emails = {target.email, *history.deleted}
+            for email in emails:
+                principal_cache.invalidate(email)
+            # flush 时旧数据仍是已提交版本：并发查询可能以新版本号缓存旧用户，提交后需要再失效一次
+            session = object_session(target)
+            if session is not None:
+                session.info.setdefault(_PENDING_INVALIDATIONS, set()).update(emails)
+            return
+
+@event.listens_for(OrmSession, "after_commit")
+def _invalidate_principal_on_commit(session):
+    for email in session.info.pop(_PENDING_INVALIDATIONS, ()):
+        principal_cache.invalidate(email)
+
+@event.listens_for(OrmSession, "after_soft_rollback")
+def _discard_pending_invalidations(session, previous_transaction):
+    session.info.pop(_PENDING_INVALIDATIONS, None)
+
+async def get_current_user(token: str = Depends(oauth2_scheme), session: AsyncSession = Depends(get_async_session)) -> User:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    cached = principal_cache.get(token)
+    if cached is not None:
+        return cached
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
@@ -71,7 +152,11 @@ async def get_current_user(token: str = Depends(oauth2_scheme), session: Session
     except JWTError:
         raise credentials_exception
     
-    user = session.exec(select(User).where(User.email == email)).first()
-    if user is None:
+    # 查询前记录版本号，查询期间发生的失效会让这次结果不被缓存
+    version = principal_cache.version(email)
+    # 异步查询，每个鉴权请求不再在事件循环上阻塞等待 SQLite
+    user = (await session.exec(select(User).where(User.email == email))).first()
+    if user is None or not user.is_active:
         raise credentials_exception
+    principal_cache.put(token, user, version, payload.get("exp", 0))
     return user
@@ -0,0 +1,10 @@
+import os
+
+from services.worker_pool import WorkerPool
+
+# 凭证运算（RSA 解密、bcrypt）专用线程池：与请求线程池隔离，登录高峰不会占满普通接口的线程
+CREDENTIAL_WORKERS = int(os.getenv("CREDENTIAL_WORKERS", str(min(4, os.cpu_count() or 1))))
+# 排队 + 执行中的任务上限，超出时立即拒绝（503），而不是让延迟无限增长
+CREDENTIAL_MAX_PENDING = int(os.getenv("CREDENTIAL_MAX_PENDING", "32"))
+
+credential_pool = WorkerPool("credential", CREDENTIAL_WORKERS, CREDENTIAL_MAX_PENDING)
@@ -1,11 +1,17 @@
 from Crypto.PublicKey import RSA
 from Crypto.Cipher import PKCS1_v1_5
 import base64
+import logging
 import os
+import signal
+import threading
+from typing import NamedTuple, Optional
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Path to store keys - use /data for persistence in containers, fallback to local for dev
 def _get_key_path(filename: str) -> str:
     """Get the appropriate path for key files based on environment"""
@@ -88,76 +94,107 @@ def ensure_keys_exist():
             f.write(public_key)
         print("✅ RSA Key Pair Generated locally.")
 
+class Keyring(NamedTuple):
+    """解析好的 RSA 密钥对（不可变，轮换时整体替换）"""
+    private_key: RSA.RsaKey
+    public_pem: str
+
+_keyring: Optional[Keyring] = None
+_keyring_lock = threading.Lock()
+
+def _load_keyring(generate_missing: bool = True) -> Keyring:
+    if generate_missing:
+        ensure_keys_exist()
+    private_pem = _get_key_from_env_or_file("RSA_PRIVATE_KEY", PRIVATE_KEY_PATH)
+    public_pem = _get_key_from_env_or_file("RSA_PUBLIC_KEY", PUBLIC_KEY_PATH)
+    if not private_pem or not public_pem:
+        raise RuntimeError("RSA key pair not found")
+    private_key = RSA.import_key(private_pem)
+    if RSA.import_key(public_pem) != private_key.publickey():
+        raise RuntimeError("RSA public key does not match private key")
+    print(f"🔑 RSA key pair loaded, size: {private_key.size_in_bits()} bits")
+    return Keyring(private_key=private_key, public_pem=public_pem)
+
+def get_keyring() -> Keyring:
+    """进程内只读取、解析一次密钥，之后直接返回缓存的 Keyring"""
+    global _keyring
+    keyring = _keyring
+    if keyring is None:
+        with _keyring_lock:
+            if _keyring is None:
+                _keyring = _load_keyring()
+            keyring = _keyring
+    return keyring
+
+def reload_keys() -> Keyring:
+    """
+    密钥轮换：更新环境变量或 PEM 文件后调用，重新读取并替换 Keyring。
+    不会自动生成新密钥：密钥缺失、解析失败或公私钥不匹配时抛出异常，继续使用旧密钥。
+    """
+    global _keyring
+    keyring = _load_keyring(generate_missing=False)
+    with _keyring_lock:
+        _keyring = keyring
+    return keyring
+
+def _on_reload_signal(signum, frame):
+    try:
+        reload_keys()
+        print("✅ RSA keys reloaded")
+    except Exception as e:
+        logger.error("RSA key reload failed, keeping current keys: %s", e)
+        print(f"🚨 RSA key reload FAILED, still using the previous key pair: {e}")
+
+def install_reload_signal_handler():
+    """注册 SIGHUP：kill -HUP <pid> 触发 reload_keys()（每个 worker 进程需分别收到信号）"""
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, _on_reload_signal)
+
 def get_public_key():
-    ensure_keys_exist()
-    return _get_key_from_env_or_file("RSA_PUBLIC_KEY", PUBLIC_KEY_PATH)
+    return get_keyring().public_pem
 
 def decrypt_password(encrypted_password_b64: str):
+    # 登录/注册的热路径：只做解密和校验，失败原因写入 debug 日志而不是 stdout
+    try:
+        cipher = PKCS1_v1_5.new(get_keyring().private_key)
+    except Exception as e:
+        logger.error("RSA private key unavailable: %s", e)
+        return None
+
+    try:
+        encrypted_data = base64.b64decode(encrypted_password_b64)
+    except Exception as e:
+        logger.debug("Failed to decode base64: %s", e)
+        return None
+    
     try:
-        ensure_keys_exist()
-        private_key_content = _get_key_from_env_or_file("RSA_PRIVATE_KEY", PRIVATE_KEY_PATH)
-        
-        if not private_key_content:
-            print("❌ Private key not found")
-            return None
-        
-        # Debug: Show private key info (not the actual key!)
-        print(f"🔑 Private key loaded, length: {len(private_key_content)} chars")
-        print(f"🔑 Private key starts with: {private_key_content[:50]}...")
-
-        try:
-            private_key = RSA.import_key(private_key_content)
-            print(f"✅ Private key parsed successfully, size: {private_key.size_in_bits()} bits")
-        except Exception as e:
-            print(f"❌ Failed to parse private key: {e}")
-            return None
-            
-        cipher = PKCS1_v1_5.new(private_key)
-        
-        try:
-            encrypted_data = base64.b64decode(encrypted_password_b64)
-            print(f"📦 Encrypted data length: {len(encrypted_data)} bytes")
-        except Exception as e:
-            print(f"❌ Failed to decode base64: {e}")
-            return None
-        
         # sentinel is used to protect against Bleichenbacher's attack
         sentinel = os.urandom(32)
         decrypted_data = cipher.decrypt(encrypted_data, sentinel)
-        
-        if decrypted_data == sentinel:
-            print("❌ Decryption returned sentinel (key mismatch or invalid data)")
-            return None
-        
-        print(f"📦 Decrypted data length: {len(decrypted_data)} bytes")
-        
-        # Try to decode as UTF-8
-        try:
-            password = decrypted_data.decode('utf-8')
-        except UnicodeDecodeError as e:
-            print(f"❌ Failed to decode as UTF-8: {e}")
-            print(f"❌ Raw bytes (first 50): {decrypted_data[:50]}")
-            return None
-        
-        # Validate decrypted password length (bcrypt limit is 72 bytes)
-        password_bytes = len(password.encode('utf-8'))
-        if password_bytes > 72:
-            print(f"❌ Decrypted data too long ({password_bytes} bytes), likely decrypt mismatch")
-            return None
-        
-        # Basic sanity check - password shouldn't contain null bytes or be empty
-        if '\x00' in password or len(password) == 0:
-            print("❌ Decrypted password is invalid (empty or contains null bytes)")
-            return None
-            
-        print(f"✅ Password decrypted successfully (length: {len(password)} chars)")
-        return password
-        
     except Exception as e:
-        print(f"❌ Decryption failed with exception: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.debug("Decryption failed: %s", e)
         return None
-
-
-
+    
+    if decrypted_data == sentinel:
+        logger.debug("Decryption returned sentinel (key mismatch or invalid data)")
+        return None
+    
+    # Try to decode as UTF-8
+    try:
+        password = decrypted_data.decode('utf-8')
+    except UnicodeDecodeError as e:
+        logger.debug("Failed to decode as UTF-8: %s", e)
+        return None
+    
+    # Validate decrypted password length (bcrypt limit is 72 bytes)
+    password_bytes = len(password.encode('utf-8'))
+    if password_bytes > 72:
+        logger.debug("Decrypted data too long (%d bytes), likely decrypt mismatch", password_bytes)
+        return None
+    
+    # Basic sanity check - password shouldn't contain null bytes or be empty
+    if '\x00' in password or len(password) == 0:
+        logger.debug("Decrypted password is invalid (empty or contains null bytes)")
+        return None
+        
+    return password
@@ -0,0 +1,75 @@
+from decimal import Decimal, ROUND_HALF_EVEN
+
+from sqlalchemy import BigInteger
+from sqlalchemy.types import TypeDecorator
+
+# 定点数单位：价格和金额（成本、费用、盈亏）以百万分之一计，数量以千分之一股计。
+# 数据库中存 int64，账本引擎用整数运算，只在 API / 数据库边界换算成 float。
+PRICE_SCALE = 1_000_000
+QTY_SCALE = 1_000
+
+_EXACT_LIMIT = 2 ** 52
+
+def to_units(value, scale: int) -> int:
+    """十进制数值 -> 最接近的整数单位"""
+    if isinstance(value, int):
+        return value * scale
+    scaled = float(value) * scale
+    if abs(scaled) < _EXACT_LIMIT:
+        return round(scaled)
+    # 超出 float 能精确表示整数的范围时按十进制换算
+    return int((Decimal(str(value)) * scale).to_integral_value(rounding=ROUND_HALF_EVEN))
+
+def check_precision(value, scale: int):
+    """输入校验：超出 scale 精度的小数位会被 to_units 静默舍入，直接拒绝"""
+    if value is not None and not isinstance(value, int):
+        if (Decimal(str(value)) * scale) % 1 != 0:
+            raise ValueError(f"at most {len(str(scale)) - 1} decimal places allowed")
+    return value
+
+def from_units(units, scale: int):
+    """整数单位 -> float（也适用于 numpy 数组）"""
+    return units / scale
+
+def price_units(value) -> int:
+    return to_units(value, PRICE_SCALE)
+
+def qty_units(value) -> int:
+    return to_units(value, QTY_SCALE)
+
+def round_div(numerator: int, denominator: int) -> int:
+    """整数除法，四舍五入到最接近的整数（.5 向正无穷）"""
+    q, r = divmod(numerator, denominator)
+    if 2 * r >= denominator:
+        q += 1
+    return q
+
+def amount(price: int, qty: int) -> int:
+    """价格单位 × 数量单位 -> 金额单位"""
+    return round_div(price * qty, QTY_SCALE)
+
+def unit_cost(total: int, qty: int) -> int:
+    """金额单位 / 数量单位 -> 每股价格单位"""
+    return round_div(total * QTY_SCALE, qty)
+
+def prorate(total: int, part: int, whole: int) -> int:
+    """按数量比例分摊金额：total × part / whole，卖出全部时恰好等于 total"""
+    return round_div(total * part, whole)
+
+class FixedPoint(TypeDecorator):
+    """
+    以 BIGINT 保存的定点数列。Python 侧仍是 float，写入时换算成整数单位，
+    读出时除以 scale，因此 API 输入的十进制值（不超过 scale 的精度）可以原样返回。
+    """
+    impl = BigInteger
+    cache_ok = True
+
+    def __init__(self, scale: int):
+        super().__init__()
+        self.scale = scale
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else to_units(value, self.scale)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else value / self.scale
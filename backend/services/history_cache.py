@@ -0,0 +1,250 @@
+import os
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import datetime, date, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import akshare as ak
+import numpy as np
+import pandas as pd
+import yfinance as yf
+from sqlalchemy import delete
+from sqlalchemy.dialects.sqlite import insert
+from sqlmodel import Session, select
+
+from models import HistoryBar, HistorySync
+from services.quote_store import normalize_symbol
+from services.rate_limit import provider_slot
+
+# 内存中最多缓存多少个代码的日线序列
+HISTORY_CACHE_SYMBOLS = int(os.getenv("HISTORY_CACHE_SYMBOLS", "256"))
+# 最近一次同步在该时间内则直接使用本地数据，不再访问数据源
+HISTORY_RESYNC_MINUTES = float(os.getenv("HISTORY_RESYNC_MINUTES", "30"))
+# 同步数据源时按代码加锁所用的锁数量
+HISTORY_LOCK_STRIPES = 64
+
+_COLUMNS = ("open", "high", "low", "close", "volume")
+
+Bar = Tuple[str, Dict[str, float]]
+
+class _Series:
+    """一个代码的日线序列：按日期升序的日期列表 + 各字段的 NumPy 列"""
+
+    def __init__(self, rows: List[Bar], last_synced_date: Optional[str] = None, synced_at: Optional[datetime] = None):
+        self.dates = [d for d, _ in rows]
+        self.columns = {
+            name: np.array([bar[name] for _, bar in rows], dtype=np.int64 if name == "volume" else np.float64)
+            for name in _COLUMNS
+        }
+        self.last_synced_date = last_synced_date
+        self.synced_at = synced_at
+
+    def bar(self, i: int) -> Dict[str, float]:
+        return {
+            'open': float(self.columns['open'][i]),
+            'high': float(self.columns['high'][i]),
+            'low': float(self.columns['low'][i]),
+            'close': float(self.columns['close'][i]),
+            'volume': int(self.columns['volume'][i]),
+            'is_closed': True
+        }
+
+    def index_of(self, target_date: str) -> Optional[int]:
+        i = bisect_left(self.dates, target_date)
+        if i < len(self.dates) and self.dates[i] == target_date:
+            return i
+        return None
+
+    def append(self, rows: List[Bar]) -> "_Series":
+        """新数据从 rows[0] 的日期开始覆盖，之前的部分保持不变"""
+        cut = bisect_left(self.dates, rows[0][0])
+        kept = [(self.dates[i], self.bar(i)) for i in range(cut)]
+        return _Series(kept + rows, self.last_synced_date, self.synced_at)
+
+def _fetch_cn(symbol: str, start: Optional[str]) -> List[Bar]:
+    kwargs = {"start_date": start.replace("-", "")} if start else {}
+    with provider_slot("CN"):
+        df = ak.stock_zh_a_hist(symbol=symbol, period="daily", adjust="qfq", **kwargs)
+    if df is None or df.empty:
+        return []
+    rows = []
+    for d, o, h, l, c, v in zip(pd.to_datetime(df['日期']).dt.strftime('%Y-%m-%d'),
+                                df['开盘'], df['最高'], df['最低'], df['收盘'], df['成交量']):
+        if pd.isnull(c):
+            continue
+        close_val = float(c)
+        rows.append((d, {
+            'open': float(o) if pd.notnull(o) else close_val,
+            'high': float(h) if pd.notnull(h) else close_val,
+            'low': float(l) if pd.notnull(l) else close_val,
+            'close': close_val,
+            'volume': int(v) if pd.notnull(v) else 0
+        }))
+    return rows
+
+def _fetch_yf(symbol: str, market: str, start: Optional[str]) -> List[Bar]:
+    ticker = yf.Ticker(f"{symbol}.HK" if market == "HK" else symbol)
+    with provider_slot(market):
+        hist = ticker.history(start=start) if start else ticker.history(period="max")
+    if hist is None or hist.empty:
+        return []
+    rows = []
+    for idx, row in hist.iterrows():
+        if pd.isnull(row['Close']):
+            continue
+        close_val = float(row['Close'])
+        rows.append((idx.strftime('%Y-%m-%d'), {
+            'open': float(row['Open']) if pd.notnull(row['Open']) else close_val,
+            'high': float(row['High']) if pd.notnull(row['High']) else close_val,
+            'low': float(row['Low']) if pd.notnull(row['Low']) else close_val,
+            'close': close_val,
+            'volume': int(row['Volume']) if pd.notnull(row['Volume']) else 0
+        }))
+    return rows
+
+def _fetch_history(symbol: str, market: str, start: Optional[str] = None) -> List[Bar]:
+    if market == "CN":
+        return _fetch_cn(symbol, start)
+    if market in ("HK", "US"):
+        return _fetch_yf(symbol, market, start)
+    return []
+
+class HistoryCache:
+    """
+    本地日线历史缓存
+
+    每个代码第一次使用时下载一次完整历史并写入 HistoryBar 表，之后只从最后一根
+    已收盘的日线开始增量拉取；重叠的那根日线收盘价发生变化（复权因子变动）时
+    整段重新下载。查询在内存中的有序日期列表上二分查找，进程重启后从数据库恢复。
+    """
+
+    def __init__(self, max_symbols: int = HISTORY_CACHE_SYMBOLS, resync_minutes: float = HISTORY_RESYNC_MINUTES):
+        self.max_symbols = max_symbols
+        self.resync_after = timedelta(minutes=resync_minutes)
+        self._series: "OrderedDict[Tuple[str, str], _Series]" = OrderedDict()
+        self._lock = threading.Lock()
+        # 分段锁：同一代码总是映射到同一把锁，锁的数量固定，不随代码数量增长
+        self._key_locks = [threading.Lock() for _ in range(HISTORY_LOCK_STRIPES)]
+
+    def get_bar(self, symbol: str, market: str, target_date: str) -> Optional[Dict[str, float]]:
+        """指定交易日的日线，无数据（非交易日/未上市）返回 None"""
+        series = self._ensure(symbol, market, target_date)
+        i = series.index_of(target_date) if series else None
+        return series.bar(i) if i is not None else None
+
+    def latest_bar(self, symbol: str, market: str):
+        """最近一根日线，返回 (行情, 日期)"""
+        series = self._ensure(symbol, market, date.today().strftime("%Y-%m-%d"))
+        if not series or not series.dates:
+            return None, None
+        return series.bar(-1), series.dates[-1]
+
+    def tail(self, symbol: str, market: str, n: int) -> List[Bar]:
+        """最近 n 根日线，按日期升序"""
+        series = self._ensure(symbol, market, date.today().strftime("%Y-%m-%d"))
+        if not series:
+            return []
+        start = max(0, len(series.dates) - n)
+        return [(series.dates[i], series.bar(i)) for i in range(start, len(series.dates))]
+
+    def _key_lock(self, key) -> threading.Lock:
+        return self._key_locks[hash(key) % len(self._key_locks)]
+
+    def _ensure(self, symbol: str, market: str, target_date: str) -> Optional[_Series]:
+        if market not in ("CN", "HK", "US"):
+            return None
+        key = (market, normalize_symbol(symbol, market))
+        # 同一代码只有一个线程访问数据源，其余线程等待并复用结果（不同代码可能共用一把锁）
+        with self._key_lock(key):
+            with self._lock:
+                series = self._series.get(key)
+                if series is not None:
+                    self._series.move_to_end(key)
+            if series is None:
+                series = self._load(key)
+            if self._needs_sync(series, target_date):
+                try:
+                    series = self._sync(key, series)
+                except Exception as e:
+                    print(f"⚠️ Error syncing history for {key[1]}: {e}")
+            self._remember(key, series)
+            return series
+
+    def _needs_sync(self, series: _Series, target_date: str) -> bool:
+        if series.synced_at is None:
+            return True
+        # 已收盘的日线不会再变化
+        if series.last_synced_date and target_date <= series.last_synced_date:
+            return False
+        return datetime.utcnow() - series.synced_at >= self.resync_after
+
+    def _remember(self, key, series: _Series):
+        with self._lock:
+            self._series[key] = series
+            self._series.move_to_end(key)
+            while len(self._series) > self.max_symbols:
+                self._series.popitem(last=False)
+
+    def _load(self, key) -> _Series:
+        from database import engine
+        market, symbol = key
+        with Session(engine) as session:
+            state = session.get(HistorySync, (market, symbol))
+            if state is None:
+                return _Series([])
+            bars = session.exec(
+                select(HistoryBar).where(HistoryBar.market == market, HistoryBar.symbol == symbol).order_by(HistoryBar.date)
+            ).all()
+        rows = [(b.date, {name: getattr(b, name) for name in _COLUMNS}) for b in bars]
+        return _Series(rows, state.last_synced_date, state.synced_at)
+
+    def _sync(self, key, series: _Series) -> _Series:
+        market, symbol = key
+        anchor = series.last_synced_date
+        rows = _fetch_history(symbol, market, anchor) if anchor else []
+        full = anchor is None
+        if anchor:
+            i = series.index_of(anchor)
+            overlap = rows[0][1]['close'] if rows and rows[0][0] == anchor else None
+            # 重叠日线缺失或收盘价改变说明历史被重新复权，整段重新下载
+            if i is None or overlap is None or not np.isclose(overlap, series.columns['close'][i]):
+                full = True
+        if full:
+            rows = _fetch_history(symbol, market)
+
+        today = date.today().strftime("%Y-%m-%d")
+        closed = [d for d, _ in rows if d < today]
+        last_synced_date = closed[-1] if closed else anchor
+        self._store(key, rows, full, last_synced_date)
+
+        if full:
+            series = _Series(rows)
+        elif rows:
+            series = series.append(rows)
+        series.last_synced_date = last_synced_date
+        series.synced_at = datetime.utcnow()
+        return series
+
+    def _store(self, key, rows: List[Bar], replace: bool, last_synced_date: Optional[str]):
+        from database import engine
+        market, symbol = key
+        with Session(engine) as session:
+            if replace:
+                session.exec(delete(HistoryBar).where(HistoryBar.market == market, HistoryBar.symbol == symbol))
+            if rows:
+                stmt = insert(HistoryBar)
+                session.exec(
+                    stmt.on_conflict_do_update(
+                        index_elements=["market", "symbol", "date"],
+                        set_={name: stmt.excluded[name] for name in _COLUMNS}
+                    ),
+                    params=[dict(market=market, symbol=symbol, date=d, **bar) for d, bar in rows]
+                )
+            state = session.get(HistorySync, (market, symbol)) or HistorySync(market=market, symbol=symbol)
+            state.last_synced_date = last_synced_date
+            state.synced_at = datetime.utcnow()
+            session.add(state)
+            session.commit()
+
+history_cache = HistoryCache()
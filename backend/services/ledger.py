@@ -1,13 +1,14 @@
-from decimal import Decimal
 from typing import List, Dict, Any
 from models import Transaction
 from datetime import date
+from services.fixed_point import PRICE_SCALE, QTY_SCALE, price_units, qty_units, from_units, amount, unit_cost
 
 class FifoLedger:
     def __init__(self):
-        self.inventory = [] # List of {'date': date, 'price': Decimal, 'qty': Decimal}
-        self.realized_pnl = Decimal(0)
-        self.total_fees = Decimal(0)
+        # 价格/金额与数量都是定点整数单位（services/fixed_point.py）
+        self.inventory = [] # List of {'date': date, 'price': int, 'qty': int}
+        self.realized_pnl = 0
+        self.total_fees = 0
         
     def process_transactions(self, transactions: List[Transaction], update_snapshots: bool = False):
         # Ensure transactions are sorted by date
@@ -20,30 +21,32 @@ class FifoLedger:
                 self._process_buy(tx)
             elif tx.type == 'SELL':
                 pnl = self._process_sell(tx)
-                events.append({'tx': tx, 'realized_pnl': pnl})
+                events.append({'tx': tx, 'realized_pnl': from_units(pnl, PRICE_SCALE)})
             elif tx.type == 'DIVIDEND_CASH':
                 # Cash dividend reduces cost basis or treated as income? 
                 # Usually treated as income/realized PnL in simple ledgers, or reduces cost basis
                 # Let's treat as realized income for now
-                self.realized_pnl += tx.price # assuming price stores the total amount or amount/share * qty
+                self.realized_pnl += price_units(tx.price) # assuming price stores the total amount or amount/share * qty
                 # If quantity is provided, price is per share. 
                 # Let's assume price field holds the total amount for dividend type, or price * qty
-                total_div = tx.price * tx.quantity if tx.quantity else tx.price
+                total_div = amount(price_units(tx.price), qty_units(tx.quantity)) if tx.quantity else price_units(tx.price)
                 self.realized_pnl += total_div
             
-            self.total_fees += tx.fees
+            self.total_fees += price_units(tx.fees)
 
     def _process_buy(self, tx: Transaction):
+        quantity = qty_units(tx.quantity)
         self.inventory.append({
             'date': tx.date,
-            'price': tx.price,
-            'qty': tx.quantity,
-            'original_qty': tx.quantity
+            'price': price_units(tx.price),
+            'qty': quantity,
+            'original_qty': quantity
         })
 
-    def _process_sell(self, tx: Transaction) -> Decimal:
-        qty_to_sell = abs(tx.quantity)
-        realized_gain = Decimal(0)
+    def _process_sell(self, tx: Transaction) -> int:
+        qty_to_sell = abs(qty_units(tx.quantity))
+        price = price_units(tx.price)
+        realized_gain = 0
         
         # FIFO Consumption
         while qty_to_sell > 0 and self.inventory:
@@ -51,20 +54,20 @@ class FifoLedger:
             
             if lot['qty'] > qty_to_sell:
                 # Partial lot consumption
-                cost = lot['price'] * qty_to_sell
-                revenue = tx.price * qty_to_sell
+                cost = amount(lot['price'], qty_to_sell)
+                revenue = amount(price, qty_to_sell)
                 realized_gain += (revenue - cost)
                 
                 lot['qty'] -= qty_to_sell
                 qty_to_sell = 0
             else:
                 # Full lot consumption
-                amount = lot['qty']
-                cost = lot['price'] * amount
-                revenue = tx.price * amount
+                lot_qty = lot['qty']
+                cost = amount(lot['price'], lot_qty)
+                revenue = amount(price, lot_qty)
                 realized_gain += (revenue - cost)
                 
-                qty_to_sell -= amount
+                qty_to_sell -= lot_qty
                 self.inventory.pop(0)
                 
         # If we oversold (short), current logic doesn't support shorting well (negative inventory not implemented)
@@ -72,13 +75,13 @@ class FifoLedger:
 
     def get_holdings(self) -> Dict[str, Any]:
         total_qty = sum(item['qty'] for item in self.inventory)
-        total_cost = sum(item['qty'] * item['price'] for item in self.inventory)
-        avg_cost = total_cost / total_qty if total_qty > 0 else 0
+        total_cost = sum(amount(item['price'], item['qty']) for item in self.inventory)
+        avg_cost = unit_cost(total_cost, total_qty) if total_qty > 0 else 0
         
         return {
-            'quantity': total_qty,
-            'total_cost': total_cost,
-            'avg_cost': avg_cost,
-            'realized_pnl': self.realized_pnl,
-            'total_fees': self.total_fees
+            'quantity': from_units(total_qty, QTY_SCALE),
+            'total_cost': from_units(total_cost, PRICE_SCALE),
+            'avg_cost': from_units(avg_cost, PRICE_SCALE),
+            'realized_pnl': from_units(self.realized_pnl, PRICE_SCALE),
+            'total_fees': from_units(self.total_fees, PRICE_SCALE)
         }
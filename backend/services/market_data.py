@@ -1,75 +1,253 @@
 import akshare as ak
 import yfinance as yf
-from datetime import datetime, date, timedelta
+from datetime import datetime, date
 import pandas as pd
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from services.rate_limit import provider_slot, provider_for, ProviderUnavailable
+from services.history_cache import history_cache
+from services.trading_calendar import market_now
+from services.singleflight import SingleFlight
+from services.ttl_cache import TTLCache
+from services.quote_store import normalize_symbol
 
-def fetch_realtime_quote(symbol: str, market: str):
+# 相同 (market, symbol, date) 的价格查询、相同代码的诊断查询只发起一次上游请求
+price_flight = SingleFlight()
+diagnosis_flight = SingleFlight()
+# 诊断结果（基本面变化慢）按代码缓存
+diagnosis_cache = TTLCache(ttl=float(os.getenv("DIAGNOSIS_CACHE_TTL", "300")), max_entries=4096)
+
+def _load_cn_spot_table():
+    """下载 A 股全市场实时行情表，返回 {代码: 行情}"""
+    # 失败不在这里重试：由熔断器统计失败次数，调用方从行情缓存返回旧数据
+    try:
+        with provider_slot("CN"):
+            df = ak.stock_zh_a_spot_em()
+    except Exception as e:
+        print(f"Error fetching CN spot table: {e}")
+        return None
+
+    # 停牌股票没有最新价，留给历史行情兜底
+    df = df[df['最新价'].notna()]
+    close = df['最新价'].astype(float)
+    columns = zip(
+        df['代码'].astype(str),
+        df['今开'].astype(float).fillna(close),
+        df['最高'].astype(float).fillna(close),
+        df['最低'].astype(float).fillna(close),
+        close,
+        df['成交量'].fillna(0).astype('int64'),
+    )
+    return {
+        code: {
+            'open': float(o),
+            'high': float(h),
+            'low': float(l),
+            'close': float(c),
+            'volume': int(v),
+            'is_closed': False
+        }
+        for code, o, h, l, c, v in columns
+    }
+
+def _yf_ticker(symbol: str, market: str) -> str:
+    return f"{symbol}.HK" if market == "HK" else symbol
+
+def _download_yf_latest_bars(symbols, market: str):
+    """
+    一次多代码请求获取 HK/US 最新日线，返回 {代码: 行情}；
+    下载失败或缺失的代码不在结果中，由调用方走单代码兜底
+    """
+    tickers = {_yf_ticker(symbol, market): symbol for symbol in symbols}
+    try:
+        with provider_slot(market):
+            df = yf.download(list(tickers), period="5d", interval="1d", group_by="ticker",
+                             auto_adjust=False, threads=True, progress=False)
+            # 下载失败时 yfinance 通常返回空表（或全是 NaN）而不是抛异常，视为失败计入熔断
+            if df is None or df.dropna(how="all").empty:
+                raise RuntimeError("empty batch result")
+    except Exception as e:
+        print(f"Error batch downloading {market} quotes: {e}")
+        return {}
+
+    table = {}
+    for ticker, symbol in tickers.items():
+        try:
+            bars = df[ticker] if isinstance(df.columns, pd.MultiIndex) else df
+            bars = bars[bars['Close'].notna()]
+            if bars.empty:
+                continue
+            latest = bars.iloc[-1]
+            close_val = float(latest['Close'])
+            table[str(symbol).upper()] = {
+                'open': float(latest['Open']) if pd.notnull(latest['Open']) else close_val,
+                'high': float(latest['High']) if pd.notnull(latest['High']) else close_val,
+                'low': float(latest['Low']) if pd.notnull(latest['Low']) else close_val,
+                'close': close_val,
+                'volume': int(latest['Volume']) if pd.notnull(latest['Volume']) else 0,
+                'is_closed': False,
+                'date': bars.index[-1].strftime('%Y-%m-%d')
+            }
+        except Exception:
+            continue
+    return table
+
+class QuoteCache:
+    """
+    行情缓存（stale-while-revalidate）
+
+    未过期直接返回；过期但未超过 max_stale 时立即返回旧值并在后台刷新（同一 key 只刷新一次）；
+    没有缓存时同步加载。加载失败（返回 None 或抛异常）不写入缓存，
+    熔断打开期间也只返回旧值，不再访问数据源。TTL 按数据源配置。
+    """
+
+    def __init__(self, ttl: dict, max_stale: float, refresh_workers: int = 2):
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self._entries = {}  # key -> (value, fetched_at)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._refresh_pool = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix="quote-refresh")
+
+    def get(self, key, market: str, loader):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            value, fetched_at = entry
+            age = time.monotonic() - fetched_at
+            if age < self.ttl[provider_for(market)]:
+                return value
+            if age < self.max_stale:
+                self._refresh_in_background(key, loader)
+                return value
+        return self._load(key, loader)
+
+    def put(self, key, value):
+        if value is None:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+
+    def _load(self, key, loader):
+        try:
+            value = loader()
+        except ProviderUnavailable:
+            value = None
+        self.put(key, value)
+        return value
+
+    def _refresh_in_background(self, key, loader):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self._load(key, loader)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        self._refresh_pool.submit(refresh)
+
+quote_cache = QuoteCache(
+    ttl={
+        "akshare": float(os.getenv("AKSHARE_QUOTE_TTL", "30")),
+        "yfinance": float(os.getenv("YFINANCE_QUOTE_TTL", "60")),
+    },
+    max_stale=float(os.getenv("QUOTE_CACHE_MAX_STALE", "86400")),
+)
+
+class MarketSnapshot:
+    """
+    单个调度周期内的全市场行情快照
+
+    全市场行情表（如 A 股约 5000 行）每个市场只下载一次并按代码建立索引，
+    本周期内的所有查询都从索引中读取。HK/US 没有全市场表，通过 prefetch()
+    对本周期需要的代码发起一次批量请求。
+    """
+
+    _loaders = {"CN": _load_cn_spot_table}
+
+    def __init__(self):
+        self._tables = {}  # market -> {code: quote dict}; None when the download failed
+        self._locks = {market: threading.Lock() for market in ("CN", "HK", "US")}
+
+    def prefetch(self, market: str, symbols):
+        """HK/US: 一次多代码请求拉取所有代码的最新日线"""
+        if market not in ("HK", "US") or not symbols:
+            return
+        table = _download_yf_latest_bars(symbols, market)
+        for code, quote in table.items():
+            quote_cache.put(("realtime", market, code), quote)
+        with self._locks[market]:
+            self._tables.setdefault(market, {}).update(table)
+
+    def get(self, symbol: str, market: str):
+        if market not in self._locks:
+            return None
+        # 同一市场并发查询时只有第一个线程下载，其余等待结果
+        with self._locks[market]:
+            if market not in self._tables and market in self._loaders:
+                self._tables[market] = self._loaders[market]()
+                # 调度周期下载的全市场表同时刷新行情缓存，供接口读取
+                quote_cache.put(("spot", market), self._tables[market])
+            table = self._tables.get(market)
+        if table is None:
+            return None
+        return table.get(self._code(symbol, market))
+
+    @staticmethod
+    def _code(symbol: str, market: str) -> str:
+        return str(symbol).zfill(6) if market == "CN" else str(symbol).upper()
+
+def _fetch_yf_info_quote(symbol: str, market: str):
+    """HK/US 单代码实时行情"""
+    try:
+        stock = yf.Ticker(_yf_ticker(symbol, market))
+        with provider_slot(market):
+            info = stock.info
+        
+        return {
+            'open': info.get('open', 0),
+            'high': info.get('dayHigh', 0),
+            'low': info.get('dayLow', 0),
+            'close': info.get('currentPrice', info.get('previousClose', 0)),
+            'volume': info.get('volume', 0),
+            'is_closed': False
+        }
+    except Exception as e:
+        print(f"Error fetching {market} realtime data: {e}")
+        return None
+
+def fetch_realtime_quote(symbol: str, market: str, snapshot: MarketSnapshot = None):
     """
     获取实时行情数据（开盘、最高、最低、收盘、成交量）
+
+    传入 snapshot 时优先从本周期的快照中读取（A 股全市场表 / HK、US 批量日线），
+    HK/US 快照中缺失的代码再走单代码请求。不传 snapshot 时从行情缓存读取。
     """
     try:
         if market == "CN":
-            # A股实时行情 - 添加重试机制
-            max_retries = 3
-            import time
-            for attempt in range(max_retries):
-                try:
-                    df = ak.stock_zh_a_spot_em()
-                    clean_symbol = str(symbol).zfill(6)
-                    stock_data = df[df['代码'] == clean_symbol]
-                    
-                    if not stock_data.empty:
-                        return {
-                            'open': float(stock_data['今开'].values[0]),
-                            'high': float(stock_data['最高'].values[0]),
-                            'low': float(stock_data['最低'].values[0]),
-                            'close': float(stock_data['最新价'].values[0]),
-                            'volume': int(stock_data['成交量'].values[0]),
-                            'is_closed': False
-                        }
-                    break # 如果成功获取到 df 但没有数据，不需要重试，直接退出
-                except Exception as e:
-                    if attempt == max_retries - 1:
-                        print(f"Error fetching CN realtime data after {max_retries} attempts: {e}")
-                        return None
-                    time.sleep(2) # 等待 2 秒后重试
-                
-        elif market == "HK":
-            # 港股实时行情
-            try:
-                ticker = f"{symbol}.HK"
-                stock = yf.Ticker(ticker)
-                info = stock.info
-                
-                return {
-                    'open': info.get('open', 0),
-                    'high': info.get('dayHigh', 0),
-                    'low': info.get('dayLow', 0),
-                    'close': info.get('currentPrice', info.get('previousClose', 0)),
-                    'volume': info.get('volume', 0),
-                    'is_closed': False
-                }
-            except Exception as e:
-                print(f"Error fetching HK realtime data: {e}")
-                return None
-                
-        elif market == "US":
-            # 美股实时行情
-            try:
-                stock = yf.Ticker(symbol)
-                info = stock.info
-                
-                return {
-                    'open': info.get('open', 0),
-                    'high': info.get('dayHigh', 0),
-                    'low': info.get('dayLow', 0),
-                    'close': info.get('currentPrice', info.get('previousClose', 0)),
-                    'volume': info.get('volume', 0),
-                    'is_closed': False
-                }
-            except Exception as e:
-                print(f"Error fetching US realtime data: {e}")
-                return None
+            if snapshot is not None:
+                return snapshot.get(symbol, market)
+            table = quote_cache.get(("spot", market), market, _load_cn_spot_table)
+            return table.get(MarketSnapshot._code(symbol, market)) if table else None
+
+        if market not in ("HK", "US"):
+            return None
+        key = ("realtime", market, MarketSnapshot._code(symbol, market))
+        if snapshot is not None:
+            quote = snapshot.get(symbol, market)
+            if quote:
+                return quote
+            quote = _fetch_yf_info_quote(symbol, market)
+            quote_cache.put(key, quote)
+            return quote
+        return quote_cache.get(key, market, lambda: _fetch_yf_info_quote(symbol, market))
                 
     except Exception as e:
         print(f"Error in fetch_realtime_quote: {e}")
@@ -79,197 +257,86 @@ def fetch_historical_quote(symbol: str, market: str, target_date: str):
     """
     获取历史行情数据
     target_date: YYYY-MM-DD 格式
+
+    从本地历史缓存中二分查找，缓存只在缺少该日期时增量同步
     """
     try:
-        if market == "CN":
-            try:
-                clean_symbol = str(symbol).zfill(6)
-                df = ak.stock_zh_a_hist(symbol=clean_symbol, period="daily", adjust="qfq")
-                df['日期'] = pd.to_datetime(df['日期']).dt.strftime('%Y-%m-%d')
-                stock_data = df[df['日期'] == target_date]
-                
-                if not stock_data.empty:
-                    return {
-                        'open': float(stock_data['开盘'].values[0]),
-                        'high': float(stock_data['最高'].values[0]),
-                        'low': float(stock_data['最低'].values[0]),
-                        'close': float(stock_data['收盘'].values[0]),
-                        'volume': int(stock_data['成交量'].values[0]),
-                        'is_closed': True
-                    }
-            except Exception as e:
-                print(f"Error fetching CN historical data: {e}")
-                return None
-                
-        elif market in ["HK", "US"]:
-            try:
-                ticker = f"{symbol}.HK" if market == "HK" else symbol
-                stock = yf.Ticker(ticker)
-                hist = stock.history(start=target_date, end=(datetime.strptime(target_date, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d'))
-                
-                if not hist.empty:
-                    return {
-                        'open': float(hist['Open'].values[0]),
-                        'high': float(hist['High'].values[0]),
-                        'low': float(hist['Low'].values[0]),
-                        'close': float(hist['Close'].values[0]),
-                        'volume': int(hist['Volume'].values[0]),
-                        'is_closed': True
-                    }
-            except Exception as e:
-                print(f"Error fetching {market} historical data: {e}")
-                return None
+        return history_cache.get_bar(symbol, market, target_date)
     except Exception as e:
         print(f"Error in fetch_historical_quote: {e}")
         return None
 
-def fetch_latest_quote(symbol: str, market: str):
+def fetch_latest_quote(symbol: str, market: str, snapshot: MarketSnapshot = None):
     """
     获取最新的行情数据（优先今天，否则最近一个交易日）
     """
-    today_str = date.today().strftime("%Y-%m-%d")
-    
     # 1. 尝试实时行情 (不仅在开盘时尝试，收盘后通常也包含最后价格)
-    quote = fetch_realtime_quote(symbol, market)
+    quote = fetch_realtime_quote(symbol, market, snapshot)
     if quote:
-        return quote, today_str
+        # 批量日线自带所属交易日；没有日期的实时行情以交易所当地日期为准
+        # （美股交易时段跨越北京时间午夜，不能用服务器本地日期）
+        return quote, quote.get('date') or market_now(market).strftime("%Y-%m-%d")
             
     # 2. 尝试历史记录 (Back fallback)
     try:
-        if market == "CN":
-            # 确保 symbol 是 6 位字符串
-            clean_symbol = str(symbol).zfill(6)
-            df = ak.stock_zh_a_hist(symbol=clean_symbol, period="daily", adjust="qfq")
-            if not df.empty:
-                latest = df.iloc[-1]
-                return {
-                    'open': float(latest['开盘']),
-                    'high': float(latest['最高']),
-                    'low': float(latest['最低']),
-                    'close': float(latest['收盘']),
-                    'volume': int(latest['成交量']),
-                    'is_closed': True
-                }, pd.to_datetime(latest['日期']).strftime('%Y-%m-%d')
-        elif market in ["HK", "US"]:
-            ticker = f"{symbol}.HK" if market == "HK" else symbol
-            stock = yf.Ticker(ticker)
-            hist = stock.history(period="1d")
-            if not hist.empty:
-                latest_date = hist.index[-1].strftime('%Y-%m-%d')
-                return {
-                    'open': float(hist['Open'].iloc[-1]),
-                    'high': float(hist['High'].iloc[-1]),
-                    'low': float(hist['Low'].iloc[-1]),
-                    'close': float(hist['Close'].iloc[-1]),
-                    'volume': int(hist['Volume'].iloc[-1]),
-                    'is_closed': True
-                }, latest_date
+        latest, latest_date = history_cache.latest_bar(symbol, market)
+        if latest:
+            return latest, latest_date
     except Exception as e:
         print(f"⚠️ Error in fetch_latest_quote for {symbol}: {e}")
         
     return None, None
 
-def is_market_open(market: str):
-    now = datetime.now()
-    weekday = now.weekday()
-    hour = now.hour
-    minute = now.minute
-    if weekday >= 5: return False
-    
-    if market == "CN":
-        morning = (hour == 9 and minute >= 30) or (10 <= hour < 11) or (hour == 11 and minute < 30)
-        afternoon = (13 <= hour < 15) or (hour == 15 and minute == 0)
-        return morning or afternoon
-    elif market == "HK":
-        morning = (hour == 9 and minute >= 30) or (10 <= hour < 12) or (hour == 12 and minute == 0)
-        afternoon = (13 <= hour < 16) or (hour == 16 and minute == 0)
-        return morning or afternoon
-    elif market == "US":
-        # Simplified US market time check
-        return hour >= 22 or hour < 6
-    return False
-
-def fetch_price(symbol: str, market: str, target_date: str = None):
-    if target_date is None:
-        quote, q_date = fetch_latest_quote(symbol, market)
-        return quote['close'] if quote else None
-    
+def _fetch_and_save_price(symbol: str, market: str, target_date: str):
     quote = fetch_historical_quote(symbol, market, target_date)
-    if quote: return quote['close']
-    
-    if target_date == date.today().strftime("%Y-%m-%d"):
-        realtime = fetch_realtime_quote(symbol, market)
-        if realtime: return realtime['close']
-    
-    return None
+    if not quote and target_date == date.today().strftime("%Y-%m-%d"):
+        quote = fetch_realtime_quote(symbol, market)
+    if not quote:
+        return None
+
+    from database import engine
+    from sqlmodel import Session
+    from services.quote_store import save_market_quote
+    from services.snapshots import mark_symbol_dirty, refresh_snapshots
+    with Session(engine) as session:
+        # 写入共享行情，下次查询直接命中本地；已存在的行保持不变
+        if save_market_quote(session, market, symbol, target_date, quote, overwrite=False):
+            stocks = mark_symbol_dirty(session, market, symbol, target_date)
+            session.commit()
+            refresh_snapshots(session, stocks)
+    return quote['close']
+
+def fetch_and_save_price(symbol: str, market: str, target_date: str):
+    """
+    获取某日收盘价并写入共享行情表。
+    同一 (market, symbol, date) 的并发请求共享一次上游抓取。
+    """
+    key = (market, normalize_symbol(symbol, market), target_date)
+    return price_flight.do(key, lambda: _fetch_and_save_price(symbol, market, target_date))
 
-def fetch_and_save_history(stock_id: int, symbol: str, market: str, days: int = 14):
+def fetch_and_save_history(symbol: str, market: str, days: int = 14):
     """
-    获取最近 N 天的历史数据并保存到本地
+    获取最近 N 天的历史数据并保存到共享行情表
     """
     try:
-        if market == "CN":
-            clean_symbol = str(symbol).zfill(6)
-            df = ak.stock_zh_a_hist(symbol=clean_symbol, period="daily", adjust="qfq")
-            if df.empty: return False
-            
-            # 取最近 N 条
-            df = df.tail(days)
-            from database import engine
-            from sqlmodel import Session, select
-            from models import DailyQuote
-            with Session(engine) as session:
-                for _, row in df.iterrows():
-                    d_str = pd.to_datetime(row['日期']).strftime('%Y-%m-%d')
-                    # 检查是否已存在
-                    existing = session.exec(
-                        select(DailyQuote).where(DailyQuote.stock_id == stock_id, DailyQuote.date == d_str)
-                    ).first()
-                    if not existing:
-                        close_val = float(row['收盘'])
-                        new_q = DailyQuote(
-                            stock_id=stock_id,
-                            date=d_str,
-                            open=float(row['开盘']) if pd.notnull(row['开盘']) else close_val,
-                            high=float(row['最高']) if pd.notnull(row['最高']) else close_val,
-                            low=float(row['最低']) if pd.notnull(row['最低']) else close_val,
-                            close=close_val,
-                            volume=int(row['成交量']) if pd.notnull(row['成交量']) else 0,
-                            is_manual=False
-                        )
-                        session.add(new_q)
-                session.commit()
-            return True
-        elif market in ["HK", "US"]:
-            ticker = f"{symbol}.HK" if market == "HK" else symbol
-            stock = yf.Ticker(ticker)
-            hist = stock.history(period=f"{days}d")
-            if hist.empty: return False
-            
-            from database import engine
-            from sqlmodel import Session, select
-            from models import DailyQuote
-            with Session(engine) as session:
-                for idx, row in hist.iterrows():
-                    d_str = idx.strftime('%Y-%m-%d')
-                    existing = session.exec(
-                        select(DailyQuote).where(DailyQuote.stock_id == stock_id, DailyQuote.date == d_str)
-                    ).first()
-                    if not existing:
-                        close_val = float(row['Close'])
-                        new_q = DailyQuote(
-                            stock_id=stock_id,
-                            date=d_str,
-                            open=float(row['Open']) if pd.notnull(row['Open']) else close_val,
-                            high=float(row['High']) if pd.notnull(row['High']) else close_val,
-                            low=float(row['Low']) if pd.notnull(row['Low']) else close_val,
-                            close=close_val,
-                            volume=int(row['Volume']) if pd.notnull(row['Volume']) else 0,
-                            is_manual=False
-                        )
-                        session.add(new_q)
-                session.commit()
-            return True
+        # 取最近 N 条
+        rows = history_cache.tail(symbol, market, days)
+        if not rows: return False
+
+        from database import engine
+        from sqlmodel import Session
+        from services.quote_store import upsert_market_quotes
+        from services.snapshots import mark_symbol_dirty, refresh_snapshots
+        with Session(engine) as session:
+            # 一条 INSERT ... ON CONFLICT DO NOTHING：已存在的行情保持不变，只补充缺失的日期
+            inserted = upsert_market_quotes(
+                session, [(market, symbol, d_str, data) for d_str, data in rows], overwrite=False
+            )
+            # 新写入的历史行情需要让所有持有者的快照从最早的新日期开始重算，失效标记与行情同一事务提交
+            stocks = mark_symbol_dirty(session, market, symbol, min(d for _, _, d in inserted)) if inserted else []
+            session.commit()
+            refresh_snapshots(session, stocks)
+        return True
     except Exception as e:
         print(f"⚠️ Error syncing history for {symbol}: {e}")
     return False
@@ -277,6 +344,7 @@ def fetch_and_save_history(stock_id: int, symbol: str, market: str, days: int =
 def fetch_diagnosis_data(symbol: str):
     """
     获取股票详细诊断信息 (详细行情 + 基本面概要)
+    结果按代码缓存 DIAGNOSIS_CACHE_TTL 秒；同一代码的并发请求共享一次上游抓取。
     """
     # 尝试自动判断市场 (简单逻辑: 6位数字且不是以 0 开头或特定规律通常是 A 股)
     # 或者尝试从 symbols 列表中匹配也可以，但为了通用，我们尝试多种方案
@@ -287,10 +355,21 @@ def fetch_diagnosis_data(symbol: str):
     elif len(symbol) <= 5 and symbol.isdigit():
         market = "HK"
     
+    key = (market, symbol)
+    cached = diagnosis_cache.get(key)
+    if cached is not None:
+        return cached
+    data = diagnosis_flight.do(key, lambda: _fetch_diagnosis_data(symbol, market))
+    if data:
+        diagnosis_cache.set(key, data)
+    return data
+
+def _fetch_diagnosis_data(symbol: str, market: str):
     try:
         if market == "CN":
             clean_symbol = str(symbol).zfill(6)
-            df = ak.stock_individual_info_em(symbol=clean_symbol)
+            with provider_slot("CN"):
+                df = ak.stock_individual_info_em(symbol=clean_symbol)
             if df.empty:
                 return None
             
@@ -320,7 +399,8 @@ def fetch_diagnosis_data(symbol: str):
         elif market in ["HK", "US"]:
             ticker = f"{symbol}.HK" if market == "HK" else symbol
             stock = yf.Ticker(ticker)
-            info = stock.info
+            with provider_slot(market):
+                info = stock.info
             
             return {
                 "symbol": symbol,
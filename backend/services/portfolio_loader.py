@@ -0,0 +1,64 @@
+from typing import List, Dict
+from collections import defaultdict
+from sqlmodel import Session, select, func
+from models import Stock, Transaction, AssetSnapshot
+from services.analytics import PortfolioAnalyzer
+from services.snapshots import refresh_snapshots
+
+class StockPosition:
+    """Transactions and the most recent snapshot rows of one stock, loaded in bulk."""
+
+    def __init__(self, stock: Stock, transactions: List[Transaction], snapshots: List[AssetSnapshot]):
+        self.stock = stock
+        self.transactions = transactions
+        self.snapshots = snapshots  # oldest first
+
+    @property
+    def current_price(self) -> float:
+        return self.snapshots[-1].close if self.snapshots else 0.0
+
+    def get_snapshot(self):
+        analyzer = PortfolioAnalyzer(self.transactions, [])
+        return analyzer.get_snapshot(self.current_price)
+
+def load_positions(session: Session, stocks: List[Stock], recent: int = 7) -> Dict[int, StockPosition]:
+    """
+    批量加载多只股票的交易记录和最近 `recent` 条快照。
+
+    不论股票数量多少，干净状态下只需要三条查询：检查点、交易、快照。
+    """
+    if not stocks:
+        return {}
+    refresh_snapshots(session, stocks)
+    stock_ids = [stock.id for stock in stocks]
+
+    tx_by_stock = defaultdict(list)
+    for tx in session.exec(select(Transaction).where(Transaction.stock_id.in_(stock_ids))).all():
+        tx_by_stock[tx.stock_id].append(tx)
+
+    # 每只股票按日期倒序编号，只取最近 recent 行
+    ranked = (
+        select(
+            AssetSnapshot.id,
+            func.row_number().over(
+                partition_by=AssetSnapshot.stock_id,
+                order_by=AssetSnapshot.date.desc()
+            ).label("rn")
+        )
+        .where(AssetSnapshot.stock_id.in_(stock_ids))
+        .subquery()
+    )
+    snapshots_by_stock = defaultdict(list)
+    rows = session.exec(
+        select(AssetSnapshot)
+        .join(ranked, AssetSnapshot.id == ranked.c.id)
+        .where(ranked.c.rn <= recent)
+        .order_by(AssetSnapshot.stock_id, AssetSnapshot.date)
+    ).all()
+    for row in rows:
+        snapshots_by_stock[row.stock_id].append(row)
+
+    return {
+        stock.id: StockPosition(stock, tx_by_stock[stock.id], snapshots_by_stock[stock.id])
+        for stock in stocks
+    }
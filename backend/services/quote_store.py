@@ -0,0 +1,135 @@
+from typing import List, Optional, Dict, Any, Iterable, Tuple
+from datetime import datetime
+from sqlalchemy.dialects.sqlite import insert
+from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from models import Stock, DailyQuote, MarketQuote
+
+def normalize_symbol(symbol: str, market: str) -> str:
+    """Canonical symbol used to key the shared MarketQuote table."""
+    symbol = str(symbol).strip().upper()
+    if market == "CN" and symbol.isdigit():
+        symbol = symbol.zfill(6)
+    return symbol
+
+def _quote_queries(stock: Stock, after: Optional[str] = None):
+    shared_query = select(MarketQuote).where(MarketQuote.market == stock.market, MarketQuote.symbol == stock.symbol)
+    manual_query = select(DailyQuote).where(DailyQuote.stock_id == stock.id)
+    if after is not None:
+        shared_query = shared_query.where(MarketQuote.date > after)
+        manual_query = manual_query.where(DailyQuote.date > after)
+    return shared_query, manual_query
+
+def _merge_quotes(stock: Stock, shared: Iterable[MarketQuote], manual: Iterable[DailyQuote]) -> List[DailyQuote]:
+    quote_map = {
+        q.date: DailyQuote(
+            stock_id=stock.id,
+            date=q.date,
+            open=q.open,
+            close=q.close,
+            high=q.high,
+            low=q.low,
+            volume=q.volume,
+            is_manual=False
+        )
+        for q in shared
+    }
+    for q in manual:
+        quote_map[q.date] = q
+    return sorted(quote_map.values(), key=lambda x: x.date)
+
+def load_quotes(session: Session, stock: Stock, after: Optional[str] = None) -> List[DailyQuote]:
+    """
+    获取某只股票的行情序列：共享行情 + 该用户的手动覆盖（同一天以手动为准）
+
+    Shared rows are returned as transient DailyQuote objects (id=None) so callers
+    keep working with a single quote type.
+    """
+    shared_query, manual_query = _quote_queries(stock, after)
+    return _merge_quotes(stock, session.exec(shared_query).all(), session.exec(manual_query).all())
+
+async def load_quotes_async(session: AsyncSession, stock: Stock, after: Optional[str] = None) -> List[DailyQuote]:
+    """load_quotes() 的异步版本，供 async 请求处理函数使用"""
+    shared_query, manual_query = _quote_queries(stock, after)
+    shared = (await session.exec(shared_query)).all()
+    manual = (await session.exec(manual_query)).all()
+    return _merge_quotes(stock, shared, manual)
+
+def get_quote(session: Session, stock: Stock, target_date: str) -> Optional[DailyQuote]:
+    """单日行情，手动覆盖优先"""
+    manual = session.exec(
+        select(DailyQuote).where(DailyQuote.stock_id == stock.id, DailyQuote.date == target_date)
+    ).first()
+    if manual:
+        return manual
+    shared = session.exec(
+        select(MarketQuote).where(
+            MarketQuote.market == stock.market,
+            MarketQuote.symbol == stock.symbol,
+            MarketQuote.date == target_date
+        )
+    ).first()
+    if not shared:
+        return None
+    return DailyQuote(stock_id=stock.id, date=shared.date, open=shared.open, close=shared.close,
+                      high=shared.high, low=shared.low, volume=shared.volume, is_manual=False)
+
+def _market_quote_row(market: str, symbol: str, target_date: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'market': market,
+        'symbol': normalize_symbol(symbol, market),
+        'date': target_date,
+        'open': data.get('open', 0),
+        'high': data.get('high', 0),
+        'low': data.get('low', 0),
+        'close': data['close'],
+        'volume': data.get('volume', 0),
+        'updated_at': datetime.utcnow()
+    }
+
+def upsert_market_quotes(session: Session, rows: Iterable[Tuple[str, str, str, Dict[str, Any]]], overwrite: bool = True) -> List[Tuple[str, str, str]]:
+    """
+    批量写入共享行情（不提交）：一条 INSERT ... ON CONFLICT 语句，无逐行查询。
+    rows: (market, symbol, date, data)。返回实际写入的 (market, symbol, date)。
+    overwrite=False 时已存在的行保持不变（用于历史回补）。
+    """
+    params = [_market_quote_row(*row) for row in rows]
+    if not params:
+        return []
+    stmt = insert(MarketQuote)
+    if overwrite:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["market", "symbol", "date"],
+            set_={name: stmt.excluded[name] for name in ("open", "high", "low", "close", "volume", "updated_at")}
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=["market", "symbol", "date"])
+    stmt = stmt.returning(MarketQuote.market, MarketQuote.symbol, MarketQuote.date)
+    return [tuple(row) for row in session.execute(stmt, params).all()]
+
+def save_market_quote(session: Session, market: str, symbol: str, target_date: str, data: Dict[str, Any], overwrite: bool = True) -> bool:
+    """
+    写入单条共享行情（不提交）。返回是否有数据写入。
+    """
+    return bool(upsert_market_quotes(session, [(market, symbol, target_date, data)], overwrite=overwrite))
+
+def save_manual_quote(session: Session, stock_id: int, target_date: str, data: Dict[str, Any]) -> DailyQuote:
+    """
+    写入用户手动行情（不提交）：(stock_id, date) 上 INSERT ... ON CONFLICT DO UPDATE。
+    手动行情只由用户自己的操作写入，自动抓取只写共享表，不会覆盖它们。
+    """
+    values = {name: data[name] for name in ("open", "high", "low", "close", "volume") if name in data}
+    # 新行缺少的字段用收盘价补齐；已存在的行只更新传入的字段
+    stmt = insert(DailyQuote).values(
+        stock_id=stock_id, date=target_date, is_manual=True,
+        **{'open': data['close'], 'high': data['close'], 'low': data['close'], 'volume': 0, **values}
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["stock_id", "date"],
+        set_={**values, "is_manual": True}
+    )
+    session.execute(stmt)
+    return session.exec(
+        select(DailyQuote).where(DailyQuote.stock_id == stock_id, DailyQuote.date == target_date)
+        .execution_options(populate_existing=True)
+    ).one()
@@ -0,0 +1,123 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+class ProviderLimiter:
+    """
+    Bounded concurrency plus a minimum spacing between calls to one upstream provider.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, rate_per_second: float):
+        self.name = name
+        self._semaphore = threading.BoundedSemaphore(max(1, max_concurrency))
+        self._interval = 1.0 / rate_per_second if rate_per_second > 0 else 0.0
+        self._next_at = 0.0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self):
+        with self._semaphore:
+            if self._interval:
+                with self._lock:
+                    now = time.monotonic()
+                    wait = self._next_at - now
+                    self._next_at = max(now, self._next_at) + self._interval
+                if wait > 0:
+                    time.sleep(wait)
+            yield
+
+class ProviderUnavailable(Exception):
+    """熔断打开期间拒绝访问上游数据源"""
+
+class CircuitBreaker:
+    """
+    连续失败 failure_threshold 次后熔断，冷却时间按熔断次数指数退避（上限 max_backoff）。
+    冷却结束后放行一次试探请求：成功则恢复，失败则再次熔断。
+    """
+
+    def __init__(self, name: str, failure_threshold: int, base_backoff: float, max_backoff: float):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._failures = 0
+        self._trips = 0
+        self._open_until = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._trips == 0:
+                return True
+            if self._probing or time.monotonic() < self._open_until:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._trips:
+                print(f"✅ {self.name} recovered, circuit closed")
+            self._failures = 0
+            self._trips = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                self._trips += 1
+                backoff = min(self.max_backoff, self.base_backoff * 2 ** (self._trips - 1))
+                self._open_until = time.monotonic() + backoff
+                self._failures = 0
+                self._probing = False
+                print(f"⚠️ {self.name} circuit open for {backoff:g}s after repeated failures")
+
+# 每个上游数据源独立限流，可通过环境变量调整
+limiters = {
+    "akshare": ProviderLimiter(
+        "akshare",
+        int(os.getenv("AKSHARE_MAX_CONCURRENCY", "2")),
+        float(os.getenv("AKSHARE_RATE_LIMIT", "2")),
+    ),
+    "yfinance": ProviderLimiter(
+        "yfinance",
+        int(os.getenv("YFINANCE_MAX_CONCURRENCY", "4")),
+        float(os.getenv("YFINANCE_RATE_LIMIT", "5")),
+    ),
+}
+
+# 每个上游数据源独立熔断
+breakers = {
+    name: CircuitBreaker(
+        name,
+        int(os.getenv("PROVIDER_FAILURE_THRESHOLD", "5")),
+        float(os.getenv("PROVIDER_BACKOFF_SECONDS", "10")),
+        float(os.getenv("PROVIDER_MAX_BACKOFF_SECONDS", "600")),
+    )
+    for name in limiters
+}
+
+def provider_for(market: str) -> str:
+    return "akshare" if market == "CN" else "yfinance"
+
+@contextmanager
+def provider_slot(market: str):
+    """
+    Context manager wrapping one network call to the provider serving `market`.
+    Raises ProviderUnavailable while the provider's circuit is open; an exception
+    inside the block counts as a failure.
+    """
+    name = provider_for(market)
+    breaker = breakers[name]
+    if not breaker.allow():
+        raise ProviderUnavailable(f"{name} circuit open")
+    with limiters[name].slot():
+        try:
+            yield
+        except Exception:
+            breaker.record_failure()
+            raise
+    breaker.record_success()
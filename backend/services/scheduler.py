@@ -1,125 +1,175 @@
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
-from datetime import datetime, date
-from sqlmodel import Session, select
+from apscheduler.triggers.interval import IntervalTrigger
+from datetime import datetime, timedelta
+from sqlmodel import Session, select, func
 from database import engine
-from models import Stock, DailyQuote
-from services.market_data import fetch_realtime_quote, fetch_historical_quote, is_market_open, fetch_latest_quote
+from models import Stock
+from services.market_data import fetch_latest_quote, MarketSnapshot
+from services.trading_calendar import MARKET_SESSIONS, is_market_open, is_trading_day, refresh_trading_calendar
+from services.stock_search import symbol_directory, SYMBOL_DIRECTORY_REFRESH_HOURS
+from services.snapshots import mark_symbols_dirty, refresh_snapshots
+from services.quote_store import upsert_market_quotes
+from concurrent.futures import ThreadPoolExecutor
 import logging
+import os
+import time
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 scheduler = BackgroundScheduler()
 
-def update_all_quotes():
+# 抓取线程池大小；各数据源的并发与频率限制见 services/rate_limit.py
+QUOTE_FETCH_WORKERS = int(os.getenv("QUOTE_FETCH_WORKERS", "8"))
+# 交易时段内的轮询间隔（分钟）
+QUOTE_POLL_MINUTES = int(os.getenv("QUOTE_POLL_MINUTES", "5"))
+
+# 最近一次行情更新周期的统计（持仓数、去重后的代码数、去重比等）
+last_cycle_stats = {}
+
+def _fetch_quote(key, snapshot: MarketSnapshot):
+    market, symbol = key
+    try:
+        # 优先获取最新价格 (可能是实时或最近交易日)
+        return fetch_latest_quote(symbol, market, snapshot)
+    except Exception as e:
+        logger.error(f"Error fetching quote for {symbol}: {e}")
+        return None, None
+
+def update_all_quotes(markets=None):
     """
-    更新所有股票的行情数据
+    更新所有股票的行情数据，markets 为空时更新全部市场
+
+    抓取阶段在有界线程池中并发执行（各数据源独立限流），
+    所有结果在周期结束时通过一个事务批量写入。
     """
     logger.info("Starting quote update task...")
-    
+    started = time.monotonic()
+
+    with Session(engine) as session:
+        # 行情按 (market, symbol) 共享，多个用户持有同一代码只抓取一次
+        holdings = session.exec(
+            select(Stock.market, Stock.symbol, func.count(Stock.id)).group_by(Stock.market, Stock.symbol)
+        ).all()
+    if markets is not None:
+        holdings = [row for row in holdings if row[0] in markets]
+    if not holdings:
+        logger.info("No stocks to update.")
+        return
+    keys = [(market, symbol) for market, symbol, _ in holdings]
+
+    # 本周期共用一份全市场快照，每个市场只下载一次；HK/US 批量请求一次
+    snapshot = MarketSnapshot()
+    with ThreadPoolExecutor(max_workers=QUOTE_FETCH_WORKERS, thread_name_prefix="quote-fetch") as pool:
+        list(pool.map(
+            lambda m: snapshot.prefetch(m, [symbol for market, symbol in keys if market == m]),
+            [m for m in ("HK", "US") if markets is None or m in markets]
+        ))
+        results = list(zip(keys, pool.map(lambda key: _fetch_quote(key, snapshot), keys)))
+
+    rows = []
+    for (market, symbol), (quote_data, quote_date) in results:
+        if not quote_data:
+            continue
+        # 如果返回的日期是今天，则更新/插入今天的记录
+        # 如果返回的是之前的日期，且数据库没有当天的价格，则作为最新价格插入
+        # 手动录入的行情是用户级覆盖，读取时优先，这里无需跳过
+        # fetch_latest_quote 对没有日期的实时行情已按交易所当地日期补全
+        rows.append((market, symbol, quote_date, quote_data))
+
     with Session(engine) as session:
-        stocks = session.exec(select(Stock)).all()
-        today = date.today().strftime("%Y-%m-%d")
-        
-        for stock in stocks:
-            try:
-                # 检查今天的记录是否已存在
-                existing_quote = session.exec(
-                    select(DailyQuote).where(
-                        DailyQuote.stock_id == stock.id,
-                        DailyQuote.date == today
-                    )
-                ).first()
-                
-                if existing_quote and existing_quote.is_manual:
-                    continue
-
-                # 优先获取最新价格 (可能是实时或最近交易日)
-                quote_data, quote_date = fetch_latest_quote(stock.symbol, stock.market)
-                
-                if quote_data:
-                    # 如果返回的日期是今天，则更新/插入今天的记录
-                    # 如果返回的是之前的日期，且数据库没有当天的价格，则作为最新价格插入
-                    target_date = quote_date if quote_date else today
-                    
-                    target_quote = session.exec(
-                        select(DailyQuote).where(
-                            DailyQuote.stock_id == stock.id,
-                            DailyQuote.date == target_date
-                        )
-                    ).first()
-                    
-                    if target_quote:
-                        if not target_quote.is_manual:
-                            target_quote.open = quote_data.get('open', target_quote.open)
-                            target_quote.high = quote_data.get('high', target_quote.high)
-                            target_quote.low = quote_data.get('low', target_quote.low)
-                            target_quote.close = quote_data['close']
-                            target_quote.volume = quote_data.get('volume', target_quote.volume)
-                            session.add(target_quote)
-                    else:
-                        new_quote = DailyQuote(
-                            stock_id=stock.id,
-                            date=target_date,
-                            open=quote_data.get('open', 0),
-                            high=quote_data.get('high', 0),
-                            low=quote_data.get('low', 0),
-                            close=quote_data['close'],
-                            volume=quote_data.get('volume', 0),
-                            is_manual=False
-                        )
-                        session.add(new_quote)
-                    
-                    logger.info(f"Updated quote for {stock.symbol} on {target_date}: {quote_data['close']}")
-                
-            except Exception as e:
-                logger.error(f"Error updating quote for {stock.symbol}: {e}")
-                continue
-        
+        try:
+            # 整个周期的行情用一条 INSERT ... ON CONFLICT 语句写入
+            upsert_market_quotes(session, rows)
+        except Exception as e:
+            logger.error(f"Error saving quotes: {e}")
+            return
+        for market, symbol, target_date, quote_data in rows:
+            logger.info(f"Updated quote for {symbol} on {target_date}: {quote_data['close']}")
+        # 一次查询找出所有持有者，一条批量 UPDATE 标记快照失效
+        updated_stocks = mark_symbols_dirty(session, {(market, symbol): target_date for market, symbol, target_date, _ in rows})
+
         session.commit()
-        logger.info("Quote update task completed.")
+        # 只从本次写入的日期开始重算快照
+        refresh_snapshots(session, updated_stocks)
 
-def start_scheduler():
-    # ... (same as before)
-    scheduler.add_job(
-        update_all_quotes,
-        trigger=CronTrigger(minute='*/5'),
-        id='update_quotes_5min',
-        name='Update stock quotes every 5 minutes',
-        replace_existing=True
+    holding_count = sum(count for _, _, count in holdings)
+    last_cycle_stats.update({
+        "finished_at": datetime.utcnow().isoformat(),
+        "markets": sorted(markets) if markets is not None else None,
+        "holdings": holding_count,
+        "symbols": len(keys),
+        "dedup_ratio": round(holding_count / len(keys), 2),
+        "fetched": len(rows),
+        "failed": len(keys) - len(rows),
+        "stocks_refreshed": len(updated_stocks),
+        "elapsed_seconds": round(time.monotonic() - started, 2),
+    })
+    logger.info(
+        f"Quote update task completed: {holding_count} holdings -> {len(keys)} symbols "
+        f"(dedup {last_cycle_stats['dedup_ratio']}x), {len(rows)} fetched, "
+        f"{len(keys) - len(rows)} failed in {last_cycle_stats['elapsed_seconds']}s"
     )
-    # ... other jobs
-    scheduler.start()
 
-# For simplicity, keeping the start_scheduler logic
+def poll_market(market: str):
+    """交易时段内的高频轮询；午休、休市日直接跳过，不访问数据源"""
+    if not is_market_open(market):
+        return
+    update_all_quotes([market])
+
+def settle_market(market: str):
+    """收盘后的结算抓取，每个交易日一次，写入当日收盘价"""
+    if not is_trading_day(market):
+        logger.info(f"{market} market closed today, skipping settlement.")
+        return
+    logger.info(f"Settling {market} quotes after market close...")
+    update_all_quotes([market])
+
 def start_scheduler():
+    for market, spec in MARKET_SESSIONS.items():
+        first_hour = spec["sessions"][0][0].hour
+        last_hour = spec["sessions"][-1][1].hour
+        # cron 只覆盖交易时段所在的小时（交易所时区），精确的开收盘/午休/节假日由 poll_market 判断
+        scheduler.add_job(
+            poll_market,
+            args=[market],
+            trigger=CronTrigger(day_of_week='mon-fri', hour=f'{first_hour}-{last_hour}',
+                                minute=f'*/{QUOTE_POLL_MINUTES}', timezone=spec["tz"]),
+            id=f'poll_quotes_{market.lower()}',
+            name=f'Poll {market} stock quotes during trading hours',
+            replace_existing=True
+        )
+        scheduler.add_job(
+            settle_market,
+            args=[market],
+            trigger=CronTrigger(day_of_week='mon-fri', hour=spec["settle"].hour,
+                                minute=spec["settle"].minute, timezone=spec["tz"]),
+            id=f'settle_quotes_{market.lower()}',
+            name=f'Settle {market} stock quotes after market close',
+            replace_existing=True
+        )
+    # 代码目录先从磁盘快照加载，过期时后台刷新；之后按固定间隔刷新
+    symbol_directory.warm_start()
+    # 快照缺失或过期时 warm_start 已触发首次刷新，这里不传 next_run_time，
+    # 由 IntervalTrigger 正常排期（显式传 None 会让任务以暂停状态加入）
+    directory_job = {}
+    if not symbol_directory.is_stale:
+        directory_job["next_run_time"] = datetime.fromtimestamp(symbol_directory.loaded_at) + timedelta(hours=SYMBOL_DIRECTORY_REFRESH_HOURS)
     scheduler.add_job(
-        update_all_quotes,
-        trigger=CronTrigger(minute='*/5'),
-        id='update_quotes_5min',
-        name='Update stock quotes every 5 minutes',
-        replace_existing=True
-    )
-    scheduler.add_job(
-        update_all_quotes,
-        trigger=CronTrigger(hour=15, minute=5),
-        id='update_quotes_cn_close',
-        name='Update CN stock quotes after market close',
-        replace_existing=True
-    )
-    scheduler.add_job(
-        update_all_quotes,
-        trigger=CronTrigger(hour=16, minute=5),
-        id='update_quotes_hk_close',
-        name='Update HK stock quotes after market close',
-        replace_existing=True
+        symbol_directory.refresh,
+        trigger=IntervalTrigger(hours=SYMBOL_DIRECTORY_REFRESH_HOURS),
+        id='refresh_symbol_directory',
+        name='Refresh CN/HK/US symbol directory',
+        replace_existing=True,
+        **directory_job
     )
     scheduler.add_job(
-        update_all_quotes,
-        trigger=CronTrigger(hour=6, minute=5),
-        id='update_quotes_us_close',
-        name='Update US stock quotes after market close',
+        refresh_trading_calendar,
+        trigger=CronTrigger(day_of_week='sun', hour=3),
+        id='refresh_trading_calendar',
+        name='Refresh exchange holiday calendar',
+        next_run_time=datetime.now(),
         replace_existing=True
     )
     scheduler.start()
@@ -0,0 +1,178 @@
+from typing import List, Dict, Any, Optional, Tuple
+from datetime import datetime
+from sqlalchemy import bindparam, or_, tuple_, update
+from sqlmodel import Session, select, delete, insert
+from models import Stock, Transaction, DailyQuote, AssetSnapshot, SnapshotCheckpoint
+from services.analytics import build_timeline_columns
+from services.quote_store import load_quotes, normalize_symbol
+import numpy as np
+
+def mark_dirty(session: Session, stock_id: int, from_date: str):
+    """
+    标记某只股票从 from_date 起的快照已失效（不提交，由调用方 commit）
+    """
+    checkpoint = session.get(SnapshotCheckpoint, stock_id)
+    if checkpoint is None:
+        # 没有检查点本身就意味着需要全量重建，无需记录
+        return
+    if checkpoint.dirty_from is None or from_date < checkpoint.dirty_from:
+        checkpoint.dirty_from = from_date
+        checkpoint.updated_at = datetime.utcnow()
+        session.add(checkpoint)
+
+def mark_symbols_dirty(session: Session, dirty: Dict[Tuple[str, str], str]) -> List[Stock]:
+    """
+    共享行情写入后，标记所有持有这些代码的股票快照失效，返回这些股票（不提交）
+    dirty: {(market, symbol): 最早写入日期}。一次查询持有者 + 一条批量 UPDATE，与用户数无关
+    """
+    if not dirty:
+        return []
+    keys = {(market, normalize_symbol(symbol, market)): d for (market, symbol), d in dirty.items()}
+    stocks = session.exec(select(Stock).where(tuple_(Stock.market, Stock.symbol).in_(list(keys)))).all()
+    if stocks:
+        table = SnapshotCheckpoint.__table__
+        # 没有检查点的股票本身就需要全量重建，UPDATE 不会命中它们
+        stmt = (
+            update(table)
+            .where(table.c.stock_id == bindparam("sid"))
+            .where(or_(table.c.dirty_from.is_(None), table.c.dirty_from > bindparam("from_date")))
+            .values(dirty_from=bindparam("from_date"), updated_at=datetime.utcnow())
+        )
+        session.connection().execute(stmt, [
+            {"sid": stock.id, "from_date": keys[(stock.market, stock.symbol)]} for stock in stocks
+        ])
+    return stocks
+
+def mark_symbol_dirty(session: Session, market: str, symbol: str, from_date: str) -> List[Stock]:
+    """
+    共享行情写入后，标记所有持有该代码的股票快照失效，返回这些股票
+    """
+    return mark_symbols_dirty(session, {(market, symbol): from_date})
+
+def refresh_snapshots(session: Session, stocks: List[Stock]):
+    """
+    重新计算失效的快照，只从每只股票最早的失效日期开始向后重放
+    """
+    if not stocks:
+        return
+    stock_ids = [stock.id for stock in stocks]
+    checkpoints = {
+        cp.stock_id: cp for cp in session.exec(
+            select(SnapshotCheckpoint).where(SnapshotCheckpoint.stock_id.in_(stock_ids))
+        ).all()
+    }
+
+    rebuilt = False
+    for stock in stocks:
+        checkpoint = checkpoints.get(stock.id)
+        if checkpoint is not None and checkpoint.dirty_from is None:
+            continue
+
+        _rebuild_from(session, stock, checkpoint.dirty_from if checkpoint else None)
+
+        if checkpoint is None:
+            checkpoint = SnapshotCheckpoint(stock_id=stock.id)
+        checkpoint.dirty_from = None
+        checkpoint.updated_at = datetime.utcnow()
+        session.add(checkpoint)
+        rebuilt = True
+
+    if rebuilt:
+        session.commit()
+
+def _rebuild_from(session: Session, stock: Stock, from_date: Optional[str]):
+    # Resume from the last snapshot strictly before the dirty date
+    seed = None
+    if from_date is not None:
+        seed = session.exec(
+            select(AssetSnapshot)
+            .where(AssetSnapshot.stock_id == stock.id, AssetSnapshot.date < from_date)
+            .order_by(AssetSnapshot.date.desc())
+        ).first()
+
+    tx_query = select(Transaction).where(Transaction.stock_id == stock.id)
+    delete_query = delete(AssetSnapshot).where(AssetSnapshot.stock_id == stock.id)
+    start = None
+    if seed is not None:
+        tx_query = tx_query.where(Transaction.date > seed.date)
+        delete_query = delete_query.where(AssetSnapshot.date > seed.date)
+        start = {
+            "qty": seed.holdings_qty,
+            "cost_basis": seed.cost_basis_fifo,
+            "total_cost": seed.total_cost,
+            "realized_pnl": seed.realized_pnl,
+        }
+
+    transactions = session.exec(tx_query).all()
+    quotes = with_close_position_quotes(load_quotes(session, stock, after=seed.date if seed else None), transactions)
+    timeline = build_timeline_columns(transactions, quotes, start)
+
+    session.exec(delete_query)
+    if not len(timeline):
+        return
+    prev_total_pnl = seed.total_pnl if seed is not None else 0.0
+    daily_pnl = np.diff(timeline.total_pnl, prepend=prev_total_pnl)
+    columns = zip(
+        timeline.dates,
+        timeline.close.tolist(),
+        timeline.qty.tolist(),
+        timeline.cost_basis.tolist(),
+        timeline.total_cost.tolist(),
+        timeline.market_value.tolist(),
+        daily_pnl.tolist(),
+        timeline.total_pnl.tolist(),
+        timeline.realized_pnl.tolist(),
+    )
+    session.exec(insert(AssetSnapshot), params=[
+        {
+            "stock_id": stock.id,
+            "user_id": stock.user_id,
+            "date": d,
+            "close": close,
+            "holdings_qty": qty,
+            "cost_basis_fifo": cost_basis,
+            "total_cost": total_cost,
+            "market_value": market_value,
+            "daily_pnl": daily,
+            "total_pnl": total_pnl,
+            "realized_pnl": realized_pnl,
+        }
+        for d, close, qty, cost_basis, total_cost, market_value, daily, total_pnl, realized_pnl in columns
+    ])
+
+def with_close_position_quotes(quotes: List[DailyQuote], transactions: List[Transaction]) -> List[DailyQuote]:
+    """
+    补充平仓记录中的价格到行情中，确保时间线包含这些日期
+    """
+    quote_map = { (q.date if isinstance(q.date, str) else q.date.strftime('%Y-%m-%d')): q for q in quotes }
+    for tx in transactions:
+        d_str = tx.date if isinstance(tx.date, str) else tx.date.strftime('%Y-%m-%d')
+        if d_str not in quote_map and tx.type == 'CLOSE_POSITION':
+            quote_map[d_str] = DailyQuote(
+                stock_id=tx.stock_id,
+                date=d_str,
+                open=tx.price,
+                high=tx.price,
+                low=tx.price,
+                close=tx.price,
+                volume=0,
+                is_manual=False
+            )
+    return sorted(quote_map.values(), key=lambda x: (x.date if isinstance(x.date, str) else x.date.strftime('%Y-%m-%d')))
+
+def snapshot_to_timeline_entry(row: AssetSnapshot) -> Dict[str, Any]:
+    """Render a persisted row in the same shape as build_timeline() entries."""
+    unrealized_pnl = row.market_value - row.cost_basis_fifo
+    return {
+        "date": row.date,
+        "close": row.close,
+        "qty": row.holdings_qty,
+        "avg_cost": row.total_cost / row.holdings_qty if row.holdings_qty > 0 else 0,
+        "cost_basis": row.cost_basis_fifo,
+        "total_cost": row.total_cost,
+        "market_value": row.market_value,
+        "unrealized_pnl": unrealized_pnl,
+        "realized_pnl": row.realized_pnl,
+        "total_pnl": row.total_pnl,
+        "unrealized_pnl_percent": (unrealized_pnl / row.cost_basis_fifo * 100) if row.cost_basis_fifo > 0 else 0
+    }
@@ -1,105 +1,286 @@
 import akshare as ak
-import pandas as pd
-from typing import List, Dict
+import numpy as np
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import List, Dict, Optional, Tuple
 
-# Simple in-memory cache
-_cache_cn = None
-_cache_hk = None
+from services.rate_limit import provider_slot
 
-def get_cn_stocks():
-    """Fetch A-Share list. Priority: Lighter list API -> Spot API."""
-    global _cache_cn
-    if _cache_cn is not None and not _cache_cn.empty:
-        return _cache_cn
+try:
+    from pypinyin import lazy_pinyin, Style
+except ImportError:  # 没有 pypinyin 时不建立拼音首字母索引
+    lazy_pinyin = None
 
+MARKETS = ("CN", "HK", "US")
+
+# 目录快照格式版本，字段变化时递增，旧快照会被忽略
+SNAPSHOT_VERSION = 1
+# 超过该时间的目录视为过期，启动后在后台刷新
+SYMBOL_DIRECTORY_REFRESH_HOURS = float(os.getenv("SYMBOL_DIRECTORY_REFRESH_HOURS", "24"))
+
+def _snapshot_path() -> str:
+    """默认与数据库文件放在同一目录（容器中为持久化卷）"""
+    path = os.getenv("SYMBOL_DIRECTORY_PATH")
+    if path:
+        return path
+    from database import sqlite_file_name
+    return os.path.join(os.path.dirname(sqlite_file_name), "symbol_directory.npz")
+
+def _fetch_cn_listing() -> List[Tuple[str, str]]:
+    """A-Share list. Priority: Lighter list API -> Spot API."""
     # Strategy 1: Lighter 'code-name' list (fast, less prone to blocks)
     try:
-        df = ak.stock_info_a_code_name()
+        with provider_slot("CN"):
+            df = ak.stock_info_a_code_name()
         if not df.empty and 'code' in df.columns:
-            # Rename columns to match our internal standard if needed, or just use as is
-            # df has 'code', 'name'
-            _cache_cn = df
-            return _cache_cn
+            return list(zip(df['code'].astype(str), df['name'].astype(str)))
     except Exception as e:
         print(f"Strategy 1 (List) failed: {e}")
 
     # Strategy 2: Spot EM (Full details, higher failure rate)
     try:
-        df = ak.stock_zh_a_spot_em()
+        with provider_slot("CN"):
+            df = ak.stock_zh_a_spot_em()
         if not df.empty:
-            # Standardize columns: '代码'->'code', '名称'->'name'
-            df = df.rename(columns={'代码': 'code', '名称': 'name'})
-            _cache_cn = df
-            return _cache_cn
+            return list(zip(df['代码'].astype(str), df['名称'].astype(str)))
     except Exception as e:
         print(f"Strategy 2 (Spot) failed: {e}")
+    return []
 
-    return pd.DataFrame()
-
-def get_hk_stocks():
-    global _cache_hk
-    if _cache_hk is not None and not _cache_hk.empty:
-        return _cache_hk
-        
+def _fetch_hk_listing() -> List[Tuple[str, str]]:
     try:
-        df = ak.stock_hk_spot_em()
+        with provider_slot("CN"):
+            df = ak.stock_hk_spot_em()
         if not df.empty:
-            df = df.rename(columns={'代码': 'code', '名称': 'name'})
-            _cache_hk = df
+            return list(zip(df['代码'].astype(str), df['名称'].astype(str)))
     except Exception as e:
         print(f"HK Fetch failed: {e}")
-        return pd.DataFrame() # Return empty DF but don't cache failure forever if we want retry logic
-        
-    return _cache_hk if _cache_hk is not None else pd.DataFrame()
-
-def search_stocks(query: str) -> List[Dict]:
-    results = []
-    query = query.strip()
-    if not query:
-        return []
+    return []
 
-    # 1. Search CN (A-Shares)
+def _fetch_us_listing() -> List[Tuple[str, str]]:
     try:
-        df_cn = get_cn_stocks()
-        if not df_cn.empty:
-            # Filter matches
-            mask = df_cn['code'].astype(str).str.contains(query, case=False) | \
-                   df_cn['name'].astype(str).str.contains(query, case=False)
-            
-            matched = df_cn[mask].head(10)
-            for _, row in matched.iterrows():
-                results.append({
-                    "symbol": row['code'],
-                    "name": row['name'],
-                    "market": "CN"
-                })
+        with provider_slot("CN"):
+            df = ak.stock_us_spot_em()
+        if not df.empty:
+            # 代码形如 "105.AAPL"，去掉交易所编号
+            codes = df['代码'].astype(str).str.split('.').str[-1].str.upper()
+            return list(zip(codes, df['名称'].astype(str)))
     except Exception as e:
-        print(f"CN Search Error: {e}")
+        print(f"US Fetch failed: {e}")
+    return []
 
-    # 2. Search HK Stocks
-    try:
-        df_hk = get_hk_stocks()
-        if not df_hk.empty:
-            mask = df_hk['code'].astype(str).str.contains(query, case=False) | \
-                   df_hk['name'].astype(str).str.contains(query, case=False)
-            
-            matched = df_hk[mask].head(5)
-            for _, row in matched.iterrows():
-                results.append({
-                    "symbol": row['code'],
-                    "name": row['name'],
-                    "market": "HK"
-                })
-    except Exception as e:
-        print(f"HK Search Error: {e}")
-        
-    # 3. Basic US Handling
-    # If user queries a pure ASCII alpha string (e.g. "AAPL"), suggest it as US
-    if query.isascii() and query.isalpha() and len(query) <= 5:
-        results.append({
-            "symbol": query.upper(),
-            "name": f"{query.upper()} (US Stock)",
-            "market": "US"
-        })
-
-    return results
+_fetchers = {"CN": _fetch_cn_listing, "HK": _fetch_hk_listing, "US": _fetch_us_listing}
+
+def name_initials(name: str) -> str:
+    """拼音首字母，如 贵州茅台 -> gzmt；非汉字部分原样保留（只保留字母数字）"""
+    if lazy_pinyin is None:
+        return ""
+    return "".join(c for c in "".join(lazy_pinyin(name, style=Style.FIRST_LETTER)).lower() if c.isalnum())
+
+def enumerate_pairs(columns):
+    """按市场顺序拼接后的 (key, entry id)"""
+    return ((key, i) for i, key in enumerate(key for column in columns for key in column))
+
+class _PrefixIndex:
+    """排好序的 (key, entry id) 列表，前缀查询二分定位区间"""
+
+    def __init__(self, pairs):
+        pairs = sorted((k, i) for k, i in pairs if k)
+        self.keys = [k for k, _ in pairs]
+        self.ids = [i for _, i in pairs]
+
+    def lookup(self, prefix: str):
+        lo = bisect_left(self.keys, prefix)
+        hi = bisect_left(self.keys, prefix + "\uffff")
+        return self.ids[lo:hi]
+
+class _DirectoryIndex:
+    """
+    一份不可变的代码目录及其索引：代码/名称/拼音首字母的前缀索引，
+    以及名称上的二元组倒排索引（子串查询）。刷新时整体重建后替换。
+    """
+
+    def __init__(self, listings: Dict[str, List[Tuple[str, str]]], initials: Optional[Dict[str, List[str]]] = None):
+        self.listings = listings
+        self.entries: List[Tuple[str, str, str]] = []  # (market, code, name)
+        for market in MARKETS:
+            self.entries.extend((market, code, name) for code, name in listings.get(market, []))
+        # 拼音首字母计算较慢，从快照加载时直接复用
+        if initials is None:
+            initials = {market: [name_initials(name) for _, name in listings.get(market, [])] for market in MARKETS}
+        self.initials = initials
+
+        # 精确查找：market -> {代码: 名称}
+        self.by_code = {market: {code.upper(): name for code, name in listings.get(market, [])} for market in MARKETS}
+
+        codes = [code.lower() for _, code, _ in self.entries]
+        names = [name.lower() for _, _, name in self.entries]
+        self.codes = codes
+        self.names = names
+        self.code_index = _PrefixIndex((c, i) for i, c in enumerate(codes))
+        self.name_index = _PrefixIndex((n, i) for i, n in enumerate(names))
+        self.initials_index = _PrefixIndex(enumerate_pairs(initials[market] for market in MARKETS))
+
+        # 子串索引：名称与代码的每个字符/二元组 -> entry id
+        self.grams: Dict[str, List[int]] = {}
+        for i, (c, n) in enumerate(zip(codes, names)):
+            for text in (c, n):
+                for gram in {text[j:j + 2] for j in range(len(text) - 1)} | set(text):
+                    self.grams.setdefault(gram, []).append(i)
+
+    def _substring(self, q: str):
+        if len(q) == 1:
+            candidates = self.grams.get(q, [])
+        else:
+            postings = [self.grams.get(q[j:j + 2], []) for j in range(len(q) - 1)]
+            if not all(postings):
+                return []
+            candidates = min(postings, key=len)
+        return [i for i in candidates if q in self.codes[i] or q in self.names[i]]
+
+    def search(self, query: str, limit: int) -> List[int]:
+        q = query.strip().lower()
+        if not q:
+            return []
+        seen, ordered = set(), []
+        # 排序：代码精确匹配 > 代码前缀 > 名称/拼音首字母前缀 > 子串
+        tiers = (
+            lambda: [i for i in self.code_index.lookup(q) if self.codes[i] == q],
+            lambda: self.code_index.lookup(q),
+            lambda: sorted(set(self.name_index.lookup(q)) | set(self.initials_index.lookup(q))),
+            lambda: self._substring(q),
+        )
+        for tier in tiers:
+            for i in tier():
+                if i not in seen:
+                    seen.add(i)
+                    ordered.append(i)
+                    if len(ordered) >= limit:
+                        return ordered
+        return ordered
+
+class SymbolDirectory:
+    """
+    CN/HK/US 股票代码目录：全市场列表只在刷新时下载，查询全部在内存索引中完成。
+    刷新在后台执行，某个市场下载失败时保留上一份列表。
+
+    每次刷新后写入磁盘快照（代码/名称/拼音首字母数组 + 版本与时间戳），
+    进程启动时先加载快照，过期时再在后台刷新，避免重启后集中下载全市场列表。
+    """
+
+    def __init__(self):
+        self._index: Optional[_DirectoryIndex] = None
+        self._refresh_lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._snapshot_checked = False
+        self.loaded_at: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._index is not None
+
+    @property
+    def is_stale(self) -> bool:
+        return self.loaded_at is None or time.time() - self.loaded_at >= SYMBOL_DIRECTORY_REFRESH_HOURS * 3600
+
+    def load_snapshot(self) -> bool:
+        """从磁盘快照加载目录，返回是否成功"""
+        with self._load_lock:
+            self._snapshot_checked = True
+            path = _snapshot_path()
+            if not os.path.exists(path):
+                return False
+            try:
+                with np.load(path, allow_pickle=False) as data:
+                    if int(data["version"]) != SNAPSHOT_VERSION:
+                        print(f"⚠️ Ignoring symbol directory snapshot with version {int(data['version'])}")
+                        return False
+                    listings = {m: list(zip(data[f"{m}_codes"].tolist(), data[f"{m}_names"].tolist())) for m in MARKETS}
+                    initials = {m: data[f"{m}_initials"].tolist() for m in MARKETS}
+                    created_at = float(data["created_at"])
+            except Exception as e:
+                print(f"⚠️ Failed to load symbol directory snapshot: {e}")
+                return False
+            if self._index is None:
+                self._index = _DirectoryIndex(listings, initials)
+                self.loaded_at = created_at
+                print(f"📇 Symbol directory loaded from snapshot: " + ", ".join(f"{m} {len(listings[m])}" for m in MARKETS))
+            return True
+
+    def save_snapshot(self):
+        index = self._index
+        if index is None:
+            return
+        path = _snapshot_path()
+        arrays = {"version": np.array(SNAPSHOT_VERSION), "created_at": np.array(self.loaded_at)}
+        for m in MARKETS:
+            rows = index.listings.get(m, [])
+            arrays[f"{m}_codes"] = np.array([code for code, _ in rows], dtype=str)
+            arrays[f"{m}_names"] = np.array([name for _, name in rows], dtype=str)
+            arrays[f"{m}_initials"] = np.array(index.initials.get(m, []), dtype=str)
+        try:
+            # 先写临时文件再替换，其他进程不会读到写了一半的快照
+            tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+            np.savez_compressed(tmp_path, **arrays)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"⚠️ Failed to save symbol directory snapshot: {e}")
+
+    def refresh(self):
+        """下载全部市场列表并重建索引（阻塞，由调度器或后台线程调用）"""
+        if not self._refresh_lock.acquire(blocking=False):
+            return  # 已有刷新在进行
+        try:
+            previous = self._index.listings if self._index else {}
+            listings = {}
+            for market in MARKETS:
+                rows = _fetchers[market]()
+                listings[market] = rows or previous.get(market, [])
+            if any(listings.values()):
+                self._index = _DirectoryIndex(listings)
+                self.loaded_at = time.time()
+                print(f"📇 Symbol directory loaded: " + ", ".join(f"{m} {len(listings[m])}" for m in MARKETS))
+                self.save_snapshot()
+        finally:
+            self._refresh_lock.release()
+
+    def refresh_in_background(self):
+        threading.Thread(target=self.refresh, name="symbol-directory-refresh", daemon=True).start()
+
+    def warm_start(self):
+        """启动时调用：加载快照，缺失或过期时在后台刷新"""
+        self.load_snapshot()
+        if self.is_stale:
+            self.refresh_in_background()
+
+    def lookup(self, code: str, market: str) -> Optional[str]:
+        """精确查找代码，返回名称；不在目录中返回 None"""
+        index = self._index
+        if index is None:
+            return None
+        return index.by_code.get(market, {}).get(str(code).upper())
+
+    def has_listing(self, market: str) -> bool:
+        """该市场的全量列表是否已加载（可用于判断代码是否存在）"""
+        index = self._index
+        return index is not None and bool(index.by_code.get(market))
+
+    def search(self, query: str, limit: int = 10) -> List[Dict]:
+        if self._index is None and not self._snapshot_checked:
+            self.load_snapshot()
+        index = self._index
+        if index is None:
+            # 目录尚未加载（首次启动且没有快照），先触发后台加载，本次返回空
+            self.refresh_in_background()
+            return []
+        return [
+            {"symbol": index.entries[i][1], "name": index.entries[i][2], "market": index.entries[i][0]}
+            for i in index.search(query, limit)
+        ]
+
+symbol_directory = SymbolDirectory()
+
+def search_stocks(query: str, limit: int = 10) -> List[Dict]:
+    return symbol_directory.search(query, limit)
@@ -0,0 +1,126 @@
+import os
+import threading
+import warnings
+from typing import Dict, List, Optional, Tuple
+
+import yfinance as yf
+from yfinance.exceptions import YFTickerMissingError
+
+from services.rate_limit import provider_slot, ProviderUnavailable
+from services.singleflight import SingleFlight
+from services.stock_search import symbol_directory
+from services.ttl_cache import TTLCache
+
+# history(raise_errors=True) 在新版 yfinance 中会给出弃用警告，这里只需要它的抛错行为
+warnings.filterwarnings("ignore", message="'raise_errors' deprecated", category=DeprecationWarning)
+
+# 远程验证结果的缓存时间：存在的代码长期有效，不存在的代码过一段时间允许重新验证
+TICKER_POSITIVE_TTL = float(os.getenv("TICKER_POSITIVE_TTL", str(7 * 24 * 3600)))
+TICKER_NEGATIVE_TTL = float(os.getenv("TICKER_NEGATIVE_TTL", "3600"))
+# 可选的本地有效代码列表（CSV：market,symbol[,name]），用于补充代码目录
+VALID_TICKERS_PATH = os.getenv("VALID_TICKERS_PATH")
+
+class TickerValidator:
+    """
+    HK/US 代码验证
+
+    1. 本地列表：代码目录中的 HK/US 全量列表，以及可选的 VALID_TICKERS_PATH 文件；
+       某市场的全量列表已加载时，不在列表中的代码直接视为不存在，不访问网络
+    2. 正向缓存 / 带 TTL 的负向缓存：保存远程验证结果
+    3. 远程验证（yfinance fast_info），同一代码的并发验证只请求一次
+    """
+
+    def __init__(self):
+        self._positive = TTLCache(ttl=TICKER_POSITIVE_TTL, max_entries=10000)
+        self._negative = TTLCache(ttl=TICKER_NEGATIVE_TTL, max_entries=10000)
+        self._flight = SingleFlight()
+        self._local: Optional[Dict[Tuple[str, str], str]] = None
+        self._local_lock = threading.Lock()
+
+    def _local_list(self) -> Dict[Tuple[str, str], str]:
+        with self._local_lock:
+            if self._local is None:
+                self._local = {}
+                if VALID_TICKERS_PATH and os.path.exists(VALID_TICKERS_PATH):
+                    with open(VALID_TICKERS_PATH, encoding="utf-8") as f:
+                        for line in f:
+                            parts = [p.strip() for p in line.split(",")]
+                            if len(parts) >= 2 and parts[0].upper() in ("HK", "US") and parts[1]:
+                                market, symbol = parts[0].upper(), parts[1].upper()
+                                self._local[(market, symbol)] = parts[2] if len(parts) > 2 and parts[2] else symbol
+                    print(f"📇 Loaded {len(self._local)} valid tickers from {VALID_TICKERS_PATH}")
+            return self._local
+
+    @staticmethod
+    def _directory_code(symbol: str, market: str) -> str:
+        # 目录中的港股代码为 5 位
+        return symbol.zfill(5) if market == "HK" and symbol.isdigit() else symbol
+
+    def match_query(self, q: str, known: List[dict]) -> List[dict]:
+        """
+        把搜索词当作 HK/US 代码验证（q / q.HK / q.US），返回 known 中还没有的结果。
+        港股代码按目录的 5 位格式比较（700 与 00700 视为同一只）。
+        """
+        if not q or not all(ord(c) < 128 for c in q):
+            return []
+        ticker = q.strip().upper()
+        candidates = [ticker] if "." in ticker else [ticker, f"{ticker}.HK", f"{ticker}.US"]
+        seen = {(r["market"], self._directory_code(r["symbol"], r["market"])) for r in known}
+        matches = []
+        for candidate in candidates:
+            market = "HK" if candidate.endswith(".HK") else "US"
+            symbol = candidate.replace(".HK", "").replace(".US", "")
+            key = (market, self._directory_code(symbol, market))
+            if key in seen:
+                continue
+            name = self.validate(symbol, market)
+            if name:
+                seen.add(key)
+                matches.append({"symbol": symbol, "name": name, "market": market})
+        return matches
+
+    def validate(self, symbol: str, market: str) -> Optional[str]:
+        """代码存在时返回名称，否则返回 None"""
+        symbol = symbol.strip().upper()
+        if not symbol or market not in ("HK", "US"):
+            return None
+        key = (market, symbol)
+
+        name = self._local_list().get(key) or symbol_directory.lookup(self._directory_code(symbol, market), market)
+        if name:
+            return name
+        if symbol_directory.has_listing(market):
+            return None
+
+        name = self._positive.get(key)
+        if name:
+            return name
+        if key in self._negative:
+            return None
+        return self._flight.do(key, lambda: self._probe(symbol, market))
+
+    def _probe(self, symbol: str, market: str) -> Optional[str]:
+        key = (market, symbol)
+        ticker = f"{symbol}.HK" if market == "HK" else symbol
+        try:
+            with provider_slot(market):
+                tkr = yf.Ticker(ticker)
+                try:
+                    # raise_errors 让网络错误 / 限流直接抛出（计入熔断，不写负向缓存）；
+                    # 只有 Yahoo 明确返回无数据（YFTickerMissingError）才视为代码不存在
+                    tkr.history(period="5d", raise_errors=True)
+                    exchange = tkr.get_history_metadata().get('exchangeName')
+                except YFTickerMissingError:
+                    exchange = None
+        except ProviderUnavailable:
+            return None  # 熔断期间无法判断，不写入负向缓存
+        except Exception as e:
+            print(f"⚠️ Ticker probe failed for {ticker}: {e}")
+            return None  # 临时故障，不缓存结果
+        if exchange:
+            self._positive.set(key, symbol)
+            return symbol
+        self._negative.set(key, True)
+        return None
+
+ticker_validator = TickerValidator()
@@ -0,0 +1,146 @@
+import csv
+import os
+import threading
+from datetime import datetime, date, time, timedelta
+from typing import Dict, List, Optional, Set
+from zoneinfo import ZoneInfo
+
+import akshare as ak
+from sqlalchemy.dialects.sqlite import insert
+from sqlmodel import Session, select
+
+from models import MarketHoliday
+from services.rate_limit import provider_slot
+
+# 各市场交易时段（交易所当地时间），午休不在时段内；settle 为收盘后结算抓取时间
+MARKET_SESSIONS = {
+    "CN": {
+        "tz": ZoneInfo("Asia/Shanghai"),
+        "sessions": [(time(9, 30), time(11, 30)), (time(13, 0), time(15, 0))],
+        "settle": time(15, 5),
+    },
+    "HK": {
+        "tz": ZoneInfo("Asia/Hong_Kong"),
+        "sessions": [(time(9, 30), time(12, 0)), (time(13, 0), time(16, 0))],
+        "settle": time(16, 10),
+    },
+    "US": {
+        "tz": ZoneInfo("America/New_York"),
+        "sessions": [(time(9, 30), time(16, 0))],
+        "settle": time(16, 5),
+    },
+}
+
+# 港美股休市日（交易所公告）保存在随代码发布的 CSV（market,date,name）中，每年交易所公布下一年
+# 安排后追加；A 股由 sync_cn_holidays() 从交易日历同步。也可直接在 marketholiday 表中增删
+MARKET_HOLIDAYS_PATH = os.getenv("MARKET_HOLIDAYS_PATH") or os.path.join(os.path.dirname(__file__), "market_holidays.csv")
+
+_holidays: Optional[Dict[str, Set[str]]] = None
+_holidays_lock = threading.Lock()
+
+def market_now(market: str) -> datetime:
+    """交易所当地时间"""
+    return datetime.now(MARKET_SESSIONS[market]["tz"])
+
+def _holiday_set(market: str) -> Set[str]:
+    global _holidays
+    with _holidays_lock:
+        if _holidays is None:
+            from database import engine
+            loaded: Dict[str, Set[str]] = {}
+            with Session(engine) as session:
+                for m, d in session.exec(select(MarketHoliday.market, MarketHoliday.date)).all():
+                    loaded.setdefault(m, set()).add(d)
+            _holidays = loaded
+        return _holidays.get(market, set())
+
+def reload_holidays():
+    """休市日表变更后调用，下次查询时重新加载"""
+    global _holidays
+    with _holidays_lock:
+        _holidays = None
+
+def is_trading_day(market: str, day: Optional[date] = None) -> bool:
+    if market not in MARKET_SESSIONS:
+        return False
+    day = day or market_now(market).date()
+    return day.weekday() < 5 and day.strftime("%Y-%m-%d") not in _holiday_set(market)
+
+def is_market_open(market: str, now: Optional[datetime] = None) -> bool:
+    """是否处于交易时段：交易日 + 开盘时间内（不含午休）"""
+    if market not in MARKET_SESSIONS:
+        return False
+    spec = MARKET_SESSIONS[market]
+    now = now.astimezone(spec["tz"]) if now else market_now(market)
+    if not is_trading_day(market, now.date()):
+        return False
+    t = now.time().replace(tzinfo=None)
+    return any(start <= t <= end for start, end in spec["sessions"])
+
+def load_default_holidays(path: str = MARKET_HOLIDAYS_PATH) -> List[Dict[str, str]]:
+    """读取休市日 CSV，文件缺失时返回空列表"""
+    if not os.path.exists(path):
+        print(f"⚠️ Market holiday file not found: {path}")
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [
+            {"market": row["market"].strip().upper(), "date": row["date"].strip(), "name": (row.get("name") or "").strip() or None}
+            for row in csv.DictReader(f)
+            if row.get("market") and row.get("date")
+        ]
+
+def seed_default_holidays(session: Session):
+    """写入休市日文件中的港美股休市日，已存在的行保持不变（不提交）"""
+    rows = load_default_holidays()
+    if rows:
+        session.execute(insert(MarketHoliday).on_conflict_do_nothing(index_elements=["market", "date"]), rows)
+
+def check_calendar_coverage(session: Session, year: Optional[int] = None) -> List[str]:
+    """
+    返回今年没有任何休市日记录的市场并告警。
+    没有记录时节假日会被当作正常交易日轮询，需要更新 market_holidays.csv 或检查 A 股日历同步
+    """
+    year = year or date.today().year
+    covered = set(session.exec(
+        select(MarketHoliday.market).where(MarketHoliday.date.like(f"{year}-%")).distinct()
+    ).all())
+    missing = [market for market in MARKET_SESSIONS if market not in covered]
+    for market in missing:
+        print(f"🚨 No {market} holiday calendar for {year}: holidays will be treated as trading days. "
+              f"Add {year} rows to {MARKET_HOLIDAYS_PATH} or the marketholiday table.")
+    return missing
+
+def sync_cn_holidays(session: Session, years_ahead: int = 1):
+    """
+    A 股休市日：交易日历中缺失的工作日（不提交）
+    覆盖从今年年初到交易日历最后一天，最多到 years_ahead 年之后
+    """
+    with provider_slot("CN"):
+        df = ak.tool_trade_date_hist_sina()
+    trade_days = {str(d)[:10] for d in df["trade_date"]}
+    today = date.today()
+    day = date(today.year, 1, 1)
+    end = min(max(date.fromisoformat(d) for d in trade_days), date(today.year + years_ahead, 12, 31))
+    rows = []
+    while day <= end:
+        d_str = day.strftime("%Y-%m-%d")
+        if day.weekday() < 5 and d_str not in trade_days:
+            rows.append({"market": "CN", "date": d_str, "name": None})
+        day += timedelta(days=1)
+    if rows:
+        session.execute(insert(MarketHoliday).on_conflict_do_nothing(index_elements=["market", "date"]), rows)
+
+def refresh_trading_calendar():
+    """启动时及每周执行：写入休市日文件并同步 A 股交易日历，检查今年的日历是否完整"""
+    from database import engine
+    with Session(engine) as session:
+        seed_default_holidays(session)
+        session.commit()
+        try:
+            sync_cn_holidays(session)
+            session.commit()
+        except Exception as e:
+            print(f"⚠️ Error syncing CN trading calendar: {e}")
+            session.rollback()
+        check_calendar_coverage(session)
+    reload_holidays()
@@ -0,0 +1,106 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+_MISSING = object()
+
+class CacheFull(Exception):
+    """evict_live=False 的缓存已满且没有可清理的过期条目"""
+
+class TTLCache:
+    """
+    线程安全的 TTL + LRU 缓存：条目在 ttl 秒后过期，超过 max_entries 时淘汰最久未使用的条目。
+    evict_live=False 时只清理过期条目，仍然已满则 set/add 抛出 CacheFull（用于不能提前丢弃的一次性记录）。
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 1024, evict_live: bool = True):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.evict_live = evict_live
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+        self._full_until = 0.0  # evict_live=False：在此之前没有条目会过期，已满时无需再扫描
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        with self._lock:
+            self._make_room(key)
+            expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+            self._entries[key] = (value, expires_at)
+            self._full_until = min(self._full_until, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def add(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> bool:
+        """键不存在（或已过期）时写入，返回是否写入"""
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING and entry[1] > time.monotonic():
+                return False
+            self._make_room(key)
+            expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+            self._entries[key] = (value, expires_at)
+            self._full_until = min(self._full_until, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return True
+
+    def _make_room(self, key: Hashable):
+        """调用方持有 self._lock。evict_live=False 且已满时先清理过期条目，仍无空位则抛出 CacheFull"""
+        if self.evict_live or key in self._entries or len(self._entries) < self.max_entries:
+            return
+        now = time.monotonic()
+        if now >= self._full_until:
+            for expired in [k for k, (_, expires_at) in self._entries.items() if expires_at <= now]:
+                del self._entries[expired]
+            self._full_until = min((expires_at for _, expires_at in self._entries.values()), default=now)
+        if len(self._entries) >= self.max_entries:
+            raise CacheFull(f"{len(self._entries)} live entries (max {self.max_entries})")
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.pop(key, _MISSING)
+        return default if entry is _MISSING else entry[0]
+
+    def pop_if(self, key: Hashable, value: Any) -> bool:
+        """条目未过期且值等于 value 时删除，返回是否删除"""
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING or entry[1] <= time.monotonic() or entry[0] != value:
+                return False
+            del self._entries[key]
+            return True
+
+    def purge_expired(self) -> int:
+        """删除所有已过期的条目，返回删除数量"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, (_, expires_at) in self._entries.items() if expires_at <= now]
+            for key in expired:
+                del self._entries[key]
+        return len(expired)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
@@ -0,0 +1,195 @@
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert
+
+from models import TTLEntry
+from services.ttl_cache import CacheFull, TTLCache
+
+# 短期状态（验证码、已使用的 nonce）的存储后端：
+# sqlite —— 写入数据库中的 ttlentry 表，多个 uvicorn worker 共享；memory —— 仅当前进程可见
+TTL_STORE_BACKEND = os.getenv("TTL_STORE_BACKEND", "sqlite").lower()
+# 过期条目的清理间隔（秒），在写入时顺带执行
+TTL_STORE_SWEEP_SECONDS = float(os.getenv("TTL_STORE_SWEEP_SECONDS", "300"))
+# memory 后端每个命名空间的条目上限；未过期的条目不会被淘汰，已满时拒绝新写入（TTLStoreFull）
+TTL_STORE_MAX_ENTRIES = int(os.getenv("TTL_STORE_MAX_ENTRIES", "100000"))
+
+class TTLStoreFull(RuntimeError):
+    """存储已满，无法写入新条目；调用方应返回 503 而不是丢弃仍然有效的验证码或 nonce"""
+
+class TTLStore(ABC):
+    """
+    带过期时间的键值存储，按命名空间隔离。值需要可 JSON 序列化。
+    过期条目对读取不可见，并在写入时按 TTL_STORE_SWEEP_SECONDS 间隔批量清理。
+    """
+
+    def __init__(self, namespace: str, sweep_interval: float = TTL_STORE_SWEEP_SECONDS):
+        self.namespace = namespace
+        self.sweep_interval = sweep_interval
+        self._next_sweep = 0.0
+        self._sweep_lock = threading.Lock()
+
+    @abstractmethod
+    def get(self, key: str, default: Any = None) -> Any:
+        """返回未过期的值，不存在时返回 default"""
+
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl: float):
+        """写入或覆盖，ttl 秒后过期；存储已满时抛出 TTLStoreFull"""
+
+    @abstractmethod
+    def add(self, key: str, value: Any, ttl: float) -> bool:
+        """键不存在（或已过期）时写入，返回是否写入；用于一次性 nonce。存储已满时抛出 TTLStoreFull"""
+
+    @abstractmethod
+    def pop(self, key: str, default: Any = None) -> Any:
+        """删除并返回未过期的值，不存在时返回 default"""
+
+    @abstractmethod
+    def consume(self, key: str, value: Any) -> bool:
+        """条目未过期且值等于 value 时原子地删除，返回是否删除；用于一次性验证码"""
+
+    @abstractmethod
+    def sweep(self) -> int:
+        """删除已过期的条目，返回删除数量"""
+
+    def _maybe_sweep(self):
+        now = time.monotonic()
+        if now < self._next_sweep or not self._sweep_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_sweep = now + self.sweep_interval
+            self.sweep()
+        finally:
+            self._sweep_lock.release()
+
+class MemoryTTLStore(TTLStore):
+    def __init__(self, namespace: str, sweep_interval: float = TTL_STORE_SWEEP_SECONDS,
+                 max_entries: int = TTL_STORE_MAX_ENTRIES):
+        super().__init__(namespace, sweep_interval)
+        # 淘汰未过期的 nonce 会让 token 可以重放，因此满了只拒绝写入
+        self._cache = TTLCache(ttl=sweep_interval, max_entries=max_entries, evict_live=False)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self._cache.get(key, default)
+
+    def set(self, key: str, value: Any, ttl: float):
+        self._maybe_sweep()
+        try:
+            self._cache.set(key, value, ttl=ttl)
+        except CacheFull as e:
+            raise TTLStoreFull(f"TTL store '{self.namespace}' is full: {e}") from e
+
+    def add(self, key: str, value: Any, ttl: float) -> bool:
+        self._maybe_sweep()
+        try:
+            return self._cache.add(key, value, ttl=ttl)
+        except CacheFull as e:
+            raise TTLStoreFull(f"TTL store '{self.namespace}' is full: {e}") from e
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        # pop 不检查过期时间，这里先确认条目仍然有效
+        if key not in self._cache:
+            return default
+        return self._cache.pop(key, default)
+
+    def consume(self, key: str, value: Any) -> bool:
+        return self._cache.pop_if(key, value)
+
+    def sweep(self) -> int:
+        return self._cache.purge_expired()
+
+class SQLiteTTLStore(TTLStore):
+    """
+    基于 ttlentry 表的共享存储。过期时间使用 unix 时间戳，各 worker 读写同一个数据库文件；
+    add 用 INSERT ... ON CONFLICT DO UPDATE WHERE 已过期 ... RETURNING 实现原子的“不存在则写入”。
+    """
+
+    def __init__(self, namespace: str, sweep_interval: float = TTL_STORE_SWEEP_SECONDS, engine=None):
+        super().__init__(namespace, sweep_interval)
+        if engine is None:
+            from database import engine
+        self.engine = engine
+        self._table = TTLEntry.__table__
+
+    def _key_clause(self, key: str):
+        c = self._table.c
+        return (c.namespace == self.namespace) & (c.key == key)
+
+    def _upsert(self, key: str, value: Any, ttl: float):
+        stmt = insert(self._table).values(
+            namespace=self.namespace, key=key, value=json.dumps(value), expires_at=time.time() + ttl
+        )
+        return stmt, {"value": stmt.excluded.value, "expires_at": stmt.excluded.expires_at}
+
+    def get(self, key: str, default: Any = None) -> Any:
+        c = self._table.c
+        stmt = select(c.value).where(self._key_clause(key), c.expires_at > time.time())
+        with self.engine.connect() as conn:
+            value = conn.execute(stmt).scalar()
+        return default if value is None else json.loads(value)
+
+    def set(self, key: str, value: Any, ttl: float):
+        self._maybe_sweep()
+        stmt, updates = self._upsert(key, value, ttl)
+        stmt = stmt.on_conflict_do_update(index_elements=["namespace", "key"], set_=updates)
+        with self.engine.begin() as conn:
+            conn.execute(stmt)
+
+    def add(self, key: str, value: Any, ttl: float) -> bool:
+        self._maybe_sweep()
+        stmt, updates = self._upsert(key, value, ttl)
+        # 冲突时只覆盖已过期的旧条目；未写入时 RETURNING 不返回行
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["namespace", "key"], set_=updates,
+            where=self._table.c.expires_at <= time.time(),
+        ).returning(self._table.c.key)
+        with self.engine.begin() as conn:
+            return conn.execute(stmt).first() is not None
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        c = self._table.c
+        stmt = delete(self._table).where(self._key_clause(key)).returning(c.value, c.expires_at)
+        with self.engine.begin() as conn:
+            row = conn.execute(stmt).first()
+        if row is None or row.expires_at <= time.time():
+            return default
+        return json.loads(row.value)
+
+    def consume(self, key: str, value: Any) -> bool:
+        c = self._table.c
+        stmt = (
+            delete(self._table)
+            .where(self._key_clause(key), c.value == json.dumps(value), c.expires_at > time.time())
+            .returning(c.key)
+        )
+        with self.engine.begin() as conn:
+            return conn.execute(stmt).first() is not None
+
+    def sweep(self) -> int:
+        c = self._table.c
+        stmt = delete(self._table).where(c.namespace == self.namespace, c.expires_at <= time.time())
+        with self.engine.begin() as conn:
+            return conn.execute(stmt).rowcount
+
+_stores: Dict[str, TTLStore] = {}
+_stores_lock = threading.Lock()
+
+def get_ttl_store(namespace: str) -> TTLStore:
+    """按 TTL_STORE_BACKEND 返回命名空间对应的存储（同一命名空间复用同一实例）"""
+    with _stores_lock:
+        store = _stores.get(namespace)
+        if store is None:
+            if TTL_STORE_BACKEND == "memory":
+                store = MemoryTTLStore(namespace)
+            elif TTL_STORE_BACKEND == "sqlite":
+                store = SQLiteTTLStore(namespace)
+            else:
+                raise ValueError(f"Unknown TTL_STORE_BACKEND: {TTL_STORE_BACKEND}")
+            _stores[namespace] = store
+        return store
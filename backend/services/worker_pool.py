@@ -0,0 +1,31 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+class WorkerPoolBusy(Exception):
+    """线程池已满，调用方应返回 503"""
+
+class WorkerPool:
+    """
+    专用的有界线程池：与 anyio 的共享请求线程池隔离，慢任务不会占满普通接口的线程。
+    排队 + 执行中的任务超过 max_pending 时立即拒绝，而不是让延迟无限增长。
+    """
+
+    def __init__(self, name: str, workers: int, max_pending: int):
+        self.name = name
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(max(1, max_pending))
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        """在线程池中执行 fn(*args) 并等待结果；队列已满时抛出 WorkerPoolBusy"""
+        if not self._slots.acquire(blocking=False):
+            raise WorkerPoolBusy(f"{self.name} pool is full")
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # 任务结束时才归还名额：客户端断开取消等待时，已提交的任务仍计入队列深度
+        future.add_done_callback(lambda _: self._slots.release())
+        return await asyncio.wrap_future(future)
@@ -0,0 +1,91 @@
+"""
+Fixed-point ledger tests for services/fixed_point.py and the engines using it.
+
+Runs against an in-memory SQLite database, no server needed:
+    python test_fixed_point.py   (or: python -m pytest test_fixed_point.py)
+"""
+from pydantic import ValidationError
+from sqlalchemy import text
+from sqlalchemy.pool import StaticPool
+from sqlmodel import SQLModel, Session, create_engine, select
+from models import User, Stock, Transaction, TransactionCreate, TransactionUpdate, DailyQuote, DailyQuoteInput
+from services.analytics import PortfolioAnalyzer, build_timeline_columns
+from services.ledger import FifoLedger
+
+def _tx(tx_id, tx_type, day, price, quantity, fees=0.0):
+    return Transaction(id=tx_id, stock_id=1, type=tx_type, date=day, price=price, quantity=quantity, fees=fees)
+
+def test_round_trip():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+    values = [(0.1, 0.3, 0.07), (1234.567891, 0.001, 0.0), (19.99, 1e6, 12345.678901)]
+    with Session(engine) as session:
+        user = User(email="fixed@test.local", hashed_password="x")
+        session.add(user)
+        session.commit()
+        stock = Stock(user_id=user.id, symbol="000001", name="Test", market="CN")
+        session.add(stock)
+        session.commit()
+        for price, quantity, fees in values:
+            session.add(Transaction(stock_id=stock.id, type="BUY", date="2024-01-02", price=price, quantity=quantity, fees=fees))
+        session.commit()
+        raw = session.exec(text('SELECT price, quantity, fees FROM "transaction" ORDER BY id')).all()
+        assert raw[0] == (100_000, 300, 70_000) and all(isinstance(v, int) for row in raw for v in row)
+        session.expire_all()
+        loaded = [(tx.price, tx.quantity, tx.fees) for tx in session.exec(select(Transaction).order_by(Transaction.id)).all()]
+        assert loaded == values, loaded
+    print("✅ Prices, quantities and fees round-trip exactly through the database")
+
+def test_exact_ledger():
+    # 0.1 + 0.2 - 0.3 在 float 中不为 0，定点整数下卖光后数量和成本恰好为 0
+    txs = [
+        _tx(1, "BUY", "2024-01-02", 10.1, 0.1, 0.01),
+        _tx(2, "BUY", "2024-01-03", 10.2, 0.2, 0.01),
+        _tx(3, "SELL", "2024-01-04", 10.3, 0.3, 0.01),
+    ]
+    snapshot = PortfolioAnalyzer(txs, []).get_snapshot(10.3)
+    assert snapshot["holdings_qty"] == 0 and snapshot["total_cost"] == 0 and snapshot["market_value"] == 0
+    # 收入 3.09 - 0.01，成本 1.01 + 2.04 + 0.02
+    assert snapshot["realized_pnl"] == 0.01, snapshot["realized_pnl"]
+
+    quotes = [DailyQuote(stock_id=1, date=d, open=10, close=10.3, high=10, low=10, volume=0)
+              for d in ("2024-01-02", "2024-01-03", "2024-01-04", "2024-01-05")]
+    timeline = build_timeline_columns(txs, quotes)
+    assert timeline.qty[-1] == 0 and timeline.cost_basis[-1] == 0 and timeline.total_cost[-1] == 0
+    assert timeline.realized_pnl[-1] == 0.01 and timeline.total_pnl[-1] == 0.01
+
+    ledger = FifoLedger()
+    ledger.process_transactions(txs)
+    holdings = ledger.get_holdings()
+    assert holdings["quantity"] == 0 and holdings["total_cost"] == 0
+    assert holdings["total_fees"] == 0.03
+
+    # FIFO：0.1 股按 10.1、0.05 股按 10.2 出库
+    ledger = FifoLedger()
+    ledger.process_transactions(txs[:2])
+    assert ledger._process_sell(_tx(4, "SELL", "2024-01-05", 10.3, 0.15)) == 25_000
+    assert ledger.get_holdings()["quantity"] == 0.15
+    print("✅ Selling out leaves exactly zero quantity and cost")
+
+def test_rejects_over_precision():
+    body = dict(type="BUY", date="2024-01-02", price=1234.567891, quantity=0.001, fees=0.07)
+    assert TransactionCreate(**body).price == 1234.567891
+    assert TransactionUpdate(fees=None).fees is None
+    for field, value in [("price", 1.0000001), ("fees", 0.1234567), ("quantity", 1.0005)]:
+        for model in (TransactionCreate, TransactionUpdate):
+            try:
+                model(**{**body, field: value})
+                assert False, f"{model.__name__}.{field}={value} must be rejected, not rounded"
+            except ValidationError:
+                pass
+    try:
+        DailyQuoteInput(stock_id=1, date="2024-01-02", close=10.00000001)
+        assert False, "manual quote prices beyond 6 decimals must be rejected"
+    except ValidationError:
+        pass
+    print("✅ over-precision input rejected")
+
+if __name__ == "__main__":
+    test_round_trip()
+    test_exact_ledger()
+    test_rejects_over_precision()
@@ -0,0 +1,74 @@
+"""
+RSA key reload tests for services/crypto.py.
+
+Uses key files in a temporary directory, no server needed:
+    python test_key_reload.py   (or: python -m pytest test_key_reload.py)
+"""
+import os
+import signal
+import tempfile
+from Crypto.PublicKey import RSA
+import services.crypto as crypto
+
+def _write_pair(priv_path, pub_path):
+    key = RSA.generate(2048)
+    with open(priv_path, "wb") as f:
+        f.write(key.export_key())
+    with open(pub_path, "wb") as f:
+        f.write(key.publickey().export_key())
+    return key
+
+def test_reload_keys():
+    saved = (crypto.PRIVATE_KEY_PATH, crypto.PUBLIC_KEY_PATH, crypto._keyring)
+    saved_env = {k: os.environ.pop(k, None) for k in ("RSA_PRIVATE_KEY", "RSA_PUBLIC_KEY")}
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            priv_path = os.path.join(tmp, "private_key.pem")
+            pub_path = os.path.join(tmp, "public_key.pem")
+            crypto.PRIVATE_KEY_PATH, crypto.PUBLIC_KEY_PATH = priv_path, pub_path
+            first = _write_pair(priv_path, pub_path)
+            crypto._keyring = None
+            assert crypto.get_keyring().private_key == first
+
+            # 文件暂时缺失：reload 必须报错并保留旧密钥，不能生成新密钥对
+            os.remove(priv_path)
+            os.remove(pub_path)
+            try:
+                crypto.reload_keys()
+                assert False, "reload must fail when the key files are missing"
+            except RuntimeError:
+                pass
+            assert not os.path.exists(priv_path), "reload must not generate a new key pair"
+            assert crypto.get_keyring().private_key == first
+
+            # 公私钥不匹配
+            _write_pair(priv_path, pub_path)
+            other = RSA.generate(2048)
+            with open(pub_path, "wb") as f:
+                f.write(other.publickey().export_key())
+            try:
+                crypto.reload_keys()
+                assert False, "reload must reject a mismatched key pair"
+            except RuntimeError:
+                pass
+            assert crypto.get_keyring().private_key == first
+
+            # SIGHUP 触发轮换
+            second = _write_pair(priv_path, pub_path)
+            previous = signal.getsignal(signal.SIGHUP)
+            crypto.install_reload_signal_handler()
+            try:
+                os.kill(os.getpid(), signal.SIGHUP)
+            finally:
+                signal.signal(signal.SIGHUP, previous)
+            assert crypto.get_keyring().private_key == second
+    finally:
+        crypto.PRIVATE_KEY_PATH, crypto.PUBLIC_KEY_PATH, crypto._keyring = saved
+        for k, v in saved_env.items():
+            if v is not None:
+                os.environ[k] = v
+
+    print("✅ key reload tests passed")
+
+if __name__ == "__main__":
+    test_reload_keys()
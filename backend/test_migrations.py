@@ -0,0 +1,137 @@
+"""
+Migration chain tests for migrations/ (alembic).
+
+Builds throwaway SQLite files, no server needed:
+    python test_migrations.py   (or: python -m pytest test_migrations.py)
+"""
+import os
+import tempfile
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+from sqlalchemy import create_engine, inspect, text
+from sqlmodel import SQLModel, Session, select
+from models import Transaction
+from services.fixed_point import PRICE_SCALE
+from database import run_migrations, _alembic_config
+
+HEAD = "0005"
+
+def _engine(path):
+    return create_engine(f"sqlite:///{path}")
+
+def _downgrade(engine, revision):
+    from alembic import command
+    config = _alembic_config()
+    with engine.begin() as connection:
+        config.attributes["connection"] = connection
+        command.downgrade(config, revision)
+
+def _revision(conn):
+    return conn.execute(text("SELECT version_num FROM alembic_version")).scalar()
+
+def test_fresh_database_matches_models():
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = _engine(os.path.join(tmp, "fresh.db"))
+        run_migrations(engine)
+        with engine.connect() as conn:
+            assert _revision(conn) == HEAD
+            diffs = compare_metadata(MigrationContext.configure(conn), SQLModel.metadata)
+        assert not diffs, f"schema drift between migrations and models: {diffs}"
+        engine.dispose()
+    print("✅ Fresh database upgraded to head matches models.py")
+
+def test_legacy_database_upgrade():
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = _engine(os.path.join(tmp, "legacy.db"))
+        # 模拟引入迁移之前由 create_all 建出的 ledger.db：基线结构且没有 alembic_version 表
+        run_migrations(engine, "0001")
+        with engine.begin() as conn:
+            conn.execute(text("DROP TABLE alembic_version"))
+            conn.execute(text("INSERT INTO user (email, hashed_password, is_active, created_at) VALUES ('a@b.com', 'x', 1, '2024-01-01')"))
+            for symbol, market in (("600519", "CN"), ("aapl", "US"), ("600519", "CN")):
+                conn.execute(text("INSERT INTO stock (user_id, symbol, name, market, created_at) VALUES (1, :s, :s, :m, '2024-01-01')"),
+                             {"s": symbol, "m": market})
+            for stock_id in (1, 2, 3):
+                for day in range(1, 11):
+                    conn.execute(text(
+                        "INSERT INTO dailyquote (stock_id, date, open, close, high, low, volume, is_manual) "
+                        "VALUES (:sid, :d, 1, :c, 1, 1, 100, :manual)"
+                    ), {"sid": stock_id, "d": f"2024-01-{day:02d}", "c": 10 + day + stock_id, "manual": int(stock_id == 3 and day == 5)})
+            # 同一天重复写入的手动行情，以及同一 symbol 不同持仓的重复行情
+            conn.execute(text("INSERT INTO dailyquote (stock_id, date, open, close, high, low, volume, is_manual) VALUES (3, '2024-01-05', 1, 99, 1, 1, 0, 1)"))
+            conn.execute(text("INSERT INTO \"transaction\" (stock_id, type, date, price, quantity, fees) VALUES (1, 'BUY', '2024-01-02', 10.5, 100, 5)"))
+
+        run_migrations(engine)
+
+        with engine.connect() as conn:
+            assert _revision(conn) == HEAD
+            # 两个 600519 持仓共享一份行情，同一天保留最后写入的一行
+            assert conn.execute(text("SELECT COUNT(*) FROM marketquote")).scalar() == 20
+            assert conn.execute(text("SELECT close FROM marketquote WHERE symbol = '600519' AND date = '2024-01-01'")).scalar() == 14 * PRICE_SCALE
+            assert conn.execute(text("SELECT symbol FROM stock WHERE id = 2")).scalar() == "AAPL"
+            manual = conn.execute(text("SELECT stock_id, date, close FROM dailyquote")).all()
+            assert manual == [(3, "2024-01-05", 99 * PRICE_SCALE)], manual
+            # 金额和数量转为定点整数，读回模型时还原为原来的十进制值
+            assert conn.execute(text("SELECT price, quantity, fees FROM \"transaction\"")).all() == [(10_500_000, 100_000, 5_000_000)]
+            tx = Session(bind=conn).exec(select(Transaction)).one()
+            assert (tx.price, tx.quantity, tx.fees) == (10.5, 100.0, 5.0)
+            assert "close" in {c["name"] for c in inspect(conn).get_columns("assetsnapshot")}
+
+            indexes = {table: {ix["name"] for ix in inspect(conn).get_indexes(table)}
+                       for table in ("transaction", "assetsnapshot", "stock", "dailyquote")}
+            assert "ix_transaction_stock_id_date" in indexes["transaction"]
+            assert "ix_assetsnapshot_stock_id_date" in indexes["assetsnapshot"]
+            assert "ix_stock_market_symbol" in indexes["stock"]
+            assert indexes["dailyquote"] == {"ix_dailyquote_stock_id_date"}
+            assert not compare_metadata(MigrationContext.configure(conn), SQLModel.metadata)
+
+            # 热点查询走复合索引
+            plan = " ".join(str(r[-1]) for r in conn.execute(text(
+                "EXPLAIN QUERY PLAN SELECT * FROM \"transaction\" WHERE stock_id = 1 ORDER BY date"
+            )).all())
+            assert "ix_transaction_stock_id_date" in plan and "TEMP B-TREE" not in plan, plan
+
+        # 再次执行不做任何改动
+        run_migrations(engine)
+
+        # 降级到基线：共享行情复制回每个持仓，手动覆盖保留；再升级回来结果不变
+        _downgrade(engine, "0001")
+        with engine.connect() as conn:
+            assert _revision(conn) == "0001"
+            assert "marketquote" not in inspect(conn).get_table_names()
+            assert conn.execute(text("SELECT COUNT(*) FROM dailyquote")).scalar() == 30
+            assert conn.execute(text("SELECT close FROM dailyquote WHERE stock_id = 3 AND date = '2024-01-05'")).scalar() == 99
+            assert conn.execute(text("SELECT price FROM \"transaction\"")).scalar() == 10.5
+        run_migrations(engine)
+        with engine.connect() as conn:
+            assert _revision(conn) == HEAD
+            assert conn.execute(text("SELECT COUNT(*) FROM marketquote")).scalar() == 20
+            assert conn.execute(text("SELECT stock_id, date, close FROM dailyquote")).all() == [(3, "2024-01-05", 99 * PRICE_SCALE)]
+            assert not compare_metadata(MigrationContext.configure(conn), SQLModel.metadata)
+        engine.dispose()
+    print("✅ Legacy ledger.db upgraded to head with data preserved, and survives a downgrade round trip")
+
+def test_legacy_symbols_normalized_without_shared_quotes():
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = _engine(os.path.join(tmp, "legacy.db"))
+        run_migrations(engine, "0001")
+        with engine.begin() as conn:
+            conn.execute(text("DROP TABLE alembic_version"))
+            conn.execute(text("INSERT INTO user (email, hashed_password, is_active, created_at) VALUES ('a@b.com', 'x', 1, '2024-01-01')"))
+            for symbol, market in (("aapl", "US"), ("519", "CN")):
+                conn.execute(text("INSERT INTO stock (user_id, symbol, name, market, created_at) VALUES (1, :s, :s, :m, '2024-01-01')"),
+                             {"s": symbol, "m": market})
+            # 只有手动行情（没有需要迁入 marketquote 的行），另一只没有任何行情
+            conn.execute(text("INSERT INTO dailyquote (stock_id, date, open, close, high, low, volume, is_manual) VALUES (2, '2024-01-05', 1, 9, 1, 1, 0, 1)"))
+
+        run_migrations(engine)
+
+        with engine.connect() as conn:
+            assert conn.execute(text("SELECT symbol FROM stock ORDER BY id")).scalars().all() == ["AAPL", "000519"]
+        engine.dispose()
+    print("✅ Legacy stock symbols are canonicalized even without quotes to migrate")
+
+if __name__ == "__main__":
+    test_fresh_database_matches_models()
+    test_legacy_database_upgrade()
+    test_legacy_symbols_normalized_without_shared_quotes()
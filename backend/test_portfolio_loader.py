@@ -0,0 +1,71 @@
+"""
+Query-count regression test for services/portfolio_loader.py.
+
+Runs against an in-memory SQLite database, no server needed:
+    python test_portfolio_loader.py   (or: python -m pytest test_portfolio_loader.py)
+"""
+from sqlalchemy import event
+from sqlalchemy.pool import StaticPool
+from sqlmodel import SQLModel, Session, create_engine, select
+from models import User, Stock, Transaction, MarketQuote
+from services.analytics import PortfolioAnalyzer
+from services.portfolio_loader import load_positions
+from services.quote_store import load_quotes
+
+STOCK_COUNT = 150
+DAYS = 30
+
+def _seed(session: Session):
+    user = User(email="loader@test.local", hashed_password="x")
+    session.add(user)
+    session.commit()
+    session.refresh(user)
+
+    for i in range(STOCK_COUNT):
+        stock = Stock(user_id=user.id, symbol=f"{i:06d}", name=f"Stock {i}", market="CN")
+        session.add(stock)
+        session.commit()
+        session.refresh(stock)
+        for d in range(1, DAYS + 1):
+            session.add(MarketQuote(market="CN", symbol=stock.symbol, date=f"2024-01-{d:02d}", open=10, high=10, low=10,
+                                    close=10 + (i % 7) + d * 0.1, volume=100))
+        session.add(Transaction(stock_id=stock.id, type="BUY", date="2024-01-02", price=10, quantity=100 + i, fees=1))
+        session.add(Transaction(stock_id=stock.id, type="SELL", date="2024-01-15", price=12, quantity=50, fees=1))
+    session.commit()
+    return user
+
+def test_load_positions_query_count():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+    with Session(engine) as session:
+        user = _seed(session)
+        stocks = session.exec(select(Stock).where(Stock.user_id == user.id)).all()
+
+        # First load builds every snapshot; afterwards reads must be set-based
+        load_positions(session, stocks)
+        statements.clear()
+        positions = load_positions(session, stocks, recent=7)
+        query_count = len(statements)
+
+        assert query_count <= 3, f"expected <= 3 queries for {STOCK_COUNT} stocks, got {query_count}"
+
+        # Batched results must match a full per-stock replay
+        for stock in stocks:
+            txs = session.exec(select(Transaction).where(Transaction.stock_id == stock.id)).all()
+            quotes = load_quotes(session, stock)
+            analyzer = PortfolioAnalyzer(txs, quotes)
+            expected = analyzer.get_snapshot()
+            actual = positions[stock.id].get_snapshot()
+            assert abs(expected["total_pnl"] - actual["total_pnl"]) < 1e-9
+            assert abs(expected["holdings_qty"] - actual["holdings_qty"]) < 1e-9
+            expected_sparkline = [entry["total_pnl"] for entry in analyzer.get_timeline()[-7:]]
+            assert [row.total_pnl for row in positions[stock.id].snapshots] == expected_sparkline
+
+    print(f"✅ {STOCK_COUNT} stocks loaded with {query_count} queries")
+
+if __name__ == "__main__":
+    test_load_positions_query_count()
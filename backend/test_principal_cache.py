@@ -0,0 +1,91 @@
+"""
+Principal cache tests for services/auth.py.
+
+Runs against a throwaway SQLite file, no server needed:
+    python test_principal_cache.py   (or: python -m pytest test_principal_cache.py)
+"""
+import asyncio
+import os
+import tempfile
+from fastapi import HTTPException
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import SQLModel, Session, create_engine, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from models import User
+from services.auth import create_access_token, get_current_user, principal_cache
+
+async def _authenticate(async_engine, token):
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        return await get_current_user(token, session)
+
+def test_principal_cache():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "auth.db")
+        engine = create_engine(f"sqlite:///{path}")
+        async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+        SQLModel.metadata.create_all(engine)
+        with Session(engine) as session:
+            session.add(User(email="cache@test.local", hashed_password="x"))
+            session.commit()
+
+        statements = []
+        event.listen(async_engine.sync_engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+        principal_cache.clear()
+        token = create_access_token({"sub": "cache@test.local"})
+
+        async def scenario():
+            for _ in range(5):
+                assert (await _authenticate(async_engine, token)).email == "cache@test.local"
+            assert len(statements) == 1, "repeated requests with the same token should hit the cache"
+
+            # 改密码后缓存失效，下一次请求重新查询
+            with Session(engine) as session:
+                user = session.exec(select(User).where(User.email == "cache@test.local")).one()
+                user.hashed_password = "y"
+                session.add(user)
+                session.commit()
+            await _authenticate(async_engine, token)
+            assert len(statements) == 2
+
+            # 停用与鉴权并发：flush 之后、commit 之前的查询读到的仍是已提交的旧行，
+            # 这次结果即使被缓存，提交后也必须失效
+            with Session(engine) as session:
+                user = session.exec(select(User).where(User.email == "cache@test.local")).one()
+                user.is_active = False
+                session.add(user)
+                session.flush()
+                assert (await _authenticate(async_engine, token)).is_active, "lookup during the race sees the committed row"
+                session.commit()
+            try:
+                await _authenticate(async_engine, token)
+                raise AssertionError("principal cached during deactivation must be invalidated on commit")
+            except HTTPException as e:
+                assert e.status_code == 401
+
+            with Session(engine) as session:
+                user = session.exec(select(User).where(User.email == "cache@test.local")).one()
+                user.is_active = True
+                session.add(user)
+                session.commit()
+            await _authenticate(async_engine, token)
+
+            # 停用账号后 token 立即失效
+            with Session(engine) as session:
+                user = session.exec(select(User).where(User.email == "cache@test.local")).one()
+                user.is_active = False
+                session.add(user)
+                session.commit()
+            try:
+                await _authenticate(async_engine, token)
+                raise AssertionError("deactivated user must not authenticate")
+            except HTTPException as e:
+                assert e.status_code == 401
+            await async_engine.dispose()
+
+        asyncio.run(scenario())
+        engine.dispose()
+    print("✅ Principal cache skips repeat lookups and honours password reset / deactivation, including a concurrent deactivation")
+
+if __name__ == "__main__":
+    test_principal_cache()
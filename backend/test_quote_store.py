@@ -0,0 +1,70 @@
+"""
+Bulk upsert tests for services/quote_store.py.
+
+Runs against an in-memory SQLite database, no server needed:
+    python test_quote_store.py   (or: python -m pytest test_quote_store.py)
+"""
+from datetime import date, timedelta
+from sqlalchemy import event
+from sqlalchemy.pool import StaticPool
+from sqlmodel import SQLModel, Session, create_engine, select
+from models import User, Stock, MarketQuote, DailyQuote
+from services.quote_store import upsert_market_quotes, save_manual_quote, get_quote
+
+DAYS = 500
+
+def _bars(close: float):
+    start = date(2023, 1, 1)
+    return [
+        ("CN", "1", (start + timedelta(days=d)).strftime("%Y-%m-%d"),
+         {'open': close, 'high': close, 'low': close, 'close': close, 'volume': 100})
+        for d in range(DAYS)
+    ]
+
+def test_bulk_upsert():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+    with Session(engine) as session:
+        user = User(email="upsert@test.local", hashed_password="x")
+        session.add(user)
+        session.commit()
+        stock = Stock(user_id=user.id, symbol="000001", name="Test", market="CN")
+        session.add(stock)
+        session.commit()
+        session.refresh(stock)
+
+        statements.clear()
+        written = upsert_market_quotes(session, _bars(10.0))
+        session.commit()
+        assert len(written) == DAYS
+        inserts = [s for s in statements if s.lstrip().upper().startswith("INSERT")]
+        selects = [s for s in statements if s.lstrip().upper().startswith("SELECT")]
+        assert len(inserts) == 1 and not selects, f"expected one INSERT, got {len(inserts)} inserts / {len(selects)} selects"
+
+        # 回补不覆盖已有行情
+        assert upsert_market_quotes(session, _bars(11.0), overwrite=False) == []
+        # 调度器写入覆盖共享行情
+        assert len(upsert_market_quotes(session, _bars(12.0)[:5])) == 5
+        session.commit()
+        rows = session.exec(select(MarketQuote)).all()
+        assert len(rows) == DAYS
+        assert rows[0].symbol == "000001" and rows[0].close == 12.0 and rows[-1].close == 10.0
+
+        # 手动行情：同一天只有一行，共享行情写入不影响它
+        day = rows[0].date
+        save_manual_quote(session, stock.id, day, {'close': 20.0, 'open': 20.0, 'high': 20.0, 'low': 20.0, 'volume': 0})
+        save_manual_quote(session, stock.id, day, {'close': 21.0})
+        upsert_market_quotes(session, _bars(13.0)[:1])
+        session.commit()
+        manual = session.exec(select(DailyQuote).where(DailyQuote.stock_id == stock.id)).all()
+        assert len(manual) == 1 and manual[0].close == 21.0 and manual[0].open == 20.0
+        assert get_quote(session, stock, day).close == 21.0
+
+    print(f"✅ {DAYS} bars upserted with a single statement")
+
+if __name__ == "__main__":
+    test_bulk_upsert()
@@ -0,0 +1,89 @@
+"""
+Incremental snapshot rebuild tests for services/snapshots.py.
+
+Drives the transaction endpoints (insert / edit / move / delete, out of date order)
+against an in-memory SQLite database and checks after every step that the
+incrementally maintained AssetSnapshot rows equal a full replay:
+    python test_snapshots.py   (or: python -m pytest test_snapshots.py)
+"""
+import random
+from fastapi import BackgroundTasks
+from sqlalchemy.pool import StaticPool
+from sqlmodel import SQLModel, Session, create_engine, select
+from models import User, Stock, Transaction, MarketQuote, AssetSnapshot, SnapshotCheckpoint
+from routers.stocks import create_transaction
+from routers.transactions import update_transaction, delete_transaction
+from services.snapshots import refresh_snapshots
+
+DAYS = 20
+
+def _dates():
+    return [f"2024-01-{d:02d}" for d in range(1, DAYS + 1)]
+
+def _rows(session: Session, stock: Stock):
+    return [
+        (r.date, r.close, r.holdings_qty, r.cost_basis_fifo, r.total_cost, r.market_value, r.daily_pnl, r.total_pnl, r.realized_pnl)
+        for r in session.exec(select(AssetSnapshot).where(AssetSnapshot.stock_id == stock.id).order_by(AssetSnapshot.date)).all()
+    ]
+
+def _full_replay(session: Session, stock: Stock):
+    checkpoint = session.get(SnapshotCheckpoint, stock.id)
+    if checkpoint:
+        session.delete(checkpoint)
+        session.commit()
+    refresh_snapshots(session, [stock])
+    return _rows(session, stock)
+
+def test_incremental_rebuild_matches_full_replay():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+    rng = random.Random(7)
+
+    with Session(engine) as session:
+        user = User(email="snapshots@test.local", hashed_password="x")
+        session.add(user)
+        session.commit()
+        stocks = []
+        for symbol in ("600519", "000001"):
+            stock = Stock(user_id=user.id, symbol=symbol, name=symbol, market="CN")
+            session.add(stock)
+            session.commit()
+            stocks.append(stock)
+            for i, d in enumerate(_dates()):
+                session.add(MarketQuote(market="CN", symbol=symbol, date=d, open=10, high=12, low=9,
+                                        close=round(10 + rng.uniform(-1, 1) + i * 0.05, 2), volume=100))
+            session.add(Transaction(stock_id=stock.id, type="BUY", date="2024-01-01", price=10, quantity=1000, fees=5))
+        session.commit()
+        refresh_snapshots(session, stocks)
+
+        for step in range(40):
+            tx_ids = session.exec(select(Transaction.id)).all()
+            op = rng.choice(["insert", "insert", "edit", "move", "delete"]) if len(tx_ids) > 2 else "insert"
+            if op == "insert":
+                stock = rng.choice(stocks)
+                create_transaction(stock.id, Transaction(
+                    stock_id=stock.id, type=rng.choice(["BUY", "SELL"]), date=rng.choice(_dates()),
+                    price=round(rng.uniform(9, 12), 2), quantity=rng.choice([10, 20, 50]), fees=1,
+                ), BackgroundTasks(), current_user=user, session=session)
+            elif op == "edit":
+                tx = session.get(Transaction, rng.choice(tx_ids))
+                update = Transaction(stock_id=tx.stock_id, type=tx.type, date=rng.choice(_dates()),
+                                     price=round(rng.uniform(9, 12), 2), quantity=tx.quantity, fees=2)
+                update_transaction(tx.id, update, current_user=user, session=session)
+            elif op == "move":
+                tx = session.get(Transaction, rng.choice(tx_ids))
+                target = next(s for s in stocks if s.id != tx.stock_id)
+                update_transaction(tx.id, Transaction(stock_id=target.id, type=tx.type, date=tx.date,
+                                                      price=tx.price, quantity=tx.quantity, fees=tx.fees),
+                                   current_user=user, session=session)
+            else:
+                delete_transaction(rng.choice(tx_ids), current_user=user, session=session)
+
+            for stock in stocks:
+                incremental = _rows(session, stock)
+                assert incremental == _full_replay(session, stock), f"step {step} ({op}) diverged for {stock.symbol}"
+    engine.dispose()
+    print("✅ Incremental snapshot rebuilds match a full replay after out-of-order inserts, edits, moves and deletes")
+
+if __name__ == "__main__":
+    test_incremental_rebuild_matches_full_replay()
@@ -0,0 +1,80 @@
+"""
+TTL store tests for services/ttl_store.py (memory and shared SQLite backends).
+
+Runs against a throwaway SQLite file, no server needed:
+    python test_ttl_store.py   (or: python -m pytest test_ttl_store.py)
+"""
+import os
+import tempfile
+import time
+from sqlmodel import SQLModel, create_engine
+from services.ttl_store import MemoryTTLStore, SQLiteTTLStore, TTLStoreFull
+
+def _check_store(store):
+    store.set("a@test.local", "123456", ttl=60)
+    assert store.get("a@test.local") == "123456"
+    assert store.add("a@test.local", "654321", ttl=60) is False, "add must not overwrite a live entry"
+    assert store.consume("a@test.local", "000000") is False, "a wrong code must not consume the entry"
+    assert store.consume("a@test.local", "123456") is True
+    assert store.consume("a@test.local", "123456") is False, "a code can only be consumed once"
+    store.set("a@test.local", "123456", ttl=60)
+    assert store.pop("a@test.local") == "123456"
+    assert store.get("a@test.local") is None
+
+    store.set("expired", "x", ttl=0.05)
+    time.sleep(0.1)
+    assert store.get("expired") is None
+    assert store.add("expired", "y", ttl=60) is True, "add may reuse an expired key"
+    assert store.get("expired") == "y"
+
+    store.set("stale", "z", ttl=0.05)
+    time.sleep(0.1)
+    assert store.sweep() == 1
+
+def test_memory_store():
+    _check_store(MemoryTTLStore("test"))
+
+def test_memory_store_never_evicts_live_entries():
+    store = MemoryTTLStore("nonce", max_entries=3)
+    for i in range(3):
+        assert store.add(f"n-{i}", True, ttl=60) is True
+    # 已满：拒绝新写入，而不是挤掉仍然有效的 nonce（否则可以重放）
+    for call in (lambda: store.add("flood", True, ttl=60), lambda: store.set("flood", True, ttl=60)):
+        try:
+            call()
+            assert False, "a full store must reject new entries"
+        except TTLStoreFull:
+            pass
+    for i in range(3):
+        assert store.add(f"n-{i}", True, ttl=60) is False, "live nonces must survive a flood"
+    store.set("n-0", False, ttl=60)  # 覆盖已有的键不需要新空位
+
+    # 过期条目腾出空位
+    store.set("n-1", True, ttl=0.05)
+    time.sleep(0.1)
+    assert store.add("late", True, ttl=60) is True
+    assert store.get("n-0") is False and store.get("n-2") is True
+
+def test_sqlite_store_is_shared():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "ttl.db")
+        engine = create_engine(f"sqlite:///{path}")
+        SQLModel.metadata.create_all(engine)
+        _check_store(SQLiteTTLStore("test", engine=engine))
+
+        # 两个 worker 进程各自的引擎指向同一个文件
+        worker_a = SQLiteTTLStore("nonce", engine=engine)
+        worker_b = SQLiteTTLStore("nonce", engine=create_engine(f"sqlite:///{path}"))
+        assert worker_a.add("n-1", True, ttl=60) is True
+        assert worker_b.add("n-1", True, ttl=60) is False, "a nonce used on one worker is rejected on another"
+        worker_b.set("b@test.local", "111111", ttl=60)
+        assert worker_a.pop("b@test.local") == "111111"
+        assert SQLiteTTLStore("other", engine=engine).get("n-1") is None, "namespaces are isolated"
+        engine.dispose()
+        worker_b.engine.dispose()
+
+if __name__ == "__main__":
+    test_memory_store()
+    test_memory_store_never_evicts_live_entries()
+    test_sqlite_store_is_shared()
+    print("✅ TTL store tests passed")
@@ -0,0 +1,76 @@
+"""
+Verification code redemption tests for routers/users.py (register / reset-password).
+
+Runs against a throwaway SQLite file, no server needed:
+    python test_verification_codes.py   (or: python -m pytest test_verification_codes.py)
+"""
+import asyncio
+import base64
+import os
+import tempfile
+import threading
+from Crypto.Cipher import PKCS1_v1_5
+from Crypto.PublicKey import RSA
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import SQLModel, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+import routers.users as users
+from services.crypto import get_public_key
+from services.ttl_store import MemoryTTLStore
+from services.worker_pool import WorkerPool
+
+def _encrypt(password: str) -> str:
+    cipher = PKCS1_v1_5.new(RSA.import_key(get_public_key()))
+    return base64.b64encode(cipher.encrypt(password.encode())).decode()
+
+async def _register(async_engine, data):
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        return await users.register(data, session)
+
+async def _expect_status(coro, status_code):
+    try:
+        await coro
+        raise AssertionError(f"expected HTTP {status_code}")
+    except HTTPException as e:
+        assert e.status_code == status_code, e.detail
+
+def test_failed_register_keeps_code():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "codes.db")
+        engine = create_engine(f"sqlite:///{path}")
+        SQLModel.metadata.create_all(engine)
+        async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+        users.verification_codes = MemoryTTLStore("verification_code")
+        users.verification_codes.set("new@example.com", "123456", ttl=60)
+        data = users.UserRegister(email="new@example.com", password=_encrypt("secret"), code="123456")
+
+        async def scenario():
+            # 凭证线程池占满：返回 503，验证码不能被消耗
+            original_pool = users.credential_pool
+            release = threading.Event()
+            users.credential_pool = WorkerPool("credential-test", 1, 1)
+            blocker = asyncio.ensure_future(users.credential_pool.run(release.wait))
+            await asyncio.sleep(0.05)
+            try:
+                await _expect_status(_register(async_engine, data), 503)
+            finally:
+                release.set()
+                await blocker
+                users.credential_pool = original_pool
+
+            # 密码无法解密同样不消耗验证码
+            bad = users.UserRegister(email=data.email, password="bm90IHJzYQ==", code=data.code)
+            await _expect_status(_register(async_engine, bad), 400)
+
+            # 服务端建议的重试成功，验证码随后失效
+            assert (await _register(async_engine, data))["message"]
+            await _expect_status(_register(async_engine, data), 400)
+            await async_engine.dispose()
+
+        asyncio.run(scenario())
+        engine.dispose()
+    print("✅ Failed registrations keep the verification code, the successful retry consumes it")
+
+if __name__ == "__main__":
+    test_failed_register_keeps_code()